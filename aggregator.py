@@ -0,0 +1,394 @@
+import argparse
+import atexit
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import uuid
+
+from results_store import lock_file, unlock_file
+
+DEFAULT_PORT = 8765
+DEFAULT_BATCH_SIZE = 500
+# Time between two delivery attempts while the aggregator cannot be reached
+RETRY_INTERVAL = 5.0
+SOCKET_TIMEOUT = 30.0
+# How long a station process waits at exit for its spooled results to be delivered
+CLOSE_TIMEOUT = 2.0
+# Maximum number of station batches the aggregator writes in one transaction
+MAX_GROUP_BATCHES = 64
+SPOOL_FILE = 'spool.jsonl'
+STATE_FILE = 'state.json'
+
+# Delivering clients of this process, (spool dir, address) -> AggregatorClient
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def parse_address(address, default_host='localhost'):
+    # "host:port", "host" or ":port" -> (host, port)
+    host, separator, port = str(address).rpartition(':')
+    if not separator:
+        return address or default_host, DEFAULT_PORT
+    return host or default_host, int(port)
+
+
+def aggregator_options(config):
+    # The optional "aggregator" section of the test configuration, true or {"address": "host:port",
+    # "station_id": "...", "spool_dir": "...", "batch_size": 500}. Returns None when results are
+    # not sent to an aggregator.
+    options = config.options.get("aggregator")
+    if not options:
+        return None
+    if options is True:
+        options = {}
+    return options
+
+
+def aggregator_entry(result):
+    # What a station sends for a TestResult: the result file row, the data rate histogram and
+    # the SPC windows
+    return {'row': result.to_row(),
+            'histogram': result.histogram.to_dict() if result.histogram is not None else None,
+            'windows': result.spc['windows'] if result.spc is not None else None}
+
+
+class ResultSpool:
+    # On-disk queue of the results of a station that were not delivered yet. A result is appended
+    # and fsynced before the test goes on, so nothing is lost while the aggregator is slow or down,
+    # or when the station crashes. Every result gets the next sequence number of the spool's epoch,
+    # a random id made with the spool state, so numbers are never reused even if the state is lost.
+    # The aggregator stores the last sequence number per station and epoch together with the
+    # results and skips what it already has, so resending after a lost acknowledgement or a
+    # restart of the station delivers every result exactly once.
+    def __init__(self, spool_dir):
+        self.spool_dir = spool_dir
+        os.makedirs(spool_dir, exist_ok=True)
+        self.path = os.path.join(spool_dir, SPOOL_FILE)
+        self.state_path = os.path.join(spool_dir, STATE_FILE)
+
+    def append(self, entry):
+        # Queues a result entry and returns its sequence number
+        with open(self.path, 'a+b') as file:
+            lock_file(file)
+            try:
+                state = self._read_state()
+                seq = state['next_seq']
+                # The number is taken before the entry is written, a crash in between leaves a
+                # gap but never reuses a number
+                state['next_seq'] = seq + 1
+                self._write_state(state)
+                data = json.dumps({'epoch': state['epoch'], 'seq': seq, 'entry': entry}, default=str) + '\n'
+                size = file.seek(0, os.SEEK_END)
+                if size:
+                    file.seek(size - 1)
+                    if file.read(1) != b'\n':
+                        # Ends the line a crash cut short, it is skipped when read
+                        data = '\n' + data
+                file.write(data.encode('utf-8'))
+                file.flush()
+                os.fsync(file.fileno())
+            finally:
+                unlock_file(file)
+        return seq
+
+    def pending(self, limit=DEFAULT_BATCH_SIZE):
+        # Returns (epoch, entries) with up to `limit` undelivered entries of one epoch, oldest first.
+        # Every entry gets its "seq".
+        epoch, entries = None, []
+        with open(self.path, 'a+b') as file:
+            lock_file(file)
+            try:
+                file.seek(self._read_state()['offset'])
+                for line in file:
+                    if not line.endswith(b'\n') or len(entries) >= limit:
+                        break
+                    record = self._parse(line)
+                    if record is None:
+                        continue
+                    if epoch is None:
+                        epoch = record['epoch']
+                    elif record['epoch'] != epoch:
+                        break
+                    entries.append(dict(record['entry'], seq=record['seq']))
+            finally:
+                unlock_file(file)
+        return epoch, entries
+
+    def acknowledge(self, epoch, last_seq):
+        # Drops the entries the aggregator confirmed, the file is emptied once all are delivered
+        with open(self.path, 'a+b') as file:
+            lock_file(file)
+            try:
+                state = self._read_state()
+                file.seek(state['offset'])
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        break
+                    record = self._parse(line)
+                    if record is not None and (record['epoch'] != epoch or record['seq'] > last_seq):
+                        break
+                    state['offset'] += len(line)
+                if state['offset'] >= file.seek(0, os.SEEK_END):
+                    file.truncate(0)
+                    state['offset'] = 0
+                self._write_state(state)
+            finally:
+                unlock_file(file)
+
+    def _parse(self, line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def _read_state(self):
+        try:
+            with open(self.state_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            # New spool, or its state is lost: a new epoch starts and the whole spool is sent again
+            return {'epoch': uuid.uuid4().hex, 'next_seq': 1, 'offset': 0}
+
+    def _write_state(self, state):
+        # Replaced atomically, so it is either the old or the new state after a crash
+        temporary_path = self.state_path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.state_path)
+
+
+class AggregatorClient:
+    # Sends the spooled results of a station to the aggregator in batches from a background
+    # thread, so recording a result never waits for the network
+    def __init__(self, address, station_id, spool_dir, batch_size=DEFAULT_BATCH_SIZE):
+        self.address = parse_address(address)
+        self.station_id = station_id
+        self.spool = ResultSpool(spool_dir)
+        self.batch_size = int(batch_size)
+        self._connection = None
+        self._stream = None
+        self._failing = False
+        self._closing = False
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        # One client per spool and aggregator in a process, shared by all its tests. Returns None
+        # when the configuration does not name an aggregator.
+        options = aggregator_options(config)
+        if options is None:
+            return None
+        spool_dir = options.get("spool_dir") or os.path.join(os.path.dirname(config.test_result_path) or '.',
+                                                             'spool')
+        address = options.get("address", f"localhost:{DEFAULT_PORT}")
+        key = (os.path.abspath(spool_dir), address)
+        with _clients_lock:
+            if key not in _clients:
+                _clients[key] = cls(address, options.get("station_id") or socket.gethostname(), spool_dir,
+                                    options.get("batch_size", DEFAULT_BATCH_SIZE))
+            return _clients[key]
+
+    def submit(self, entry):
+        # Spools the entry and wakes up the sender, returns its sequence number
+        seq = self.spool.append(entry)
+        with self._lock:
+            if self._thread is None:
+                atexit.register(self.close)
+            if self._thread is None or not self._thread.is_alive():
+                # Also replaces a sender that died of an unexpected error
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return seq
+
+    def deliver(self):
+        # Sends everything spooled, returns True if the spool is empty afterwards
+        try:
+            while True:
+                epoch, entries = self.spool.pending(self.batch_size)
+                if not entries:
+                    break
+                last_seq = self._send(epoch, entries)
+                self.spool.acknowledge(epoch, last_seq)
+                if last_seq < entries[-1]['seq']:
+                    raise ValueError(f"the aggregator only confirmed up to {last_seq} of {entries[-1]['seq']}")
+            if self._failing:
+                print(f"Results are delivered to the aggregator at {self.address[0]}:{self.address[1]} again")
+            self._failing = False
+            return True
+        except (OSError, ValueError) as e:
+            self._disconnect()
+            if not self._failing:
+                print(f"An error occurred while sending results to the aggregator, they stay spooled "
+                      f"in {self.spool.spool_dir}: {e}")
+            self._failing = True
+            return False
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        # Gives the sender `timeout` seconds to deliver what is left, the rest is sent by the
+        # next process that uses the spool
+        self._closing = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(RETRY_INTERVAL)
+            self._wakeup.clear()
+            self.deliver()
+            if self._closing:
+                break
+        self._disconnect()
+
+    def _send(self, epoch, entries):
+        if self._connection is None:
+            self._connection = socket.create_connection(self.address, timeout=SOCKET_TIMEOUT)
+            self._stream = self._connection.makefile('rwb')
+        request = {'station_id': self.station_id, 'epoch': epoch, 'entries': entries}
+        self._stream.write(json.dumps(request, default=str).encode('utf-8') + b'\n')
+        self._stream.flush()
+        line = self._stream.readline()
+        if not line:
+            raise ConnectionError("the aggregator closed the connection")
+        # A malformed reply is a ValueError like a refused batch, the batch is sent again later
+        reply = json.loads(line)
+        if not isinstance(reply, dict):
+            raise ValueError(f"malformed reply from the aggregator: {line[:200]!r}")
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+        last_seq = reply.get('last_seq')
+        if not isinstance(last_seq, int) or isinstance(last_seq, bool):
+            raise ValueError(f"malformed reply from the aggregator: {line[:200]!r}")
+        return last_seq
+
+    def _disconnect(self):
+        if self._connection is None:
+            return
+        try:
+            self._stream.close()
+            self._connection.close()
+        except OSError:
+            pass
+        self._connection = None
+        self._stream = None
+
+
+class Delivery:
+    # A batch of one station waiting for the database writer of the aggregator
+    def __init__(self, station_id, epoch, entries):
+        self.station_id = station_id
+        self.epoch = epoch
+        self.entries = entries
+        self.last_seq = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class DeliveryHandler(socketserver.StreamRequestHandler):
+    # One station connection, a JSON request per line answered by {"last_seq": n} or {"error": "..."}
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                delivery = Delivery(str(request['station_id']), str(request['epoch']), request['entries'])
+                self.server.deliveries.put(delivery)
+                delivery.done.wait()
+                if delivery.error is not None:
+                    raise delivery.error
+                reply = {'last_seq': delivery.last_seq}
+            except Exception as e:
+                print(f"An error occurred while storing results from {self.client_address[0]}: {e}")
+                reply = {'error': str(e)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class AggregatorServer(socketserver.ThreadingTCPServer):
+    # Receives the results of many stations into one results database. Every connection has its
+    # own thread, a single writer thread stores the batches: the batches that arrive while it
+    # commits are written together in its next transaction, so the commit rate stays the same
+    # however many stations send.
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, database_path):
+        super().__init__(address, DeliveryHandler)
+        self.database_path = database_path
+        self.deliveries = queue.Queue()
+        self._writer_thread = threading.Thread(target=self._write_deliveries, daemon=True)
+        self._writer_thread.start()
+
+    def server_close(self):
+        super().server_close()
+        self.deliveries.put(None)
+        self._writer_thread.join()
+
+    def _write_deliveries(self):
+        # sqlite3 connections belong to the thread that made them
+        from results_db import ResultsDatabase
+        database = ResultsDatabase(self.database_path)
+        try:
+            stopping = False
+            while not stopping:
+                batch = [self.deliveries.get()]
+                while len(batch) < MAX_GROUP_BATCHES:
+                    try:
+                        batch.append(self.deliveries.get_nowait())
+                    except queue.Empty:
+                        break
+                stopping = None in batch
+                batch = [delivery for delivery in batch if delivery is not None]
+                try:
+                    last_seqs = database.insert_deliveries(
+                        [(delivery.station_id, delivery.epoch, delivery.entries) for delivery in batch])
+                    for delivery, last_seq in zip(batch, last_seqs):
+                        delivery.last_seq = last_seq
+                except Exception as e:
+                    for delivery in batch:
+                        delivery.error = e
+                for delivery in batch:
+                    delivery.done.set()
+        finally:
+            database.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Collect the test results of many stations into one results "
+                                                 "database, or deliver the spooled results of a station.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the aggregator")
+    serve_parser.add_argument("database", help="results database file (*.sqlite)")
+    serve_parser.add_argument("--listen", default=f"0.0.0.0:{DEFAULT_PORT}",
+                              help=f"address to listen on (default: 0.0.0.0:{DEFAULT_PORT})")
+    flush_parser = commands.add_parser("flush", help="deliver the spooled results of a station now")
+    flush_parser.add_argument("spool_dir", help="spool directory of the station")
+    flush_parser.add_argument("--address", default=f"localhost:{DEFAULT_PORT}", help="aggregator host:port")
+    flush_parser.add_argument("--station-id", default=socket.gethostname(), help="station id (default: host name)")
+    args = parser.parse_args(argv)
+
+    if args.command == "flush":
+        client = AggregatorClient(args.address, args.station_id, args.spool_dir)
+        return 0 if client.deliver() else 1
+    server = AggregatorServer(parse_address(args.listen, ''), args.database)
+    print(f"Aggregator listening on {server.server_address[0]}:{server.server_address[1]}, "
+          f"writing to {args.database}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
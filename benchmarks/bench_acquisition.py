@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from comserver import start_comserver_process, stop_comserver_process
+from comserver_reader import ComserverReader
+from test_engine import TestConfig, extract_value, run_test
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SIMULATOR = os.path.join(ROOT, 'comserver_simulator.py')
+RESULTS_FILE = os.path.join(ROOT, 'benchmarks', 'results', 'acquisition.jsonl')
+TIMESTAMP_PATTERN = re.compile(r'ts=(\d+\.\d+)')
+
+# Scenarios run by default: name -> simulator arguments
+SCENARIOS = {
+    'nominal_100hz': {'rate': 100},
+    'fast_10khz': {'rate': 10_000},
+    'flood_100khz': {'rate': 100_000},
+    'noisy_1khz': {'rate': 1_000, 'jitter': 0.5, 'duplicate-probability': 0.01, 'junk-probability': 0.01,
+                   'stall-probability': 0.0005, 'stall-duration': 0.2},
+}
+# Relative change of a metric that is reported as a regression by --compare
+REGRESSION_THRESHOLD = 0.10
+# Metrics where a higher value is better, all others are better when lower
+HIGHER_IS_BETTER = {'lines_per_second'}
+# Only every n-th line is checked for latency so the measurement stays cheap
+LATENCY_SAMPLE_EVERY = 10
+
+
+class MeasuringReader:
+    # Wraps a ComserverReader, counts lines, samples ingestion latency and keeps the lines
+    # for the accuracy check
+    def __init__(self, reader):
+        self.reader = reader
+        self.line_count = 0
+        self.latencies = []
+        self.lines = []
+
+    @property
+    def eof(self):
+        return self.reader.eof
+
+    def read_lines(self, timeout, until=None):
+        lines = self.reader.read_lines(timeout, until)
+        received = time.time()
+        for stream, line in lines[::LATENCY_SAMPLE_EVERY]:
+            match = TIMESTAMP_PATTERN.search(line)
+            if match:
+                self.latencies.append(received - float(match.group(1)))
+        self.line_count += len(lines)
+        self.lines.extend(line for stream, line in lines)
+        return lines
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def reference_statistics(lines):
+    # The original start_test computation: a list of every rx value and np.std at the end
+    import numpy as np
+
+    rx_value_list = []
+    previous_line = ''
+    for line in lines:
+        if previous_line != line and len(line) > 3:
+            previous_line = line
+            rx_value = extract_value(line)
+            if rx_value is not None:
+                rx_value_list.append(float(rx_value))
+    if not rx_value_list:
+        return 0.0, 0.0
+    return sum(rx_value_list) / len(rx_value_list), float(np.std(rx_value_list))
+
+
+def run_scenario(name, simulator_args, duration, warmup=0.5):
+    command = f'"{sys.executable}" "{SIMULATOR}" --seed 1 ' + ' '.join(
+        f'--{key} {value}' for key, value in simulator_args.items())
+    config = TestConfig(min_data_rate_limit=0, max_data_rate_limit=1e9, max_std_dev_limit=1e9,
+                        test_run_time=duration)
+    process = start_comserver_process(command)
+    reader = ComserverReader(process)
+    try:
+        # Let the simulator start and drop the banner
+        warmup_end = time.monotonic() + warmup
+        while time.monotonic() < warmup_end:
+            reader.read_lines(warmup_end - time.monotonic())
+        measuring_reader = MeasuringReader(reader)
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        result = run_test(config, name, measuring_reader)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+    finally:
+        reader.close()
+        stop_comserver_process(process)
+    reference_mean, reference_std_dev = reference_statistics(measuring_reader.lines)
+    latencies_ms = [latency * 1000 for latency in measuring_reader.latencies]
+    return {
+        'lines_per_second': measuring_reader.line_count / wall,
+        'samples': result.samples,
+        'cpu_percent': 100.0 * cpu / wall,
+        'peak_rss_mb': peak_rss_mb(),
+        'latency_p50_ms': percentile(latencies_ms, 0.5),
+        'latency_p99_ms': percentile(latencies_ms, 0.99),
+        'latency_max_ms': max(latencies_ms) if latencies_ms else None,
+        'mean_abs_error': abs(result.average_data_rate - reference_mean),
+        'std_dev_abs_error': abs(result.standard_deviation - reference_std_dev),
+        'mean_vs_simulator': result.average_data_rate - simulator_args.get('mean', 100.0),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(results_file):
+    if not os.path.exists(results_file):
+        return None
+    previous = None
+    with open(results_file) as file:
+        for line in file:
+            if line.strip():
+                previous = json.loads(line)
+    return previous
+
+
+def compare(previous, current):
+    # Prints the relative change of every metric and returns the number of regressions
+    regressions = 0
+    print(f"\nCompared with {previous.get('commit')} from {previous.get('time')}:")
+    for name, metrics in current['scenarios'].items():
+        old_metrics = previous['scenarios'].get(name)
+        if not old_metrics:
+            continue
+        for metric in ('lines_per_second', 'cpu_percent', 'peak_rss_mb', 'latency_p99_ms'):
+            old, new = old_metrics.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = 'REGRESSION' if worse > REGRESSION_THRESHOLD else ''
+            regressions += bool(flag)
+            print(f"  {name:16s} {metric:18s} {old:12.2f} -> {new:12.2f} ({change:+.1%}) {flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the acquisition pipeline against the COMSERVER "
+                                                 "simulator and store the results for comparison.")
+    parser.add_argument("--duration", type=int, default=3, help="test run time per scenario in seconds")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run, may be repeated (default: all)")
+    parser.add_argument("--results-file", default=RESULTS_FILE, help="JSON lines file the results are appended to")
+    parser.add_argument("--compare", action="store_true", help="compare with the previous stored run")
+    parser.add_argument("--no-store", action="store_true", help="do not store this run")
+    args = parser.parse_args(argv)
+
+    # NumPy is imported lazily by the engine, keep its import time out of the first scenario
+    import numpy  # noqa: F401
+
+    previous = load_previous(args.results_file) if args.compare else None
+    current = {'time': datetime.now().isoformat(), 'commit': git_commit(), 'python': platform.python_version(),
+               'platform': platform.platform(), 'duration': args.duration, 'scenarios': {}}
+    for name in args.scenario or SCENARIOS:
+        metrics = run_scenario(name, SCENARIOS[name], args.duration)
+        current['scenarios'][name] = metrics
+        print(f"{name:16s} " + ' '.join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                                         for key, value in metrics.items()))
+    if not args.no_store:
+        os.makedirs(os.path.dirname(args.results_file), exist_ok=True)
+        with open(args.results_file, 'a') as file:
+            file.write(json.dumps(current) + '\n')
+    if previous:
+        return 1 if compare(previous, current) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
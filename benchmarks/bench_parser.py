@@ -0,0 +1,66 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from line_parser import LineParser
+from test_engine import TestConfig, TestSession, extract_value
+
+# Minimum parser throughput required on one core
+REQUIRED_LINES_PER_SECOND = 100_000
+
+
+def make_chunk(line_count, junk_ratio=0.01, seed=1):
+    rng = random.Random(seed)
+    lines = []
+    for index in range(line_count):
+        if rng.random() < junk_ratio:
+            lines.append("WARNING: sensor link error, retrying")
+        else:
+            lines.append(f"[{index}] ts={index * 0.01:.3f} rx={rng.gauss(100, 2):.2f} MB/s "
+                         f"tx={rng.gauss(50, 1):.2f} MB/s pkt_err={rng.randrange(3)}")
+    return "\n".join(lines) + "\n"
+
+
+def best_time(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the COMSERVER line parser.")
+    parser.add_argument("--lines", type=int, default=200_000, help="lines per chunk")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case, the best one is reported")
+    parser.add_argument("--junk-ratio", type=float, default=0.01, help="fraction of non-sample lines")
+    args = parser.parse_args(argv)
+
+    chunk = make_chunk(args.lines, args.junk_ratio)
+    lines = chunk.splitlines(keepends=True)
+    line_parser = LineParser()
+    config = TestConfig(min_data_rate_limit=0, max_data_rate_limit=1000, max_std_dev_limit=100, test_run_time=1)
+
+    cases = {
+        'extract_value per line (old)': lambda: [extract_value(line) for line in lines],
+        'LineParser.parse_chunk': lambda: line_parser.parse_chunk(chunk),
+        'TestSession.feed_lines': lambda: TestSession(config, 'bench', parser=line_parser).feed_lines(lines),
+    }
+    ok = True
+    for name, function in cases.items():
+        lines_per_second = args.lines / best_time(function, args.repeat)
+        print(f"{name:32s} {lines_per_second:12,.0f} lines/s")
+        if name != 'extract_value per line (old)' and lines_per_second < REQUIRED_LINES_PER_SECOND:
+            ok = False
+    if not ok:
+        print(f"FAILED: below {REQUIRED_LINES_PER_SECOND:,} lines/s")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_acquisition import REGRESSION_THRESHOLD, git_commit, load_previous
+
+RESULTS_FILE = os.path.join(ROOT, 'benchmarks', 'results', 'startup.jsonl')
+# Lines of "python -X importtime": "import time: <self us> | <cumulative us> | <indent><module>"
+IMPORTTIME_PATTERN = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| \s*(\S+)')
+# Third-party and standard library modules worth tracking next to the modules of this repo
+TRACKED_MODULES = ('PyQt5.QtCore', 'PyQt5.QtGui', 'PyQt5.QtWidgets', 'numpy', 'sqlite3', 'statistics')
+# Timings compared by --compare, lower is better for all of them
+COMPARED_METRICS = ('first_window_seconds', 'import_seconds', 'preload_seconds')
+
+# Started in a fresh interpreter: shows the setup window and reports when it is first painted.
+# `spawn_time` is the wall clock time the parent started the interpreter.
+FIRST_WINDOW_SCRIPT = """
+import json, sys, time
+spawn_time = float(sys.argv[1])
+import_start = time.perf_counter()
+import user_interface_modified as gui
+from PyQt5.QtCore import QEvent, QObject, QTimer
+import_seconds = time.perf_counter() - import_start
+app = gui.QApplication(sys.argv[:1])
+report = {'import_seconds': import_seconds}
+
+class FirstPaint(QObject):
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint and 'first_window_seconds' not in report:
+            report['first_window_seconds'] = time.time() - spawn_time
+            QTimer.singleShot(0, finish)
+        return False
+
+def finish():
+    # The preload starts right after the first paint of the setup window
+    if not window.preload_thread:
+        QTimer.singleShot(1, finish)
+        return
+    window.preload_thread.join()
+    report['preload_seconds'] = time.time() - spawn_time - report['first_window_seconds']
+    print(json.dumps(report))
+    app.quit()
+
+first_paint = FirstPaint()
+app.installEventFilter(first_paint)
+window = gui.TestSetupWindow()
+app.exec_()
+"""
+
+
+def repo_modules():
+    return {name[:-3] for name in os.listdir(ROOT) if name.endswith('.py')}
+
+
+def child_environment(qt_platform):
+    environment = dict(os.environ)
+    if qt_platform:
+        environment['QT_QPA_PLATFORM'] = qt_platform
+    return environment
+
+
+def measure_first_window(qt_platform):
+    output = subprocess.check_output([sys.executable, '-c', FIRST_WINDOW_SCRIPT, repr(time.time())], cwd=ROOT,
+                                     env=child_environment(qt_platform), text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_costs(statement, qt_platform):
+    # Cumulative import time in seconds of the modules of this repo and TRACKED_MODULES,
+    # measured with "python -X importtime" in a fresh interpreter
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=ROOT,
+                             env=child_environment(qt_platform), capture_output=True, text=True, check=True)
+    tracked = repo_modules().union(TRACKED_MODULES)
+    costs = {}
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if match and match.group(3) in tracked:
+            costs[match.group(3)] = int(match.group(2)) / 1e6
+    return dict(sorted(costs.items(), key=lambda item: -item[1]))
+
+
+def compare(previous, current):
+    # Prints the relative change of every timing and returns the number of regressions
+    regressions = 0
+    print(f"\nCompared with {previous.get('commit')} from {previous.get('time')}:")
+    for metric in COMPARED_METRICS:
+        old, new = previous.get(metric), current.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        flag = 'REGRESSION' if change > REGRESSION_THRESHOLD else ''
+        regressions += bool(flag)
+        print(f"  {metric:22s} {old:10.3f} -> {new:10.3f} ({change:+.1%}) {flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the time to the first window of the test GUI and the "
+                                                 "import cost of its modules, and store the results for comparison.")
+    parser.add_argument("--repeat", type=int, default=5, help="number of cold starts, the median is reported")
+    parser.add_argument("--platform", default='offscreen',
+                        help="Qt platform plugin of the measured GUI, empty for the default (default: offscreen)")
+    parser.add_argument("--results-file", default=RESULTS_FILE, help="JSON lines file the results are appended to")
+    parser.add_argument("--compare", action="store_true", help="compare with the previous stored run")
+    parser.add_argument("--no-store", action="store_true", help="do not store this run")
+    args = parser.parse_args(argv)
+
+    previous = load_previous(args.results_file) if args.compare else None
+    runs = [measure_first_window(args.platform) for _ in range(args.repeat)]
+    current = {'time': datetime.now().isoformat(), 'commit': git_commit(), 'python': platform.python_version(),
+               'platform': platform.platform(), 'repeat': args.repeat}
+    for metric in COMPARED_METRICS:
+        current[metric] = statistics.median(run[metric] for run in runs)
+    # What the setup window waits for, and what the background preload adds afterwards
+    current['startup_imports'] = import_costs("import user_interface_modified", args.platform)
+    # importlib.import_module() is not logged by -X importtime, so the preloaded modules are
+    # imported with an import statement here
+    from user_interface_modified import PRELOAD_MODULES
+    current['preload_imports'] = import_costs("import user_interface_modified, " + ", ".join(PRELOAD_MODULES),
+                                              args.platform)
+    for metric in COMPARED_METRICS:
+        print(f"{metric:22s} {current[metric]:.3f} s")
+    for name in ('startup_imports', 'preload_imports'):
+        print(f"\n{name}:")
+        for module, seconds in current[name].items():
+            print(f"  {module:24s} {seconds * 1000:8.1f} ms")
+    if not args.no_store:
+        os.makedirs(os.path.dirname(args.results_file), exist_ok=True)
+        with open(args.results_file, 'a') as file:
+            file.write(json.dumps(current) + '\n')
+    if previous:
+        return 1 if compare(previous, current) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Defaults of the "checkpoint" configuration option
+DEFAULT_INTERVAL = 10.0
+# Checkpoints may use at most this share of the CPU time the acquisition used since they
+# started, a checkpoint that is due waits until the acquisition has caught up
+MAX_CPU_SHARE = 0.01
+CHECKPOINT_SUFFIX = '.checkpoint'
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_options(config):
+    # The optional "checkpoint" section of the test configuration, true or
+    # {"checkpoint_dir": "...", "interval": 10.0}. Returns None when checkpoints are off.
+    options = config.options.get("checkpoint")
+    if not options:
+        return None
+    if options is True:
+        options = {}
+    return options
+
+
+def checkpoint_dir(config):
+    # Next to the result file by default, like the sample files
+    options = checkpoint_options(config) or {}
+    return options.get("checkpoint_dir") or os.path.join(os.path.dirname(config.test_result_path) or '.',
+                                                         'checkpoints')
+
+
+def checkpoint_path(directory, serial_number, start_time):
+    safe_serial = ''.join(c if c.isalnum() or c in '-_' else '_' for c in serial_number)
+    return os.path.join(directory, f"{safe_serial}_{start_time:%Y%m%d_%H%M%S_%f}{CHECKPOINT_SUFFIX}")
+
+
+def write_atomically(path, data):
+    # The file is replaced in one step, so it holds either the old or the new checkpoint after a crash
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+def encode_state(state):
+    # The checkpoint file contents of a TestSession.checkpoint_state(). Parts that grow with the
+    # test run time are handed over unencoded (spc.WindowSnapshot) and encoded here.
+    def deferred(value):
+        if hasattr(value, 'to_json'):
+            return value.to_json()
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+    return json.dumps(state, default=deferred).encode('utf-8')
+
+
+def load_checkpoint(path):
+    with open(path, encoding='utf-8') as file:
+        state = json.load(file)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} is not a checkpoint of this version")
+    return state
+
+
+def interrupted_tests(directory, serial_number=None):
+    # (path, state) of the checkpoints in `directory`, i.e. tests that did not end normally, oldest first
+    tests = []
+    for path in sorted(glob.glob(os.path.join(glob.escape(directory), '*' + CHECKPOINT_SUFFIX))):
+        try:
+            state = load_checkpoint(path)
+        except (OSError, ValueError) as e:
+            print(f"An error occurred while reading the checkpoint {path}: {e}")
+            continue
+        if serial_number is None or state['serial_number'] == serial_number:
+            tests.append((path, state))
+    return sorted(tests, key=lambda test: test[1]['start_time'])
+
+
+class Checkpointer:
+    # Saves the state of a running TestSession to its checkpoint file. The acquisition loop asks
+    # for a checkpoint after every read; when one is due the session state is copied there (a
+    # few small dicts and references to the growing arrays) and encoded and written by a
+    # background thread, so the loop never waits for the disk. The CPU time spent on checkpoints
+    # is kept below MAX_CPU_SHARE of the CPU time of the acquisition, i.e. of the process
+    # without the checkpoints, so the interval stretches when encoding a checkpoint is expensive.
+    def __init__(self, path, interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.interval = float(interval)
+        self.checkpoints = 0
+        self.cpu_seconds = 0.0  # Copying in the acquisition loop plus encoding in the writer thread
+        self._start_cpu = time.process_time()
+        self._next_time = 0.0
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._write_checkpoints, daemon=True)
+        self._thread.start()
+
+    def maybe_save(self, session):
+        now = time.monotonic()
+        if now < self._next_time:
+            return
+        with self._condition:
+            cpu_seconds = self.cpu_seconds
+        acquisition_cpu_seconds = time.process_time() - self._start_cpu - cpu_seconds
+        if cpu_seconds > MAX_CPU_SHARE * acquisition_cpu_seconds:
+            return
+        self._next_time = now + self.interval
+        self.save(session)
+
+    def save(self, session):
+        copy_start = time.thread_time()
+        state = session.checkpoint_state()
+        state.update(version=CHECKPOINT_VERSION, checkpoint_time=datetime.now().isoformat())
+        with self._condition:
+            self.cpu_seconds += time.thread_time() - copy_start
+            # Only the latest state matters if the writer is behind
+            self._pending = state
+            self.checkpoints += 1
+            self._condition.notify()
+
+    def close(self):
+        # Waits for the last checkpoint to be written, the file stays until the result is saved
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _write_checkpoints(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                state, self._pending = self._pending, None
+                if state is None:
+                    return
+            write_start = time.thread_time()
+            try:
+                write_atomically(self.path, encode_state(state))
+            except (OSError, ValueError) as e:
+                print(f"An error occurred while writing the checkpoint {self.path}: {e}")
+            with self._condition:
+                self.cpu_seconds += time.thread_time() - write_start
+
+
+def start_checkpoint(session):
+    # Starts the checkpoints of a session if the configuration enables them, otherwise returns
+    # None. A resumed session keeps its checkpoint file.
+    options = checkpoint_options(session.config)
+    if options is None:
+        return None
+    directory = checkpoint_dir(session.config)
+    os.makedirs(directory, exist_ok=True)
+    checkpointer = Checkpointer(checkpoint_path(directory, session.serial_number, session.start_time),
+                                options.get("interval", DEFAULT_INTERVAL))
+    # The first checkpoint records that the unit is being tested
+    checkpointer.save(session)
+    return checkpointer
+
+
+def discard_checkpoint(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def finalize_checkpoint(path, save=True):
+    # Turns an interrupted test into a result with what it measured until its last checkpoint
+    # and records it like a normal result. Returns the TestResult.
+    from test_engine import STOP_COMPLETED, STOP_INTERRUPTED, TestSession, record_result
+    state = load_checkpoint(path)
+    session = TestSession.from_checkpoint(state)
+    complete = session.elapsed >= session.config.test_run_time
+    result = session.finish(STOP_COMPLETED if complete else STOP_INTERRUPTED)
+    result.checkpoint_path = path
+    if save:
+        record_result(session.config, result)
+    else:
+        result.discard_checkpoint()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List, finalize or discard the checkpoints of interrupted tests. "
+                                                 "Interrupted tests are resumed with headless_runner.py --resume "
+                                                 "or from the test window.")
+    parser.add_argument("command", choices=("list", "finalize", "discard"))
+    parser.add_argument("checkpoint_dir", help="checkpoint directory (\"checkpoint_dir\" of the configuration)")
+    parser.add_argument("--serial", help="only the tests of this serial number")
+    parser.add_argument("--no-save", action="store_true", help="finalize without saving the results")
+    args = parser.parse_args(argv)
+    for path, state in interrupted_tests(args.checkpoint_dir, args.serial):
+        if args.command == "list":
+            print(json.dumps({'checkpoint': path, 'serial_number': state['serial_number'],
+                              'start_time': state['start_time'], 'elapsed': state['elapsed'],
+                              'test_run_time': state['config'].get('test_run_time'),
+                              'samples': state['rx_stats']['count'], 'errors': state['errors'],
+                              'checkpoint_time': state['checkpoint_time']}))
+        elif args.command == "finalize":
+            result = finalize_checkpoint(path, not args.no_save)
+            print(json.dumps(result.to_dict()), flush=True)
+        else:
+            discard_checkpoint(path)
+            print(f"Discarded {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+# Time between two checks whether a terminated process group is gone
+GROUP_POLL_INTERVAL = 0.05
+
+
+def start_comserver_process(command):
+    # Runs the COMSERVER command line (usually a .bat file) with both output pipes captured.
+    # The shell gets its own process group (session on POSIX), so stop_comserver_process can
+    # tear down COMSERVER and every child it started together.
+    if sys.platform == 'win32':
+        group_options = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        group_options = {'start_new_session': True}
+    return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, text=True,
+                            universal_newlines=True, **group_options)
+
+
+def stop_comserver_process(process, timeout=5):
+    # Asks the whole process group to terminate and kills it after `timeout` seconds
+    if process is None:
+        return
+    if sys.platform == 'win32':
+        if process.poll() is not None:
+            return
+        try:
+            # Terminate the shell and every child it started
+            subprocess.check_call(["taskkill", "/F", "/T", "/PID", str(process.pid)])
+        except Exception as e:
+            print(f"An error occurred while terminating the COMSERVER process gracefully: {e}")
+            try:
+                # If taskkill fails, try sending a CTRL_BREAK_EVENT to stop the process group
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+                # Wait for the process to terminate
+                process.wait(timeout)
+            except Exception as e:
+                print(f"An error occurred while forcefully terminating the COMSERVER process: {e}")
+        return
+    # The shell may already be gone while its children still hold the serial port, so the
+    # group is signalled even if the process itself has exited
+    process_group = process.pid
+    if not _signal_group(process_group, signal.SIGTERM):
+        process.poll()
+        return
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        process.poll()
+        if not _signal_group(process_group, 0):
+            return
+        time.sleep(GROUP_POLL_INTERVAL)
+    _signal_group(process_group, signal.SIGKILL)
+    process.wait()
+    # The children die asynchronously, a restarted COMSERVER must find the serial port free
+    deadline = time.monotonic() + timeout
+    while _signal_group(process_group, 0) and time.monotonic() < deadline:
+        time.sleep(GROUP_POLL_INTERVAL)
+
+
+def _signal_group(process_group, signal_number):
+    # Returns False if the process group does not exist (any more)
+    try:
+        os.killpg(process_group, signal_number)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Only zombies are left, they disappear once reaped
+        return False
+    return True
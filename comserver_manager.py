@@ -0,0 +1,129 @@
+import threading
+import time
+
+from comserver import start_comserver_process, stop_comserver_process
+from comserver_reader import ComserverReader, LineDemultiplexer
+
+# Minimum time between two automatic restarts of a crashed COMSERVER, stops restart loops
+RESTART_DELAY = 2.0
+
+
+class ComserverInstance:
+    # A running COMSERVER process with the demultiplexer reading its pipes
+    def __init__(self, command):
+        self.command = command
+        self.spawn_time = time.monotonic()
+        self.start_time = self.spawn_time  # When start() handed the instance out
+        self.process = start_comserver_process(command)
+        self.demux = LineDemultiplexer(ComserverReader(self.process))
+
+    @property
+    def alive(self):
+        return self.process.poll() is None and not self.demux.eof
+
+    @property
+    def spawn_to_first_line(self):
+        # Seconds from the spawn to the first output line, None until it arrived
+        if self.demux.first_line_time is None:
+            return None
+        return self.demux.first_line_time - self.spawn_time
+
+    @property
+    def start_to_first_line(self):
+        # Seconds the user waited for the first line after start(), near 0 for a warm standby
+        if self.demux.first_line_time is None:
+            return None
+        return max(self.demux.first_line_time - self.start_time, 0.0)
+
+    def stop(self):
+        self.demux.close()
+        stop_comserver_process(self.process)
+
+
+class ComserverManager:
+    # Owns the COMSERVER process of one station. start() returns the running instance,
+    # stop() tears its whole process group down. With warm_standby, a new instance is
+    # spawned right after every stop so the next start() does not wait for COMSERVER to
+    # come up; only one instance runs at a time because COMSERVER holds the serial port.
+    # With auto_restart, ensure_running() replaces a crashed instance.
+    def __init__(self, command, warm_standby=False, auto_restart=True, restart_delay=RESTART_DELAY):
+        self.command = command
+        self.warm_standby = warm_standby
+        self.auto_restart = auto_restart
+        self.restart_delay = restart_delay
+        self.active = None
+        self.standby = None
+        self.spawns = 0
+        self.restarts = 0
+        self.standby_starts = 0
+        self._last_restart = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        # Uses the optional "comserver_manager" section of the test configuration:
+        # {"warm_standby": false, "auto_restart": true, "restart_delay": 2.0}
+        options = config.options.get("comserver_manager", {})
+        return cls(config.comserver_path, options.get("warm_standby", False), options.get("auto_restart", True),
+                   options.get("restart_delay", RESTART_DELAY))
+
+    def start(self):
+        with self._lock:
+            if self.active is not None and self.active.alive:
+                return self.active
+            if self.active is not None:
+                self.active.stop()
+            if self.standby is not None and self.standby.alive:
+                self.active, self.standby = self.standby, None
+                self.active.start_time = time.monotonic()
+                self.standby_starts += 1
+            else:
+                self._discard_standby()
+                self.active = self._spawn()
+            return self.active
+
+    def stop(self):
+        with self._lock:
+            if self.active is not None:
+                self.active.stop()
+                self.active = None
+            if self.warm_standby and self.standby is None:
+                self.standby = self._spawn()
+
+    def ensure_running(self):
+        # Restarts a crashed active instance, returns True if it did
+        with self._lock:
+            if self.active is None or self.active.alive or not self.auto_restart:
+                return False
+            now = time.monotonic()
+            if self._last_restart is not None and now - self._last_restart < self.restart_delay:
+                return False
+            self._last_restart = now
+            self.active.stop()
+            self.active = self._spawn()
+            self.restarts += 1
+            return True
+
+    def shutdown(self):
+        # Stops every instance, including the standby
+        with self._lock:
+            if self.active is not None:
+                self.active.stop()
+                self.active = None
+            self._discard_standby()
+
+    def metrics(self):
+        active = self.active
+        return {'spawns': self.spawns, 'restarts': self.restarts, 'standby_starts': self.standby_starts,
+                'standby_ready': self.standby is not None and self.standby.alive,
+                'spawn_to_first_line': active.spawn_to_first_line if active is not None else None,
+                'start_to_first_line': active.start_to_first_line if active is not None else None}
+
+    def _spawn(self):
+        self.spawns += 1
+        return ComserverInstance(self.command)
+
+    def _discard_standby(self):
+        if self.standby is not None:
+            self.standby.stop()
+            self.standby = None
@@ -0,0 +1,396 @@
+import locale
+import os
+import queue
+import selectors
+import sys
+import threading
+import time
+from collections import deque
+
+# Size of a single os.read() on a COMSERVER pipe
+READ_CHUNK_SIZE = 64 * 1024
+# Time the demultiplexer thread waits for pipe data before checking whether it should stop
+DEMUX_POLL_INTERVAL = 0.1
+# Default number of lines a subscription queues before it blocks (or drops, if lossy)
+SUBSCRIPTION_QUEUE_SIZE = 100_000
+
+
+class LineSplitter:
+    # Turns raw pipe chunks into text lines, keeping partial lines between chunks.
+    # Lines are returned with a trailing "\n" like readline() in universal newlines mode.
+    def __init__(self, encoding=None):
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self._pending = b''
+
+    def feed(self, data):
+        data = self._pending + data
+        # A trailing "\r" may be the first half of a "\r\n" split across two chunks
+        if data.endswith(b'\r'):
+            data, self._pending = data[:-1], b'\r'
+        else:
+            self._pending = b''
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        parts = data.split(b'\n')
+        self._pending = parts.pop() + self._pending
+        return [self._decode(part) for part in parts]
+
+    def flush(self):
+        # Called at EOF to return whatever is left of an unterminated last line
+        data = self._pending.rstrip(b'\r')
+        self._pending = b''
+        if not data:
+            return []
+        return [self._decode(data)]
+
+    @property
+    def pending(self):
+        # Raw bytes of the unterminated line received so far
+        return self._pending
+
+    def _decode(self, raw):
+        return raw.decode(self.encoding, errors='replace') + '\n'
+
+
+class PipeReactor:
+    # Waits on several pipes at once and returns chunks as soon as any of them is readable.
+    # POSIX uses a selector on the raw file descriptors. Windows cannot select() on pipes,
+    # so there every pipe gets a blocking reader thread that hands chunks over a queue.
+    def __init__(self, chunk_size=READ_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._use_threads = sys.platform == 'win32'
+        self._selector = None if self._use_threads else selectors.DefaultSelector()
+        self._chunks = queue.Queue()
+        self._open_pipes = 0
+
+    @property
+    def active(self):
+        return self._open_pipes > 0
+
+    def register(self, pipe, key):
+        fd = pipe.fileno()
+        self._open_pipes += 1
+        if self._use_threads:
+            reader_thread = threading.Thread(target=self._read_blocking, args=(fd, key), daemon=True)
+            reader_thread.start()
+        else:
+            os.set_blocking(fd, False)
+            self._selector.register(fd, selectors.EVENT_READ, key)
+
+    def poll(self, timeout):
+        # Returns a list of (key, data); empty data means the pipe reached EOF
+        if not self.active:
+            return []
+        if self._use_threads:
+            return self._poll_queue(timeout)
+        return self._poll_selector(timeout)
+
+    def close(self):
+        if self._selector is not None:
+            self._selector.close()
+        self._open_pipes = 0
+
+    def _poll_selector(self, timeout):
+        chunks = []
+        for selector_key, _ in self._selector.select(timeout):
+            try:
+                data = os.read(selector_key.fd, self.chunk_size)
+            except BlockingIOError:
+                continue
+            except OSError:
+                data = b''
+            if not data:
+                self._selector.unregister(selector_key.fd)
+                self._open_pipes -= 1
+            chunks.append((selector_key.data, data))
+        return chunks
+
+    def _poll_queue(self, timeout):
+        chunks = []
+        try:
+            chunks.append(self._chunks.get(timeout=timeout))
+            while True:
+                chunks.append(self._chunks.get_nowait())
+        except queue.Empty:
+            pass
+        for _, data in chunks:
+            if not data:
+                self._open_pipes -= 1
+        return chunks
+
+    def _read_blocking(self, fd, key):
+        while True:
+            try:
+                data = os.read(fd, self.chunk_size)
+            except OSError:
+                data = b''
+            self._chunks.put((key, data))
+            if not data:
+                return
+
+
+class ComserverReader:
+    # Event-driven reader for the stdout/stderr pipes of one COMSERVER process
+    def __init__(self, process, encoding=None):
+        self.reactor = PipeReactor()
+        self._splitters = {}
+        self._lock = threading.Lock()
+        self.capture = None  # Optional stream_capture.CaptureWriter recording the raw chunks
+        for stream, pipe in (('stdout', process.stdout), ('stderr', process.stderr)):
+            if pipe is not None:
+                self._splitters[stream] = LineSplitter(encoding)
+                self.reactor.register(pipe, stream)
+
+    @property
+    def eof(self):
+        return not self.reactor.active
+
+    def read_lines(self, timeout, until=None):
+        # Blocks until at least one pipe is readable or the timeout expires and
+        # returns every complete line received as a list of (stream, line). Lines read after
+        # `until` (a time.monotonic()) came too late for the test and are not returned, the
+        # capture still records them.
+        with self._lock:
+            chunks = self.reactor.poll(timeout)
+            read_time = time.monotonic()
+            lines = self._split_chunks(chunks, read_time)
+        if until is not None and read_time > until:
+            return []
+        return lines
+
+    def encoding(self, stream):
+        return self._splitters[stream].encoding
+
+    def pending_data(self, key=None):
+        return {stream: splitter.pending for stream, splitter in self._splitters.items()}
+
+    def set_capture(self, capture, key=None):
+        with self._lock:
+            self.capture = capture
+
+    def close(self):
+        with self._lock:
+            self.reactor.close()
+
+    def _split_chunks(self, chunks, read_time):
+        # `read_time` is when the chunks were read, the capture records them at that time
+        lines = []
+        for stream, data in chunks:
+            if self.capture is not None:
+                self.capture.write(stream, data, read_time)
+            splitter = self._splitters[stream]
+            new_lines = splitter.feed(data) if data else splitter.flush()
+            lines.extend((stream, line) for line in new_lines)
+        return lines
+
+
+class LineSubscription:
+    # Queue of the lines a LineDemultiplexer published since the subscription was made.
+    # Has the read_lines()/eof interface of ComserverReader, so run_test() can read from it.
+    # A full queue stops the publisher from reading (backpressure up to the COMSERVER pipe),
+    # a lossy one drops its oldest lines instead and counts them in `dropped`.
+    def __init__(self, demux, max_lines=SUBSCRIPTION_QUEUE_SIZE, lossy=False):
+        self._demux = demux
+        self.max_lines = max_lines
+        self.lossy = lossy
+        self.dropped = 0
+        self._batches = deque()  # (time.monotonic() the lines were read, [(stream, line), ...])
+        self._line_count = 0
+        self._condition = threading.Condition()
+        self._closed = False
+
+    @property
+    def eof(self):
+        return self._demux.eof and not self._batches
+
+    def read_lines(self, timeout, until=None):
+        # Returns every queued line as a list of (stream, line), waiting up to `timeout`
+        # seconds for one to arrive. Lines read after `until` (a time.monotonic()) came too
+        # late for the test and are dropped, like the capture replay drops them.
+        with self._condition:
+            if not self._batches and not self._demux.eof and timeout:
+                self._condition.wait(timeout)
+            lines = []
+            for read_time, batch in self._batches:
+                if until is None or read_time <= until:
+                    lines.extend(batch)
+            self._batches.clear()
+            self._line_count = 0
+            # Wake up a publisher waiting for room
+            self._condition.notify_all()
+            return lines
+
+    def pending_data(self, key=None):
+        # Nothing to add here, set_capture() hands the backlog to the capture
+        return {}
+
+    def set_capture(self, capture, key=None):
+        # Records the raw pipe data from now on. The lines already queued for this subscription
+        # and the partial lines are written first, so the capture holds everything it delivers.
+        self._demux.set_capture(capture, self)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._demux.unsubscribe(self)
+
+    def _wait_for_room(self):
+        # Backpressure: the publisher stops reading the pipes while this queue is full
+        with self._condition:
+            while not self.lossy and self._line_count >= self.max_lines and not self._closed and \
+                    not self._demux.closing:
+                self._condition.wait(DEMUX_POLL_INTERVAL)
+
+    def _put(self, lines, read_time):
+        with self._condition:
+            if self._closed:
+                return
+            self._batches.append((read_time, lines))
+            self._line_count += len(lines)
+            if self.lossy and self._line_count > self.max_lines:
+                # Drop the oldest lines, whole batches first
+                excess = self._line_count - self.max_lines
+                self.dropped += excess
+                self._line_count = self.max_lines
+                while excess:
+                    first_time, first = self._batches[0]
+                    if len(first) <= excess:
+                        self._batches.popleft()
+                        excess -= len(first)
+                    else:
+                        self._batches[0] = (first_time, first[excess:])
+                        excess = 0
+            self._condition.notify_all()
+
+    def _wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+
+class LineDemultiplexer:
+    # The single long-lived reader of one COMSERVER process. Its thread reads the pipes of a
+    # ComserverReader and publishes every line to all current subscriptions, e.g. the
+    # connection monitor and a running test, so no consumer steals lines from another.
+    def __init__(self, reader):
+        self.reader = reader
+        self.eof = False
+        self.closing = False
+        self.first_line_time = None  # time.monotonic() when the first line was published
+        self._subscriptions = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def subscribe(self, max_lines=SUBSCRIPTION_QUEUE_SIZE, lossy=False):
+        subscription = LineSubscription(self, max_lines, lossy)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def set_capture(self, capture, subscription):
+        # Publishing holds the lock, so no chunk can slip between the backlog and the capture
+        with self._lock:
+            if capture is not None:
+                with subscription._condition:
+                    backlog = [line for _, batch in subscription._batches for line in batch]
+                for stream, line in backlog:
+                    capture.write(stream, line.encode(self.reader.encoding(stream)))
+                for stream, pending in self.reader.pending_data().items():
+                    if pending:
+                        capture.write(stream, pending)
+            self.reader.set_capture(capture)
+
+    def close(self):
+        # Stops the thread and closes the reader, the subscriptions report eof
+        self.closing = True
+        self._thread.join()
+        self.reader.close()
+
+    def _run(self):
+        while not self.closing and not self.reader.eof:
+            # Never wait with the lock held, a queue may exceed its size by one chunk
+            with self._lock:
+                subscriptions = list(self._subscriptions)
+            for subscription in subscriptions:
+                subscription._wait_for_room()
+            chunks = self.reader.reactor.poll(DEMUX_POLL_INTERVAL)
+            if not chunks:
+                continue
+            with self._lock:
+                read_time = time.monotonic()
+                lines = self.reader._split_chunks(chunks, read_time)
+                if lines:
+                    if self.first_line_time is None:
+                        self.first_line_time = read_time
+                    for subscription in list(self._subscriptions):
+                        subscription._put(lines, read_time)
+        self.eof = True
+        with self._lock:
+            for subscription in self._subscriptions:
+                subscription._wake()
+
+
+class MultiComserverReader:
+    # Reads the pipes of several COMSERVER processes with a single reactor, so any number
+    # of channels is served by one thread without busy loops. Not thread-safe: captures are
+    # attached and detached by the thread that reads, between two read_lines() calls.
+    def __init__(self, encoding=None):
+        self.reactor = PipeReactor()
+        self.encoding = encoding
+        self.read_time = None  # time.monotonic() when read_lines() read the lines it returned
+        self._splitters = {}
+        self._open_streams = {}
+        self._captures = {}  # channel -> stream_capture.CaptureWriter recording its raw chunks
+
+    def add_process(self, channel, process):
+        self._open_streams[channel] = 0
+        for stream, pipe in (('stdout', process.stdout), ('stderr', process.stderr)):
+            if pipe is not None:
+                self._splitters[(channel, stream)] = LineSplitter(self.encoding)
+                self._open_streams[channel] += 1
+                self.reactor.register(pipe, (channel, stream))
+
+    @property
+    def active(self):
+        # False once the pipes of every channel are closed
+        return self.reactor.active
+
+    def eof(self, channel):
+        return self._open_streams.get(channel, 0) == 0
+
+    def read_lines(self, timeout):
+        # Returns every complete line received as a list of (channel, stream, line)
+        lines = []
+        chunks = self.reactor.poll(timeout)
+        self.read_time = time.monotonic()
+        for key, data in chunks:
+            channel, stream = key
+            capture = self._captures.get(channel)
+            if capture is not None:
+                capture.write(stream, data, self.read_time)
+            splitter = self._splitters[key]
+            if data:
+                new_lines = splitter.feed(data)
+            else:
+                new_lines = splitter.flush()
+                self._open_streams[channel] -= 1
+            lines.extend((channel, stream, line) for line in new_lines)
+        return lines
+
+    def pending_data(self, channel):
+        return {stream: splitter.pending for (splitter_channel, stream), splitter in self._splitters.items()
+                if splitter_channel == channel}
+
+    def set_capture(self, capture, channel):
+        if capture is None:
+            self._captures.pop(channel, None)
+        else:
+            self._captures[channel] = capture
+
+    def close(self):
+        self.reactor.close()
@@ -0,0 +1,91 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+# Junk lines printed between the data lines
+JUNK_LINES = [
+    "WARNING: link retrain requested",
+    "debug: buffer watermark reached",
+    "ERROR: CRC mismatch on frame",
+    "~~~",
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulates COMSERVER output for tests and benchmarks. Use "
+                                                 "\"python comserver_simulator.py ...\" as the COMSERVER path.")
+    parser.add_argument("--rate", type=float, default=10.0, help="data lines per second")
+    parser.add_argument("--mean", type=float, default=100.0, help="mean rx data rate in MB/s")
+    parser.add_argument("--std", type=float, default=2.0, help="standard deviation of the rx data rate")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="random timing jitter as a fraction of the line interval")
+    parser.add_argument("--stall-probability", type=float, default=0.0,
+                        help="probability per line that the output stalls")
+    parser.add_argument("--stall-duration", type=float, default=1.0, help="length of a stall in seconds")
+    parser.add_argument("--duplicate-probability", type=float, default=0.0,
+                        help="probability that a data line is printed twice")
+    parser.add_argument("--junk-probability", type=float, default=0.0,
+                        help="probability that a junk line is printed on stderr before a data line")
+    parser.add_argument("--duration", type=float, default=0.0, help="seconds to run, 0 runs until killed")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for reproducible output")
+    return parser.parse_args(argv)
+
+
+def data_line(index, rng, args):
+    rx = max(rng.gauss(args.mean, args.std), 0.0)
+    tx = max(rng.gauss(args.mean / 2, args.std / 2), 0.0)
+    # ts is the wall-clock time the line was written, used to measure ingestion latency
+    return f"[{index}] ts={time.time():.6f} rx={rx:.2f} MB/s tx={tx:.2f} MB/s pkt_err=0\n"
+
+
+def run(args, stdout=sys.stdout, stderr=sys.stderr):
+    rng = random.Random(args.seed)
+    interval = 1.0 / args.rate
+    start = time.monotonic()
+    next_due = start
+    index = 0
+    print("COMSERVER simulator started", file=stderr, flush=True)
+    while args.duration <= 0 or time.monotonic() - start < args.duration:
+        now = time.monotonic()
+        if now < next_due:
+            time.sleep(next_due - now)
+            now = time.monotonic()
+        # Write every line that is due at once, high rates are written in batches
+        lines = []
+        while next_due <= now:
+            index += 1
+            line = data_line(index, rng, args)
+            lines.append(line)
+            if rng.random() < args.duplicate_probability:
+                lines.append(line)
+            if rng.random() < args.junk_probability:
+                stdout.write(''.join(lines))
+                lines = []
+                stdout.flush()
+                stderr.write(rng.choice(JUNK_LINES) + "\n")
+                stderr.flush()
+            next_due += interval * (1.0 + rng.uniform(-args.jitter, args.jitter))
+            if rng.random() < args.stall_probability:
+                next_due += args.stall_duration
+                break
+        stdout.write(''.join(lines))
+        stdout.flush()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        run(args)
+    except BrokenPipeError:
+        # The reader went away, silence the error on the final flush at exit
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import math
+
+# Defaults of the "early_stop" configuration option
+DEFAULT_CONFIDENCE = 0.99
+DEFAULT_MIN_SAMPLES = 30
+DEFAULT_MIN_TIME = 0.0
+# Time between two checks of the verdict in seconds
+CHECK_INTERVAL = 0.5
+
+VERDICT_PASS = 'PASS'
+VERDICT_FAIL = 'FAIL'
+
+
+class EarlyStopRule:
+    # Sequential check whether the verdict of a running test is already settled. The mean
+    # and the std dev of the data rate get confidence bounds (normal approximation, the
+    # std dev on a log scale); the test can stop once the bounds are entirely inside or
+    # outside the limits. The rule looks at the data once per CHECK_INTERVAL, and the
+    # confidence is split over all looks of the test (Bonferroni) so repeated checking
+    # does not raise the error rate. Any error fails the test at once, as it would at the end.
+    # Checks this rule cannot settle early (SPC, percentile floors) switch the early PASS off.
+    def __init__(self, config, confidence=DEFAULT_CONFIDENCE, min_samples=DEFAULT_MIN_SAMPLES,
+                 min_time=DEFAULT_MIN_TIME, allow_pass=True, check_interval=CHECK_INTERVAL):
+        # statistics is slow to import and only needed when early stopping is configured
+        from statistics import NormalDist
+        self.config = config
+        self.min_samples = max(int(min_samples), 2)
+        self.min_time = float(min_time)
+        # An early PASS cannot see errors that would have come later, it can be switched off.
+        # The SPC checks and the percentile floors judge the whole run, a test that has them can
+        # only stop early with a FAIL.
+        self.allow_pass = allow_pass and not config.options.get("spc") and \
+            config.min_p1_data_rate_limit is None and config.min_p99_data_rate_limit is None
+        self.check_interval = check_interval
+        looks = max(1, math.ceil(config.test_run_time / check_interval))
+        self.z = NormalDist().inv_cdf(1.0 - (1.0 - float(confidence)) / (2 * looks))
+        self._next_check = 0.0
+
+    @classmethod
+    def from_config(cls, config):
+        # Uses the optional "early_stop" section of the test configuration, true or
+        # {"confidence": 0.99, "min_samples": 30, "min_time": 0, "allow_pass": true}.
+        # Returns None when early stopping is off.
+        options = config.options.get("early_stop")
+        if not options:
+            return None
+        if options is True:
+            options = {}
+        return cls(config, options.get("confidence", DEFAULT_CONFIDENCE),
+                   options.get("min_samples", DEFAULT_MIN_SAMPLES), options.get("min_time", DEFAULT_MIN_TIME),
+                   options.get("allow_pass", True))
+
+    def check(self, elapsed, count, mean, std_dev, errors):
+        # Returns VERDICT_PASS or VERDICT_FAIL if the verdict is settled, otherwise None
+        if errors > 0:
+            return VERDICT_FAIL
+        if elapsed < self._next_check:
+            return None
+        self._next_check = elapsed + self.check_interval
+        if elapsed < self.min_time or count < self.min_samples:
+            return None
+        mean_margin = self.z * std_dev / math.sqrt(count)
+        std_factor = math.exp(self.z / math.sqrt(2.0 * (count - 1)))
+        mean_low, mean_high = mean - mean_margin, mean + mean_margin
+        std_low, std_high = std_dev / std_factor, std_dev * std_factor
+        config = self.config
+        if mean_high < config.min_data_rate_limit or mean_low > config.max_data_rate_limit or \
+                std_low > config.max_std_dev_limit:
+            return VERDICT_FAIL
+        if self.allow_pass and mean_low >= config.min_data_rate_limit and \
+                mean_high <= config.max_data_rate_limit and std_high <= config.max_std_dev_limit:
+            return VERDICT_PASS
+        return None
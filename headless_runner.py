@@ -0,0 +1,131 @@
+import time
+
+_import_start = time.perf_counter()
+
+import argparse
+import json
+import sys
+
+from comserver_manager import ComserverManager
+from multi_channel import MultiChannelOrchestrator, channels_from_config
+from test_engine import TestConfig, TestSession, export_metrics, record_result, run_test
+
+# Time spent importing the modules of the headless path
+IMPORT_TIME = time.perf_counter() - _import_start
+# Options of the station rather than of the test (set by the command line), a resumed test
+# takes them from the current configuration
+STATION_OPTIONS = ('capture_dir', 'metrics_path', 'profile_dir')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run COMSERVER data rate tests without the GUI. "
+                                                 "Prints one JSON result per line on stdout.")
+    parser.add_argument("config", help="test configuration JSON written by the setup window Export button")
+    parser.add_argument("serial_numbers", nargs="+", help="sensor serial numbers to test, in order")
+    parser.add_argument("--parallel", action="store_true",
+                        help="test the serial numbers at the same time on the \"channels\" of the configuration, "
+                             "in channel order")
+    parser.add_argument("--capture-dir", help="record the raw COMSERVER output of every test into this directory")
+    parser.add_argument("--no-save", action="store_true", help="do not append the results to test_result_path")
+    parser.add_argument("--resume", action="store_true",
+                        help="resume the interrupted test of a serial number from its checkpoint, if it has one")
+    parser.add_argument("--metrics-path",
+                        help="write the metrics of every test to this file (Prometheus text for *.prom, else JSON)")
+    parser.add_argument("--profile-dir", help="write a cProfile profile of every test into this directory")
+    parser.add_argument("--startup-time", action="store_true",
+                        help="print the startup time of the headless path on stderr")
+    return parser.parse_args(argv)
+
+
+def resumed_session(config, serial_number):
+    # Session of the latest interrupted test of the serial number, None if it has none
+    from checkpoint import checkpoint_dir, interrupted_tests
+    tests = interrupted_tests(checkpoint_dir(config), serial_number)
+    if not tests:
+        return None
+    path, state = tests[-1]
+    print(f"Resuming the test of {serial_number} after {state['elapsed']:.1f} s from {path}", file=sys.stderr)
+    session = TestSession.from_checkpoint(state)
+    for name in STATION_OPTIONS:
+        if name in config.options:
+            session.config.options[name] = config.options[name]
+        else:
+            session.config.options.pop(name, None)
+    return session
+
+
+def run(config, serial_numbers, save=True, output=sys.stdout, resume=False):
+    # Runs the tests one after another on a single COMSERVER process, returns True if all passed.
+    # A crashed COMSERVER is restarted between tests unless auto_restart is switched off.
+    all_passed = True
+    manager = ComserverManager.from_config(config)
+    demux = manager.start().demux
+    try:
+        for serial_number in serial_numbers:
+            if demux.eof:
+                if not manager.ensure_running():
+                    print("COMSERVER exited, remaining serial numbers are not tested", file=sys.stderr)
+                    return False
+                print("COMSERVER exited and was restarted", file=sys.stderr)
+                demux = manager.active.demux
+            # Each test gets the lines from its start on, output between tests is not evaluated
+            subscription = demux.subscribe()
+            try:
+                session = resumed_session(config, serial_number) if resume else None
+                # A resumed test goes on with the configuration it was started with
+                result = run_test(session.config if session else config, serial_number, subscription,
+                                  session=session)
+            finally:
+                subscription.close()
+            result.metrics.add_comserver(manager.metrics())
+            if save:
+                record_result(result.config, result)
+            else:
+                export_metrics(result.config, result)
+                result.discard_checkpoint()
+            print(json.dumps(result.to_dict()), file=output, flush=True)
+            all_passed = all_passed and result.test_status == 'PASS'
+    finally:
+        manager.shutdown()
+    return all_passed
+
+
+def run_parallel(config, serial_numbers, save=True, output=sys.stdout):
+    # Tests one serial number per channel concurrently, returns True if all passed
+    channels = channels_from_config(config)
+    if len(serial_numbers) > len(channels):
+        print(f"{len(serial_numbers)} serial numbers given but only {len(channels)} channels configured",
+              file=sys.stderr)
+        return False
+    orchestrator = MultiChannelOrchestrator(config, channels, save_results=save)
+    orchestrator.result_callback = lambda index, result: print(
+        json.dumps(dict(result.to_dict(), channel=channels[index].name)), file=output, flush=True)
+    orchestrator.start()
+    try:
+        results = orchestrator.run_test(serial_numbers)
+    finally:
+        orchestrator.stop()
+    return len(results) == len(serial_numbers) and all(result.test_status == 'PASS' for result in results)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = TestConfig.from_json_file(args.config)
+    if args.capture_dir:
+        config.options["capture_dir"] = args.capture_dir
+    if args.metrics_path:
+        config.options["metrics_path"] = args.metrics_path
+    if args.profile_dir:
+        config.options["profile_dir"] = args.profile_dir
+    if args.startup_time:
+        startup_time = time.perf_counter() - _import_start
+        print(json.dumps({'import_time': IMPORT_TIME, 'startup_time': startup_time}), file=sys.stderr)
+    if args.parallel:
+        all_passed = run_parallel(config, args.serial_numbers, save=not args.no_save)
+    else:
+        all_passed = run(config, args.serial_numbers, save=not args.no_save, resume=args.resume)
+    return 0 if all_passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import math
+import re
+
+# Fields parsed from COMSERVER output lines, name -> pattern with one group holding the number.
+# The keys must start a word, so errors= does not match rx_errors= nor time= uptime=. Unlike the
+# original rx pattern, a line whose only rx= is the end of a longer key (max_rx=) is no sample.
+DEFAULT_FIELDS = {
+    'rx': r'(?<!\w)rx=(\d+\.\d+) MB/s',
+    'tx': r'(?<!\w)tx=(\d+\.\d+) MB/s',
+    'packet_errors': r'(?<!\w)(?:pkt_err|packet_errors|errors)=(\d+)',
+    'timestamp': r'(?<!\w)(?:ts|time)=(\d+(?:\.\d+)?)',
+}
+# Field whose presence makes a line a data sample
+SAMPLE_FIELD = 'rx'
+# Lines that are expected in the output and are neither samples nor errors
+DEFAULT_NOISE_PATTERNS = [r'^\s*$']
+# Lines that report a real problem
+DEFAULT_ERROR_PATTERNS = [r'(?i)\b(error|fail(ed|ure)?|timeout|not connected|disconnected)\b']
+
+LINE_SAMPLE = 'sample'
+LINE_NOISE = 'noise'
+LINE_ERROR = 'error'
+
+
+class ParsedBatch:
+    # Result of parsing several lines: one float64 column per field for the sample lines
+    # (NaN where a sample line lacks the field) and the number of noise and error lines
+    def __init__(self, fields, noise_count, error_count, error_lines):
+        self.fields = fields
+        self.noise_count = noise_count
+        self.error_count = error_count
+        self.error_lines = error_lines
+
+    @property
+    def sample_count(self):
+        return len(self.fields[SAMPLE_FIELD])
+
+
+class LineParser:
+    # Precompiled, configurable parser for COMSERVER output. Lines with the sample field
+    # are samples; other lines are noise if they match a noise pattern and errors if they
+    # match an error pattern. Lines matching neither count as errors unless
+    # unknown_lines_are_errors is False, which keeps the verdicts of the original rx-only parser.
+    def __init__(self, fields=None, noise_patterns=None, error_patterns=None, unknown_lines_are_errors=True):
+        fields = dict(DEFAULT_FIELDS if fields is None else fields)
+        if SAMPLE_FIELD not in fields:
+            fields[SAMPLE_FIELD] = DEFAULT_FIELDS[SAMPLE_FIELD]
+        self.field_names = [SAMPLE_FIELD] + [name for name in fields if name != SAMPLE_FIELD]
+        self.field_patterns = {name: re.compile(fields[name]) for name in self.field_names}
+        # Same patterns consuming the rest of the line, so findall() over a block of text
+        # returns at most one match per line and the matches can be aligned with the lines
+        self.block_patterns = {name: re.compile(f'(?:{fields[name]})[^\n]*\n', re.MULTILINE)
+                               for name in self.field_names}
+        self.noise_patterns = [re.compile(pattern) for pattern in
+                               (DEFAULT_NOISE_PATTERNS if noise_patterns is None else noise_patterns)]
+        self.error_patterns = [re.compile(pattern) for pattern in
+                               (DEFAULT_ERROR_PATTERNS if error_patterns is None else error_patterns)]
+        self.unknown_lines_are_errors = unknown_lines_are_errors
+
+    @classmethod
+    def from_config(cls, config):
+        # Uses the optional "parser" section of the test configuration:
+        # {"fields": {...}, "noise_patterns": [...], "error_patterns": [...], "unknown_lines_are_errors": true}
+        options = config.options.get("parser", {})
+        return cls(options.get("fields"), options.get("noise_patterns"), options.get("error_patterns"),
+                   options.get("unknown_lines_are_errors", True))
+
+    def classify(self, line):
+        # Kind of a line that has no sample field
+        for pattern in self.error_patterns:
+            if pattern.search(line):
+                return LINE_ERROR
+        for pattern in self.noise_patterns:
+            if pattern.search(line):
+                return LINE_NOISE
+        return LINE_ERROR if self.unknown_lines_are_errors else LINE_NOISE
+
+    def parse_line(self, line):
+        # Returns (kind, {field: value}) for a single line
+        match = self.field_patterns[SAMPLE_FIELD].search(line)
+        if match is None:
+            return self.classify(line), {}
+        values = {SAMPLE_FIELD: float(match.group(1))}
+        for name in self.field_names[1:]:
+            match = self.field_patterns[name].search(line)
+            values[name] = float(match.group(1)) if match else math.nan
+        return LINE_SAMPLE, values
+
+    def parse_lines(self, lines):
+        # Parses a list of lines and returns a ParsedBatch. Each field is extracted with a
+        # single findall() over the whole block; only blocks where a field is missing on
+        # some lines fall back to searching line by line.
+        import numpy as np
+
+        text = ''.join(lines)
+        if text.count('\n') != len(lines):
+            text = '\n'.join(line.rstrip('\n') for line in lines) + '\n'
+        sample_values = self.block_patterns[SAMPLE_FIELD].findall(text)
+        noise_count = 0
+        error_lines = []
+        if len(sample_values) == len(lines):
+            # Every line is a sample
+            sample_text, sample_count = text, len(lines)
+        else:
+            sample_matches = list(map(self.field_patterns[SAMPLE_FIELD].search, lines))
+            sample_lines = []
+            sample_values = []
+            for line, match in zip(lines, sample_matches):
+                if match is not None:
+                    sample_lines.append(line.rstrip('\n'))
+                    sample_values.append(match.group(1))
+                elif self.classify(line) == LINE_NOISE:
+                    noise_count += 1
+                else:
+                    error_lines.append(line)
+            sample_count = len(sample_lines)
+            sample_text = '\n'.join(sample_lines) + '\n' if sample_lines else ''
+        fields = {SAMPLE_FIELD: np.array(list(map(float, sample_values)), dtype=np.float64)}
+        for name in self.field_names[1:]:
+            values = self.block_patterns[name].findall(sample_text)
+            if len(values) == sample_count:
+                fields[name] = np.array(list(map(float, values)), dtype=np.float64)
+            else:
+                matches = map(self.field_patterns[name].search, sample_text.splitlines())
+                fields[name] = np.fromiter((float(match.group(1)) if match else math.nan for match in matches),
+                                           dtype=np.float64, count=sample_count)
+        return ParsedBatch(fields, noise_count, len(error_lines), error_lines)
+
+    def parse_chunk(self, text):
+        # Parses a whole block of output text (as read from the pipe) at once
+        return self.parse_lines(text.splitlines())
@@ -0,0 +1,163 @@
+import argparse
+import json
+import math
+import sys
+
+from streaming_stats import SMALL_BATCH_SIZE
+
+# Relative error of the quantiles. Histograms only merge with the same accuracy, so it is fixed.
+DEFAULT_RELATIVE_ACCURACY = 0.005
+# Percentiles reported with every result
+REPORTED_PERCENTILES = (1, 5, 50, 95, 99)
+
+
+def percentile_name(percent):
+    return f"p{percent:g}"
+
+
+class LogHistogram:
+    # Mergeable streaming quantile sketch. Samples are counted in bins whose bounds grow
+    # geometrically by gamma = (1 + a) / (1 - a), so every quantile is known to within a
+    # relative error of a = relative_accuracy whatever the distribution, and a data rate
+    # stream needs a few hundred bins at most. Values <= 0 are counted in a zero bin.
+    # Histograms of several tests merge by adding their bins.
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}  # Bin index i -> number of samples in (gamma^(i-1), gamma^i]
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update_batch(self, values):
+        # Adds a NumPy array of samples, NaN values are ignored
+        import numpy as np
+
+        if values.size < SMALL_BATCH_SIZE:
+            for value in values.tolist():
+                # NaN != NaN
+                if value == value:
+                    self._update(value)
+            return
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return
+        positive = values[values > 0]
+        self.zero_count += values.size - positive.size
+        if positive.size:
+            indexes = np.ceil(np.log(positive) / self._log_gamma).astype(np.int64)
+            lowest = int(indexes.min())
+            counts = np.bincount(indexes - lowest).tolist()
+            bins = self.bins
+            for offset, count in enumerate(counts):
+                if count:
+                    bins[lowest + offset] = bins.get(lowest + offset, 0) + count
+        self.count += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Only histograms with the same relative accuracy can be merged")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, fraction):
+        # Value below which `fraction` of the samples lie, None without samples
+        if not self.count:
+            return None
+        rank = fraction * (self.count - 1)
+        if rank < self.zero_count:
+            return max(min(0.0, self.max), self.min)
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                # Midpoint of the bin in relative terms, within relative_accuracy of every value in it
+                value = 2.0 * self.gamma ** index / (self.gamma + 1.0)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def _update(self, value):
+        if value > 0:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentiles(self, percents=REPORTED_PERCENTILES):
+        return {percentile_name(percent): self.quantile(percent / 100.0) for percent in percents}
+
+    def to_dict(self):
+        return {'relative_accuracy': self.relative_accuracy, 'count': self.count, 'zero_count': self.zero_count,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None,
+                'bins': {str(index): count for index, count in sorted(self.bins.items())}}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['relative_accuracy'])
+        histogram.bins = {int(index): count for index, count in data['bins'].items()}
+        histogram.zero_count = data['zero_count']
+        histogram.count = data['count']
+        if histogram.count:
+            histogram.min = data['min']
+            histogram.max = data['max']
+        return histogram
+
+
+def merge_results(results, percents=REPORTED_PERCENTILES):
+    # Merges the histograms of result dicts (TestResult.to_dict()) per part number and
+    # returns one distribution summary per part number
+    histograms = {}
+    tests = {}
+    for result in results:
+        if not result.get('histogram'):
+            continue
+        part = result.get('sensor_part_number', '')
+        histogram = LogHistogram.from_dict(result['histogram'])
+        if part in histograms:
+            histograms[part].merge(histogram)
+        else:
+            histograms[part] = histogram
+        tests[part] = tests.get(part, 0) + 1
+    return [dict({'sensor_part_number': part, 'tests': tests[part], 'samples': histogram.count,
+                  'min': histogram.min, 'max': histogram.max}, **histogram.percentiles(percents))
+            for part, histogram in sorted(histograms.items())]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge the data rate histograms of JSON results (as printed by "
+                                                 "headless_runner.py or stream_capture.py) into one distribution "
+                                                 "per part number, without the raw samples.")
+    parser.add_argument("results", nargs="+", help="files with one JSON result per line, - for stdin")
+    parser.add_argument("--percent", type=float, action="append",
+                        help="percentile to compute, may be repeated (default 1, 5, 50, 95, 99)")
+    args = parser.parse_args(argv)
+    results = []
+    for path in args.results:
+        file = sys.stdin if path == '-' else open(path)
+        try:
+            for line in file:
+                if line.strip().startswith('{'):
+                    results.append(json.loads(line))
+        finally:
+            if file is not sys.stdin:
+                file.close()
+    for summary in merge_results(results, args.percent or REPORTED_PERCENTILES):
+        print(json.dumps(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
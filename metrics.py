@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+
+# Prefix of the metric names in the Prometheus text format
+METRIC_PREFIX = 'cmd_test_'
+PROMETHEUS_SUFFIX = '.prom'
+PROFILE_SUFFIX = '.prof'
+# Values that become labels instead of metrics
+LABELS = ('channel', 'serial_number', 'test_status', 'stop_reason')
+
+# Latest metrics per channel of this process, written together into the metrics file
+_latest = {}
+_latest_lock = threading.Lock()
+
+
+class TestMetrics:
+    # Instrumentation of one test run. The acquisition loop adds the time it waited for
+    # COMSERVER output (blocked) and the time it spent parsing and evaluating it (busy),
+    # the GUI adds how late its progress updates arrive and the runners how long the COMSERVER
+    # the test ran on took to print its first line. Durations are in seconds.
+    __test__ = False  # Not a test case for pytest despite the name
+
+    def __init__(self, channel=''):
+        self.channel = channel
+        self.serial_number = ''
+        self.test_status = ''
+        self.stop_reason = ''
+        self.elapsed = 0.0
+        self.reads = 0
+        self.lines_read = 0
+        self.max_queue_depth = 0
+        self.blocked_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.parse_hits = 0
+        self.parse_misses = 0
+        self.duplicate_lines = 0
+        self.gui_updates = 0
+        self.gui_update_latency_total = 0.0
+        self.gui_update_latency_max = 0.0
+        self.results_write_seconds = None
+        self.comserver_spawn_to_first_line = None
+        self.comserver_start_to_first_line = None
+
+    def add_read(self, line_count, blocked_seconds, busy_seconds):
+        # `line_count` lines were waiting at once, i.e. the queue depth when the loop caught up
+        self.reads += 1
+        self.lines_read += line_count
+        self.blocked_seconds += blocked_seconds
+        self.busy_seconds += busy_seconds
+        if line_count > self.max_queue_depth:
+            self.max_queue_depth = line_count
+
+    def add_gui_update(self, latency):
+        self.gui_updates += 1
+        self.gui_update_latency_total += latency
+        if latency > self.gui_update_latency_max:
+            self.gui_update_latency_max = latency
+
+    def add_comserver(self, comserver_metrics):
+        # ComserverManager.metrics() of the station, None values until the first line arrived
+        self.comserver_spawn_to_first_line = comserver_metrics['spawn_to_first_line']
+        self.comserver_start_to_first_line = comserver_metrics['start_to_first_line']
+
+    def to_dict(self):
+        active = self.blocked_seconds + self.busy_seconds
+        return {'channel': self.channel, 'serial_number': self.serial_number, 'test_status': self.test_status,
+                'stop_reason': self.stop_reason, 'elapsed_seconds': self.elapsed, 'lines_read': self.lines_read,
+                'lines_per_second': self.lines_read / self.elapsed if self.elapsed else 0.0,
+                'parse_hits': self.parse_hits, 'parse_misses': self.parse_misses,
+                'duplicate_lines': self.duplicate_lines, 'blocked_seconds': self.blocked_seconds,
+                'busy_seconds': self.busy_seconds, 'busy_ratio': self.busy_seconds / active if active else 0.0,
+                'queue_depth_max': self.max_queue_depth,
+                'queue_depth_mean': self.lines_read / self.reads if self.reads else 0.0,
+                'gui_updates': self.gui_updates,
+                'gui_update_latency_mean_seconds':
+                    self.gui_update_latency_total / self.gui_updates if self.gui_updates else 0.0,
+                'gui_update_latency_max_seconds': self.gui_update_latency_max,
+                'results_write_seconds': self.results_write_seconds,
+                'comserver_spawn_to_first_line_seconds': self.comserver_spawn_to_first_line,
+                'comserver_start_to_first_line_seconds': self.comserver_start_to_first_line}
+
+
+def write_metrics(path, metrics):
+    # Replaces the metrics file with the latest metrics of every channel of this process.
+    # A ".prom" file gets the Prometheus text format, anything else JSON. The file is
+    # replaced atomically, so a scraper never reads a half-written file.
+    with _latest_lock:
+        _latest[metrics.channel] = metrics.to_dict()
+        channels = [_latest[channel] for channel in sorted(_latest)]
+        if path.endswith(PROMETHEUS_SUFFIX):
+            text = _prometheus_text(channels)
+        else:
+            text = json.dumps({'time': time.time(), 'tests': channels}, indent=1)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as file:
+            file.write(text)
+        os.replace(temporary_path, path)
+
+
+def _prometheus_text(channels):
+    lines = []
+    for name in channels[0]:
+        if name in LABELS:
+            continue
+        metric = METRIC_PREFIX + name
+        lines.append(f"# TYPE {metric} gauge")
+        for values in channels:
+            if values[name] is None:
+                continue
+            labels = ','.join(f'{label}="{_escape(values[label])}"' for label in LABELS)
+            lines.append(f"{metric}{{{labels}}} {values[name]}")
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def profile_path(profile_dir, serial_number, start_time):
+    safe_serial = ''.join(c if c.isalnum() or c in '-_' else '_' for c in serial_number)
+    return os.path.join(profile_dir, f"{safe_serial}_{start_time:%Y%m%d_%H%M%S_%f}{PROFILE_SUFFIX}")
@@ -0,0 +1,293 @@
+import queue
+import threading
+import time
+
+from comserver import start_comserver_process, stop_comserver_process
+from comserver_reader import MultiComserverReader
+from metrics import TestMetrics
+from test_engine import PROGRESS_INTERVAL, STOP_CANCELLED, STOP_COMPLETED, STOP_COMSERVER_EXITED, TestSession, \
+    export_metrics, record_result
+
+# A channel is considered connected while it prints sensor lines at least this long
+SENSOR_LINE_MIN_LENGTH = 42
+# Time without sensor lines after which a channel reports "Sensor not connected"
+SENSOR_TIMEOUT = 2.0
+
+STATUS_RUNNING = 'Running'
+STATUS_NOT_CONNECTED = 'Sensor not connected'
+STATUS_EXITED = 'Not Running'
+
+
+class Channel:
+    # One sensor port of a fixture with its own COMSERVER command line
+    def __init__(self, name, comserver_path):
+        self.name = name
+        self.comserver_path = comserver_path
+
+
+def channels_from_config(config):
+    # Channels come from the optional "channels" list of the test configuration:
+    # [{"name": "Port 1", "comserver_path": "..."}, ...]
+    channels = []
+    for index, data in enumerate(config.options.get("channels", [])):
+        channels.append(Channel(data.get("name") or f"Channel {index + 1}", data["comserver_path"]))
+    return channels
+
+
+class MultiChannelOrchestrator:
+    # Runs one COMSERVER process per channel and tests all channels at the same time.
+    # A single reactor thread reads every pipe, feeds the test sessions and reports
+    # progress, results and connection status through the optional callbacks:
+    #   progress_callback(channel_index, progress), result_callback(channel_index, result),
+    #   status_callback(channel_index, status)
+    # Finished results are saved by a writer thread, so the disk writes of one channel do not
+    # hold up reading the others. result_callback is called from the writer thread once the
+    # result is saved, the other callbacks from the reactor thread.
+    def __init__(self, config, channels, save_results=True, progress_interval=PROGRESS_INTERVAL):
+        self.config = config
+        self.channels = channels
+        self.save_results = save_results
+        self.progress_interval = progress_interval
+        self.progress_callback = None
+        self.result_callback = None
+        self.status_callback = None
+
+        self._reader = None
+        self._processes = []
+        self._reactor_thread = None
+        self._writer_thread = None
+        self._finished_results = queue.Queue()
+        self._unsaved_results = 0
+        self._lock = threading.Lock()
+        self._new_sessions = {}  # Sessions of start_test() the reactor thread has not started yet
+        self._sessions = {}
+        self._session_starts = {}
+        self._results = {}
+        self._captures = {}
+        self._tests_done = threading.Event()
+        self._tests_done.set()
+        self._cancel_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self._reactor_thread is not None
+
+    @property
+    def testing(self):
+        return not self._tests_done.is_set()
+
+    def start(self):
+        if self.running:
+            return
+        self._reader = MultiComserverReader()
+        self._processes = []
+        for index, channel in enumerate(self.channels):
+            process = start_comserver_process(channel.comserver_path)
+            self._processes.append(process)
+            self._reader.add_process(index, process)
+        self._stop_event.clear()
+        self._writer_thread = threading.Thread(target=self._write_results, daemon=True)
+        self._writer_thread.start()
+        self._reactor_thread = threading.Thread(target=self._run_reactor, daemon=True)
+        self._reactor_thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.cancel()
+        self._stop_event.set()
+        self._reactor_thread.join()
+        self._reactor_thread = None
+        # The results of the cancelled tests are still saved
+        self._finished_results.put(None)
+        self._writer_thread.join()
+        self._writer_thread = None
+        self._reader.close()
+        # Tear the processes down in parallel, each one may take a few seconds
+        stop_threads = [threading.Thread(target=stop_comserver_process, args=(process,))
+                        for process in self._processes]
+        for stop_thread in stop_threads:
+            stop_thread.start()
+        for stop_thread in stop_threads:
+            stop_thread.join()
+        self._processes = []
+
+    def start_test(self, serial_numbers):
+        # serial_numbers are in channel order, channels with an empty serial number are not tested.
+        # The reactor thread starts the tests before its next read.
+        with self._lock:
+            if not self.running:
+                raise RuntimeError("The COMSERVER processes are not running")
+            if self.testing:
+                raise RuntimeError("A multi-channel test is already running")
+            self._results = {}
+            self._cancel_event.clear()
+            for index, serial_number in enumerate(serial_numbers[:len(self.channels)]):
+                if serial_number and not self._reader.eof(index):
+                    self._new_sessions[index] = TestSession(self.config, serial_number,
+                                                            metrics=TestMetrics(self.channels[index].name))
+            if self._new_sessions:
+                self._tests_done.clear()
+            return sorted(self._new_sessions)
+
+    def wait(self, timeout=None):
+        # Waits for the running test and returns the results in channel order
+        self._tests_done.wait(timeout)
+        with self._lock:
+            return [self._results[index] for index in sorted(self._results)]
+
+    def run_test(self, serial_numbers):
+        self.start_test(serial_numbers)
+        return self.wait()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _run_reactor(self):
+        last_sensor_line = [time.monotonic()] * len(self.channels)
+        statuses = [None] * len(self.channels)
+        last_progress = 0.0
+        while not self._stop_event.is_set():
+            self._start_sessions()
+            read_start = time.perf_counter()
+            if self._reader.active:
+                lines = self._reader.read_lines(self._poll_timeout())
+            else:
+                # Every COMSERVER has exited, there are no pipes to wait on until stop()
+                self._stop_event.wait(self._poll_timeout())
+                lines = []
+            blocked = time.perf_counter() - read_start
+            now = time.monotonic()
+            read_time = self._reader.read_time if lines else now
+            finished = []
+            channel_lines = {}
+            for channel, stream, line in lines:
+                if stream == 'stdout' and len(line) >= SENSOR_LINE_MIN_LENGTH:
+                    last_sensor_line[channel] = now
+                channel_lines.setdefault(channel, []).append(line)
+            with self._lock:
+                # Every channel's lines are parsed as one batch
+                for index, session in self._sessions.items():
+                    new_lines = channel_lines.get(index, [])
+                    if read_time - self._session_starts[index] > self.config.test_run_time:
+                        # Read after the run time, a replay of the capture drops these lines as well
+                        new_lines = []
+                    feed_start = time.perf_counter()
+                    if new_lines:
+                        session.feed_lines(new_lines)
+                    # The wait is shared by all channels, the parsing is per channel
+                    session.metrics.add_read(len(new_lines), blocked, time.perf_counter() - feed_start)
+                finished = self._update_sessions(now)
+                progress = []
+                if self._sessions and now - last_progress >= self.progress_interval:
+                    last_progress = now
+                    progress = [(index, session.progress()) for index, session in self._sessions.items()]
+            # Results are saved and reported by the writer thread
+            for index, result in finished:
+                self._finished_results.put((index, result))
+            if self.progress_callback:
+                for index, channel_progress in progress:
+                    self.progress_callback(index, channel_progress)
+            self._update_statuses(now, last_sensor_line, statuses)
+        self._start_sessions()
+        with self._lock:
+            self._cancel_event.set()
+            finished = self._update_sessions(time.monotonic())
+        for index, result in finished:
+            self._finished_results.put((index, result))
+
+    def _start_sessions(self):
+        # Starts the tests of start_test() on the reactor thread, between two reads, so a
+        # capture records exactly the chunks whose lines its test evaluates
+        with self._lock:
+            if not self._new_sessions:
+                return
+            now = time.monotonic()
+            for index, session in self._new_sessions.items():
+                session.start_sample_file()
+                session.start_checkpoint()
+                self._sessions[index] = session
+                self._session_starts[index] = now
+                if self.config.options.get("capture_dir"):
+                    from stream_capture import start_capture
+                    self._captures[index] = start_capture(self.config, session.serial_number, session.start_time,
+                                                          now, self._reader, index)
+            self._new_sessions = {}
+
+    def _poll_timeout(self):
+        # Wake up in time for the earliest test deadline
+        timeout = self.progress_interval
+        with self._lock:
+            now = time.monotonic()
+            for index in self._sessions:
+                remaining = self.config.test_run_time - (now - self._session_starts[index])
+                timeout = min(timeout, max(remaining, 0.0))
+        return timeout
+
+    def _update_sessions(self, now):
+        finished = []
+        for index, session in list(self._sessions.items()):
+            session.elapsed = now - self._session_starts[index]
+            if self._cancel_event.is_set():
+                stop_reason = STOP_CANCELLED
+            elif session.elapsed >= self.config.test_run_time:
+                session.elapsed = float(self.config.test_run_time)
+                stop_reason = STOP_COMPLETED
+            elif self._reader.eof(index):
+                # COMSERVER of this channel closed its pipes before the test run time elapsed
+                session.add_error()
+                stop_reason = STOP_COMSERVER_EXITED
+            else:
+                stop_reason = session.early_stop_reason()
+                if stop_reason is None:
+                    session.checkpoint_if_due()
+                    continue
+            result = session.finish(stop_reason)
+            capture = self._captures.pop(index, None)
+            if capture is not None:
+                self._reader.set_capture(None, index)
+                capture.close(stop_reason, session.elapsed)
+            del self._sessions[index]
+            del self._session_starts[index]
+            self._results[index] = result
+            self._unsaved_results += 1
+            finished.append((index, result))
+        return finished
+
+    def _write_results(self):
+        while True:
+            finished = self._finished_results.get()
+            if finished is None:
+                return
+            self._report_result(*finished)
+            with self._lock:
+                self._unsaved_results -= 1
+                # The test is done once every channel's result is saved and reported
+                if not self._sessions and not self._new_sessions and not self._unsaved_results:
+                    self._tests_done.set()
+
+    def _report_result(self, index, result):
+        try:
+            if self.save_results and not result.cancelled:
+                record_result(self.config, result)
+            else:
+                export_metrics(self.config, result)
+                result.discard_checkpoint()
+        except Exception as e:
+            print(f"An error occurred while saving the result of {self.channels[index].name}: {e}")
+        if self.result_callback:
+            self.result_callback(index, result)
+
+    def _update_statuses(self, now, last_sensor_line, statuses):
+        for index in range(len(self.channels)):
+            if self._reader.eof(index):
+                status = STATUS_EXITED
+            elif now - last_sensor_line[index] > SENSOR_TIMEOUT:
+                status = STATUS_NOT_CONNECTED
+            else:
+                status = STATUS_RUNNING
+            if status != statuses[index]:
+                statuses[index] = status
+                if self.status_callback:
+                    self.status_callback(index, status)
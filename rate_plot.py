@@ -0,0 +1,126 @@
+import math
+
+from PyQt5.QtCore import QPointF, QRectF, Qt, QTimer
+from PyQt5.QtGui import QColor, QPainter, QPen
+from PyQt5.QtWidgets import QWidget
+
+# Redraw interval of the plot in milliseconds (20 fps)
+REFRESH_INTERVAL_MS = 50
+# Space for the axis labels in pixels
+LEFT_MARGIN = 50
+BOTTOM_MARGIN = 18
+TOP_MARGIN = 6
+RIGHT_MARGIN = 8
+# Samples further apart than this (in seconds) are not joined, the gap shows a dropout
+DROPOUT_GAP = 0.5
+
+
+class RatePlotWidget(QWidget):
+    # Live plot of the rx data rate drawn with QPainter from a SampleRingBuffer. Each pixel
+    # column shows the min/max of the samples falling into it, so spikes stay visible
+    # however many samples there are. The limits are drawn as dashed red lines.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.sample_buffer = None
+        self.min_limit = None
+        self.max_limit = None
+        self.time_range = 1.0
+        self._drawn_version = None
+        self._timer = QTimer(self)
+        self._timer.setInterval(REFRESH_INTERVAL_MS)
+        self._timer.timeout.connect(self._refresh)
+        self.setMinimumHeight(150)
+
+    def set_buffer(self, sample_buffer):
+        self.sample_buffer = sample_buffer
+        self._drawn_version = None
+        self.update()
+
+    def set_limits(self, min_limit, max_limit):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.update()
+
+    def set_time_range(self, seconds):
+        # Length of the x axis, normally the test run time
+        self.time_range = max(float(seconds or 0), 1.0)
+        self.update()
+
+    def start(self):
+        self._timer.start()
+
+    def stop(self):
+        # Keeps showing the last frame
+        self._timer.stop()
+        self._refresh()
+
+    def _refresh(self):
+        # Only repaint when new samples arrived since the last frame
+        if self.sample_buffer is not None and self.sample_buffer.version != self._drawn_version:
+            self.update()
+
+    def _plot_rect(self):
+        return QRectF(LEFT_MARGIN, TOP_MARGIN, max(self.width() - LEFT_MARGIN - RIGHT_MARGIN, 1),
+                      max(self.height() - TOP_MARGIN - BOTTOM_MARGIN, 1))
+
+    def _y_range(self, minimums, maximums):
+        # The limits and every drawn sample are always in view
+        values = [limit for limit in (self.min_limit, self.max_limit) if limit is not None]
+        values += [value for value in minimums + maximums if not math.isnan(value)]
+        if not values:
+            return 0.0, 1.0
+        low, high = min(values), max(values)
+        margin = (high - low) * 0.1 or max(abs(high) * 0.1, 1.0)
+        return low - margin, high + margin
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        rect = self._plot_rect()
+        columns = int(rect.width())
+        if self.sample_buffer is not None:
+            self._drawn_version = self.sample_buffer.version
+            minimums, maximums = self.sample_buffer.decimate(columns, 0.0, self.time_range)
+            minimums, maximums = minimums.tolist(), maximums.tolist()
+        else:
+            minimums = maximums = [math.nan] * columns
+        low, high = self._y_range(minimums, maximums)
+        scale = rect.height() / (high - low)
+
+        def y_of(value):
+            return rect.bottom() - (value - low) * scale
+
+        painter.setPen(QPen(Qt.black))
+        painter.drawRect(rect)
+        painter.drawText(QRectF(0, rect.top() - 2, LEFT_MARGIN - 4, 14), Qt.AlignRight, f"{high:.1f}")
+        painter.drawText(QRectF(0, rect.bottom() - 12, LEFT_MARGIN - 4, 14), Qt.AlignRight, f"{low:.1f}")
+        painter.drawText(QRectF(rect.left(), rect.bottom() + 2, rect.width(), BOTTOM_MARGIN - 2),
+                         Qt.AlignLeft, "0 s")
+        painter.drawText(QRectF(rect.left(), rect.bottom() + 2, rect.width(), BOTTOM_MARGIN - 2),
+                         Qt.AlignRight, f"{self.time_range:g} s")
+        painter.drawText(QRectF(rect.left(), rect.bottom() + 2, rect.width(), BOTTOM_MARGIN - 2),
+                         Qt.AlignHCenter, "rx [MB/s]")
+
+        limit_pen = QPen(QColor(200, 0, 0))
+        limit_pen.setStyle(Qt.DashLine)
+        painter.setPen(limit_pen)
+        for limit in (self.min_limit, self.max_limit):
+            if limit is not None and low <= limit <= high:
+                painter.drawLine(QPointF(rect.left(), y_of(limit)), QPointF(rect.right(), y_of(limit)))
+
+        # One vertical min/max segment per pixel column with samples, joined to the previous
+        # one unless no sample arrived for longer than DROPOUT_GAP
+        painter.setPen(QPen(QColor(0, 90, 200)))
+        max_gap_columns = DROPOUT_GAP * columns / self.time_range
+        previous = None
+        for column, (minimum, maximum) in enumerate(zip(minimums, maximums)):
+            if math.isnan(minimum):
+                continue
+            x = rect.left() + column + 0.5
+            top, bottom = y_of(maximum), y_of(minimum)
+            painter.drawLine(QPointF(x, top), QPointF(x, bottom))
+            middle = (top + bottom) / 2
+            if previous is not None and column - previous[0] <= max_gap_columns:
+                painter.drawLine(previous[1], QPointF(x, middle))
+            previous = (column, QPointF(x, middle))
+        painter.end()
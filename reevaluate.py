@@ -0,0 +1,167 @@
+import argparse
+import functools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from sample_store import SAMPLE_FILE_SUFFIX, replay_sample_file
+from stream_capture import CAPTURE_SUFFIX, replay_capture
+from test_engine import PERCENTILE_LIMITS, STOP_CANCELLED, TestConfig, evaluate
+
+# Configuration keys that only change the verdict, a test is evaluated again without a second replay
+LIMIT_FIELDS = ('min_data_rate_limit', 'max_data_rate_limit', 'max_std_dev_limit') + tuple(PERCENTILE_LIMITS.values())
+# Keys of a new configuration that belong to the station, not to the test of a part number
+STATION_FIELDS = ('sensor_part_number', 'comserver_path', 'test_result_path')
+# Tasks per worker process and chunk of the process pool, fewer round trips for many small tests
+CHUNKS_PER_JOB = 16
+
+
+def find_tests(paths):
+    # Capture and sample files among `paths`, directories are searched recursively
+    tests = []
+    for path in paths:
+        if not os.path.isdir(path):
+            tests.append(path)
+            continue
+        for directory, _, names in os.walk(path):
+            tests.extend(os.path.join(directory, name) for name in names
+                         if name.endswith(CAPTURE_SUFFIX) or name.endswith(SAMPLE_FILE_SUFFIX))
+    return sorted(tests)
+
+
+def replay(path, config=None):
+    if path.endswith(SAMPLE_FILE_SUFFIX):
+        return replay_sample_file(path, config)
+    return replay_capture(path, config)
+
+
+def reevaluate_test(path, part_changes=None, changes=None):
+    # Replays one test with its recorded configuration and evaluates it again with the changes
+    # for its part number (`part_changes`) and for every test (`changes`). Runs in the worker
+    # processes, so it returns a small dict instead of the TestResult.
+    try:
+        old_result = replay(path)
+        recorded = old_result.config.to_dict()
+        part = old_result.config.sensor_part_number
+        new_values = dict((part_changes or {}).get(part, {}), **(changes or {}))
+        new_values = {name: value for name, value in new_values.items() if recorded.get(name) != value}
+        if not new_values:
+            new_result = old_result
+            new_status = old_result.test_status
+        elif all(name in LIMIT_FIELDS for name in new_values):
+            new_result = old_result
+            new_status = evaluate(TestConfig(**dict(recorded, **new_values)), old_result.average_data_rate,
+                                  old_result.standard_deviation, old_result.errors, old_result.spc,
+                                  old_result.percentiles)
+        else:
+            # The run time, the parser or the SPC settings change the statistics as well
+            new_result = replay(path, TestConfig(**dict(recorded, **new_values)))
+            new_status = new_result.test_status
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        return {'test': path, 'error': str(e)}
+    return {'test': path,
+            'serial_number': old_result.serial_number,
+            'sensor_part_number': part,
+            'start_time': old_result.start_time.isoformat(),
+            'stop_reason': new_result.stop_reason,
+            'old_status': old_result.test_status,
+            'new_status': new_status,
+            'samples': new_result.samples,
+            'average_data_rate': new_result.average_data_rate,
+            'standard_deviation': new_result.standard_deviation,
+            'errors': new_result.errors,
+            'percentiles': new_result.percentiles,
+            'changes': new_values}
+
+
+def reevaluate(paths, part_changes=None, changes=None, jobs=None):
+    # Yields the reevaluate_test() dict of every test in the order of `paths`, the tests are
+    # spread over `jobs` worker processes (one per CPU by default)
+    work = functools.partial(reevaluate_test, part_changes=part_changes, changes=changes)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(paths) < 2:
+        yield from map(work, paths)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(work, paths, chunksize=max(1, len(paths) // (jobs * CHUNKS_PER_JOB)))
+
+
+class YieldImpact:
+    # Old and new pass counts per part number. Cancelled tests were never recorded as results,
+    # so they do not count.
+    def __init__(self):
+        self.parts = {}
+
+    def add(self, test):
+        if test['stop_reason'] == STOP_CANCELLED:
+            return
+        counts = self.parts.setdefault(test['sensor_part_number'], {'tests': 0, 'old_passed': 0, 'new_passed': 0,
+                                                                    'pass_to_fail': 0, 'fail_to_pass': 0})
+        old_passed = test['old_status'] == 'PASS'
+        new_passed = test['new_status'] == 'PASS'
+        counts['tests'] += 1
+        counts['old_passed'] += old_passed
+        counts['new_passed'] += new_passed
+        counts['pass_to_fail'] += old_passed and not new_passed
+        counts['fail_to_pass'] += new_passed and not old_passed
+
+    def summary(self):
+        rows = []
+        for part, counts in sorted(self.parts.items()):
+            old_yield = counts['old_passed'] / counts['tests']
+            new_yield = counts['new_passed'] / counts['tests']
+            rows.append(dict({'sensor_part_number': part}, **counts, old_yield=old_yield, new_yield=new_yield,
+                             yield_change=new_yield - old_yield))
+        return rows
+
+
+def parse_setting(text):
+    # NAME=VALUE of --set, the value is JSON if it parses (numbers, true, {...}), else a string
+    name, separator, value = text.partition('=')
+    if not separator or not name:
+        raise argparse.ArgumentTypeError(f"{text!r} is not NAME=VALUE")
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate recorded tests (captures and sample files) again with "
+                                                 "new limits and print the tests whose verdict changes, then the "
+                                                 "yield impact per part number, as JSON lines.")
+    parser.add_argument("tests", nargs="+", help="capture files (*.cap.gz), sample files (*.samples) or directories "
+                                                 "with them")
+    parser.add_argument("--config", action="append", default=[],
+                        help="new test configuration JSON of a part number, its limits and options replace the "
+                             "recorded ones for the tests of that part number; may be repeated")
+    parser.add_argument("--set", action="append", default=[], type=parse_setting, metavar="NAME=VALUE",
+                        help="configuration value for every test, e.g. max_std_dev_limit=1.5; may be repeated")
+    parser.add_argument("--part", help="only the tests of this part number")
+    parser.add_argument("--jobs", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--all", action="store_true", help="print every test, not only the changed verdicts")
+    args = parser.parse_args(argv)
+    part_changes = {}
+    for path in args.config:
+        new_config = TestConfig.from_json_file(path).to_dict()
+        part_changes[new_config['sensor_part_number']] = {name: value for name, value in new_config.items()
+                                                          if name not in STATION_FIELDS}
+    changes = dict(args.set)
+    impact = YieldImpact()
+    for test in reevaluate(find_tests(args.tests), part_changes, changes, args.jobs):
+        if 'error' in test:
+            print(f"An error occurred while re-evaluating {test['test']}: {test['error']}", file=sys.stderr)
+            continue
+        if args.part is not None and test['sensor_part_number'] != args.part:
+            continue
+        impact.add(test)
+        if args.all or test['old_status'] != test['new_status']:
+            print(json.dumps(test))
+    for row in impact.summary():
+        print(json.dumps(dict(row, summary='yield')), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,522 @@
+import argparse
+import csv
+import json
+import math
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+from log_histogram import REPORTED_PERCENTILES, LogHistogram
+
+# Result CSV column -> database column
+COLUMN_NAMES = {
+    'Test starting time': 'start_time',
+    'Sensor name': 'sensor_part_number',
+    'Sensor Serial Number': 'serial_number',
+    'Minimum Data Rate Limit': 'min_data_rate_limit',
+    'Maximum Data Rate Limit': 'max_data_rate_limit',
+    'Average data rate': 'average_data_rate',
+    'Maximum Standard Deviation Limit': 'max_std_dev_limit',
+    'Standard Deviation': 'standard_deviation',
+    'Errors': 'errors',
+    'Test status': 'test_status',
+    'Test end time': 'end_time',
+    'Stop reason': 'stop_reason',
+    'Samples': 'samples',
+    'P1 data rate': 'p1_data_rate',
+    'P99 data rate': 'p99_data_rate',
+}
+# Columns that trends and percentiles can be computed for
+NUMERIC_COLUMNS = ('average_data_rate', 'standard_deviation', 'errors', 'samples', 'min_data_rate_limit',
+                   'max_data_rate_limit', 'max_std_dev_limit', 'p1_data_rate', 'p99_data_rate')
+# Columns added after the first release of the database, name -> type
+ADDED_COLUMNS = {'stop_reason': 'TEXT', 'samples': 'INTEGER', 'p1_data_rate': 'REAL', 'p99_data_rate': 'REAL'}
+# Trend bucket -> SQLite strftime format of the bucket label
+BUCKETS = {'hour': '%Y-%m-%d %H:00', 'day': '%Y-%m-%d', 'week': '%Y-W%W', 'month': '%Y-%m'}
+DATABASE_SUFFIX = '.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    start_time TEXT NOT NULL,
+    end_time TEXT,
+    sensor_part_number TEXT NOT NULL,
+    serial_number TEXT NOT NULL,
+    min_data_rate_limit REAL,
+    max_data_rate_limit REAL,
+    average_data_rate REAL,
+    max_std_dev_limit REAL,
+    standard_deviation REAL,
+    errors INTEGER,
+    test_status TEXT,
+    stop_reason TEXT,
+    samples INTEGER,
+    p1_data_rate REAL,
+    p99_data_rate REAL,
+    -- Also the index for queries by serial number
+    UNIQUE (serial_number, start_time)
+);
+CREATE INDEX IF NOT EXISTS results_part_time ON results (sensor_part_number, start_time);
+CREATE INDEX IF NOT EXISTS results_time ON results (start_time);
+-- Running totals per part number and day, kept up to date by every insert so yield
+-- queries never scan the results table
+CREATE TABLE IF NOT EXISTS part_daily (
+    sensor_part_number TEXT NOT NULL,
+    day TEXT NOT NULL,
+    tests INTEGER NOT NULL,
+    passed INTEGER NOT NULL,
+    rates INTEGER NOT NULL,
+    rate_sum REAL NOT NULL,
+    rate_sum_squares REAL NOT NULL,
+    rate_min REAL,
+    rate_max REAL,
+    PRIMARY KEY (sensor_part_number, day)
+);
+-- Per-window summary of the SPC analysis of a result, `start` in seconds of test time
+CREATE TABLE IF NOT EXISTS result_windows (
+    result_id INTEGER NOT NULL REFERENCES results (id),
+    start REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    mean REAL,
+    min REAL,
+    max REAL,
+    PRIMARY KEY (result_id, start)
+);
+-- Data rate histogram of a result (LogHistogram.to_dict() as JSON), and the histograms of
+-- all results of a part number and day merged, so distributions never need the samples
+CREATE TABLE IF NOT EXISTS result_histograms (
+    result_id INTEGER PRIMARY KEY REFERENCES results (id),
+    histogram TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS part_daily_histograms (
+    sensor_part_number TEXT NOT NULL,
+    day TEXT NOT NULL,
+    tests INTEGER NOT NULL,
+    histogram TEXT NOT NULL,
+    PRIMARY KEY (sensor_part_number, day)
+);
+-- Last sequence number each station (and epoch of its spool) delivered to the aggregator,
+-- written in the same transaction as the results, see aggregator.py
+CREATE TABLE IF NOT EXISTS deliveries (
+    station_id TEXT NOT NULL,
+    epoch TEXT NOT NULL,
+    last_seq INTEGER NOT NULL,
+    PRIMARY KEY (station_id, epoch)
+);
+"""
+
+UPDATE_PART_DAILY = """
+INSERT INTO part_daily VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (sensor_part_number, day) DO UPDATE SET
+    tests = tests + 1,
+    passed = passed + excluded.passed,
+    rates = rates + excluded.rates,
+    rate_sum = rate_sum + excluded.rate_sum,
+    rate_sum_squares = rate_sum_squares + excluded.rate_sum_squares,
+    rate_min = min(coalesce(rate_min, excluded.rate_min), coalesce(excluded.rate_min, rate_min)),
+    rate_max = max(coalesce(rate_max, excluded.rate_max), coalesce(excluded.rate_max, rate_max))
+"""
+
+
+def default_database_path(csv_path):
+    # The database lives next to the result CSV: results.csv -> results.sqlite
+    if not csv_path:
+        return None
+    return os.path.splitext(csv_path)[0] + DATABASE_SUFFIX
+
+
+def _timestamp(value):
+    # Timestamps are stored as 'YYYY-MM-DD HH:MM:SS.ffffff' so they sort and compare as text
+    if value is None or value == '':
+        return None
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).strip())
+        except ValueError:
+            return str(value)
+    return value.isoformat(sep=' ', timespec='microseconds')
+
+
+def _whole_days(*values):
+    # True if every time is None or midnight, so the daily aggregates can answer a query
+    return all(value is None or _timestamp(value).endswith(' 00:00:00.000000') for value in values)
+
+
+def _number(value, convert=float):
+    if value is None or value == '':
+        return None
+    try:
+        return convert(float(value))
+    except ValueError:
+        return None
+
+
+def _percentile(sorted_values, percent):
+    # Linear interpolation between the closest ranks, same as numpy.percentile
+    position = (len(sorted_values) - 1) * percent / 100.0
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class ResultsDatabase:
+    # Indexed SQLite store of the test results with the same rows as the result CSV.
+    # Re-inserting a result (same serial number and start time) is ignored, so imports
+    # can be repeated safely.
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=30)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(SCHEMA)
+        self._add_missing_columns()
+
+    def close(self):
+        self._connection.close()
+
+    def insert(self, row):
+        return self.insert_rows([row])
+
+    def insert_result(self, row, histogram=None, windows=None):
+        # Inserts a result row with its data rate LogHistogram and SPC windows in one transaction,
+        # so a crash cannot leave the row without them. Returns True if the result is new.
+        values = self._values(row)
+        with self._connection:
+            result_id = self._insert_row(values)
+            if result_id is None:
+                return False
+            if histogram is not None:
+                self._connection.execute("INSERT INTO result_histograms VALUES (?, ?)",
+                                         (result_id, json.dumps(histogram.to_dict())))
+                self._merge_daily_histogram(values['sensor_part_number'], values['start_time'][:10], histogram)
+            if windows is not None:
+                self._insert_windows(result_id, windows)
+        return True
+
+    def insert_rows(self, rows):
+        # Inserts result rows (dicts keyed by the result CSV columns) in one transaction and
+        # returns the number of new rows
+        inserted = 0
+        with self._connection:
+            for row in rows:
+                if self._insert_row(self._values(row)) is not None:
+                    inserted += 1
+        return inserted
+
+    def insert_deliveries(self, deliveries):
+        # Stores result batches of stations in one transaction. `deliveries` is a list of
+        # (station_id, epoch, entries) with entries {'seq': ..., 'row': ..., 'histogram': ...,
+        # 'windows': ...} in sequence order. Entries with a sequence number the station already
+        # delivered are skipped, so a batch can be sent again after a lost acknowledgement.
+        # Returns the last delivered sequence number of every batch.
+        last_seqs = []
+        # Histograms are merged per part number and day first, so a batch updates every daily
+        # histogram once
+        daily_histograms = {}
+        with self._connection:
+            for station_id, epoch, entries in deliveries:
+                delivered = self._connection.execute(
+                    "SELECT last_seq FROM deliveries WHERE station_id = ? AND epoch = ?",
+                    (station_id, epoch)).fetchone()
+                last_seq = delivered['last_seq'] if delivered else 0
+                for entry in entries:
+                    if entry['seq'] <= last_seq:
+                        continue
+                    last_seq = entry['seq']
+                    values = self._values(entry['row'])
+                    result_id = self._insert_row(values)
+                    if result_id is None:
+                        continue
+                    if entry.get('windows'):
+                        self._insert_windows(result_id, entry['windows'])
+                    if entry.get('histogram'):
+                        self._connection.execute("INSERT INTO result_histograms VALUES (?, ?)",
+                                                 (result_id, json.dumps(entry['histogram'])))
+                        key = (values['sensor_part_number'], values['start_time'][:10])
+                        histogram = LogHistogram.from_dict(entry['histogram'])
+                        if key in daily_histograms:
+                            daily_histograms[key][0] += 1
+                            daily_histograms[key][1].merge(histogram)
+                        else:
+                            daily_histograms[key] = [1, histogram]
+                self._connection.execute("INSERT OR REPLACE INTO deliveries VALUES (?, ?, ?)",
+                                         (station_id, epoch, last_seq))
+                last_seqs.append(last_seq)
+            for (part, day), (tests, histogram) in daily_histograms.items():
+                self._merge_daily_histogram(part, day, histogram, tests)
+        return last_seqs
+
+    def import_csv(self, paths):
+        rows = []
+        for path in paths:
+            with open(path, newline='', encoding='utf-8-sig') as file:
+                rows.extend(csv.DictReader(file))
+        return self.insert_rows(rows)
+
+    def results(self, part=None, serial=None, since=None, until=None, limit=None):
+        where, parameters = self._where(part, serial, since, until)
+        query = f"SELECT * FROM results{where} ORDER BY start_time"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        return [dict(row) for row in self._connection.execute(query, parameters)]
+
+    def windows(self, serial, start_time=None):
+        # SPC windows of the result of `serial` that started at `start_time`, of its latest result by default
+        query = "SELECT id, start_time FROM results WHERE serial_number = ?"
+        parameters = [serial]
+        if start_time is not None:
+            query += " AND start_time = ?"
+            parameters.append(_timestamp(start_time))
+        result = self._connection.execute(query + " ORDER BY start_time DESC LIMIT 1", parameters).fetchone()
+        if result is None:
+            return []
+        return [dict(row, serial_number=serial, start_time=result['start_time']) for row in self._connection.execute(
+            "SELECT start, samples, mean, min, max FROM result_windows WHERE result_id = ? ORDER BY start",
+            (result['id'],))]
+
+    def yield_by_part(self, part=None, since=None, until=None):
+        # Yield and data rate summary per part number. Like every query, it covers the results
+        # started from `since` up to but excluding `until`. Whole days are summed from the daily
+        # aggregates, other time windows from the results.
+        if _whole_days(since, until):
+            where, parameters = self._daily_where(part, since, until)
+            query = ("SELECT sensor_part_number, sum(tests) AS tests, sum(passed) AS passed, sum(rates) AS rates, "
+                     "sum(rate_sum) AS rate_sum, sum(rate_sum_squares) AS rate_sum_squares, min(rate_min) AS rate_min, max(rate_max) AS rate_max "
+                     f"FROM part_daily{where} GROUP BY sensor_part_number ORDER BY sensor_part_number")
+        else:
+            where, parameters = self._where(part, None, since, until)
+            query = ("SELECT sensor_part_number, count(*) AS tests, sum(test_status = 'PASS') AS passed, "
+                     "count(average_data_rate) AS rates, total(average_data_rate) AS rate_sum, "
+                     "total(average_data_rate * average_data_rate) AS rate_sum_squares, "
+                     "min(average_data_rate) AS rate_min, max(average_data_rate) AS rate_max "
+                     f"FROM results{where} GROUP BY sensor_part_number ORDER BY sensor_part_number")
+        summaries = []
+        for row in self._connection.execute(query, parameters):
+            tests, rates = row['tests'], row['rates']
+            mean = row['rate_sum'] / rates if rates else None
+            variance = max(row['rate_sum_squares'] / rates - mean * mean, 0.0) if rates else 0.0
+            summaries.append({'sensor_part_number': row['sensor_part_number'], 'tests': tests,
+                              'passed': row['passed'], 'failed': tests - row['passed'],
+                              'yield': row['passed'] / tests, 'average_data_rate': mean,
+                              'data_rate_std_dev': math.sqrt(variance),
+                              'data_rate_min': row['rate_min'], 'data_rate_max': row['rate_max']})
+        return summaries
+
+    def distribution(self, part=None, since=None, until=None, percents=REPORTED_PERCENTILES):
+        # Data rate percentiles over all samples of the results per part number, merged from the
+        # daily histograms for whole days, otherwise from the histograms of the results
+        if _whole_days(since, until):
+            where, parameters = self._daily_where(part, since, until)
+            query = ("SELECT sensor_part_number, tests, histogram FROM part_daily_histograms"
+                     f"{where} ORDER BY sensor_part_number, day")
+        else:
+            where, parameters = self._where(part, None, since, until)
+            query = ("SELECT sensor_part_number, 1 AS tests, histogram FROM result_histograms "
+                     f"JOIN results ON results.id = result_id{where} ORDER BY sensor_part_number, start_time")
+        histograms, tests = {}, {}
+        for row in self._connection.execute(query, parameters):
+            part_number = row['sensor_part_number']
+            histogram = LogHistogram.from_dict(json.loads(row['histogram']))
+            if part_number in histograms:
+                histograms[part_number].merge(histogram)
+            else:
+                histograms[part_number] = histogram
+            tests[part_number] = tests.get(part_number, 0) + row['tests']
+        return [dict({'sensor_part_number': part_number, 'tests': tests[part_number], 'samples': histogram.count,
+                      'min': histogram.min if histogram.count else None,
+                      'max': histogram.max if histogram.count else None}, **histogram.percentiles(percents))
+                for part_number, histogram in histograms.items()]
+
+    def trend(self, column='average_data_rate', bucket='day', part=None, serial=None, since=None, until=None):
+        # Count, mean, min and max of a result column and the yield per time bucket
+        self._check_column(column)
+        where, parameters = self._where(part, serial, since, until)
+        label = f"strftime('{BUCKETS[bucket]}', start_time)"
+        query = (f"SELECT {label} AS bucket, count(*) AS tests, avg({column}) AS mean, min({column}) AS min, "
+                 f"max({column}) AS max, sum(test_status = 'PASS') AS passed "
+                 f"FROM results{where} GROUP BY bucket ORDER BY bucket")
+        return [dict(row, column=column, **{'yield': row['passed'] / row['tests']})
+                for row in self._connection.execute(query, parameters)]
+
+    def percentiles(self, column='average_data_rate', percents=(5, 50, 95), part=None, serial=None, since=None,
+                    until=None):
+        self._check_column(column)
+        where, parameters = self._where(part, serial, since, until)
+        where += (" AND " if where else " WHERE ") + f"{column} IS NOT NULL"
+        values = [row[0] for row in
+                  self._connection.execute(f"SELECT {column} FROM results{where} ORDER BY {column}", parameters)]
+        summary = {'column': column, 'count': len(values)}
+        for percent in percents:
+            summary[f'p{percent:g}'] = _percentile(values, percent) if values else None
+        return summary
+
+    def rebuild_aggregates(self):
+        # Recomputes the daily aggregates from the results table
+        with self._connection:
+            self._connection.execute("DELETE FROM part_daily")
+            for row in self._connection.execute("SELECT * FROM results").fetchall():
+                self._update_aggregates(dict(row))
+            self._connection.execute("DELETE FROM part_daily_histograms")
+            for row in self._connection.execute(
+                    "SELECT sensor_part_number, start_time, histogram FROM result_histograms "
+                    "JOIN results ON results.id = result_id").fetchall():
+                self._merge_daily_histogram(row['sensor_part_number'], row['start_time'][:10],
+                                            LogHistogram.from_dict(json.loads(row['histogram'])))
+
+    def _add_missing_columns(self):
+        existing = {row['name'] for row in self._connection.execute("PRAGMA table_info(results)")}
+        with self._connection:
+            for name, column_type in ADDED_COLUMNS.items():
+                if name not in existing:
+                    self._connection.execute(f"ALTER TABLE results ADD COLUMN {name} {column_type}")
+
+    def _values(self, row):
+        values = {name: row.get(column) for column, name in COLUMN_NAMES.items()}
+        values['start_time'] = _timestamp(values['start_time'])
+        values['end_time'] = _timestamp(values['end_time'])
+        values['sensor_part_number'] = str(values['sensor_part_number'] or '')
+        values['serial_number'] = str(values['serial_number'] or '')
+        for name in NUMERIC_COLUMNS:
+            values[name] = _number(values[name], int if name in ('errors', 'samples') else float)
+        values['stop_reason'] = values['stop_reason'] or None
+        return values
+
+    def _update_aggregates(self, values):
+        rate = values['average_data_rate']
+        self._connection.execute(UPDATE_PART_DAILY, (
+            values['sensor_part_number'], values['start_time'][:10], int(values['test_status'] == 'PASS'),
+            int(rate is not None), rate or 0.0, (rate or 0.0) ** 2, rate, rate))
+
+    def _insert_row(self, values):
+        # Inserts one result inside the caller's transaction, returns its id or None if it is
+        # incomplete or already stored
+        if values['start_time'] is None or not values['serial_number']:
+            return None
+        cursor = self._connection.execute(
+            f"INSERT OR IGNORE INTO results ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+            list(values.values()))
+        if not cursor.rowcount:
+            return None
+        self._update_aggregates(values)
+        return cursor.lastrowid
+
+    def _insert_windows(self, result_id, windows):
+        cursor = self._connection.executemany(
+            "INSERT OR IGNORE INTO result_windows VALUES (?, ?, ?, ?, ?, ?)",
+            zip([result_id] * len(windows['start']), windows['start'], windows['samples'], windows['mean'],
+                windows['min'], windows['max']))
+        return cursor.rowcount
+
+    def _merge_daily_histogram(self, part, day, histogram, tests=1):
+        # Merges the histogram of `tests` results into the daily one. Called inside the transaction
+        # of the insert, so the read and the write cannot interleave with another station
+        row = self._connection.execute(
+            "SELECT tests, histogram FROM part_daily_histograms WHERE sensor_part_number = ? AND day = ?",
+            (part, day)).fetchone()
+        if row is None:
+            daily_tests, daily = 0, LogHistogram(histogram.relative_accuracy)
+        else:
+            daily_tests, daily = row['tests'], LogHistogram.from_dict(json.loads(row['histogram']))
+        daily.merge(histogram)
+        self._connection.execute("INSERT OR REPLACE INTO part_daily_histograms VALUES (?, ?, ?, ?)",
+                                 (part, day, daily_tests + tests, json.dumps(daily.to_dict())))
+
+    def _where(self, part, serial, since, until):
+        # Time windows are half-open: results started at `since` are in, the ones at `until` not
+        where, parameters = [], []
+        if part is not None:
+            where.append("sensor_part_number = ?")
+            parameters.append(part)
+        if serial is not None:
+            where.append("serial_number = ?")
+            parameters.append(serial)
+        if since is not None:
+            where.append("start_time >= ?")
+            parameters.append(_timestamp(since))
+        if until is not None:
+            where.append("start_time < ?")
+            parameters.append(_timestamp(until))
+        return (' WHERE ' + ' AND '.join(where) if where else ''), parameters
+
+    def _daily_where(self, part, since, until):
+        # Same time window as _where() for the daily aggregates, `since` and `until` are midnights
+        where, parameters = [], []
+        if part is not None:
+            where.append("sensor_part_number = ?")
+            parameters.append(part)
+        if since is not None:
+            where.append("day >= ?")
+            parameters.append(_timestamp(since)[:10])
+        if until is not None:
+            where.append("day < ?")
+            parameters.append(_timestamp(until)[:10])
+        return (' WHERE ' + ' AND '.join(where) if where else ''), parameters
+
+    def _check_column(self, column):
+        # Column names are put into the SQL text, only allow known ones
+        if column not in NUMERIC_COLUMNS:
+            raise ValueError(f"Unknown result column {column!r}, expected one of {', '.join(NUMERIC_COLUMNS)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the test results database, or import result CSV files "
+                                                 "into it. Query results are printed as JSON lines.")
+    parser.add_argument("database", help="results database file (*.sqlite)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="import result CSV files")
+    import_parser.add_argument("sources", nargs="+", help="result CSV files to import")
+    for name, description in (("results", "list results"), ("yield", "yield per part number"),
+                              ("trend", "trend of a result column over time"),
+                              ("percentiles", "percentiles of a result column")):
+        query_parser = commands.add_parser(name, help=description)
+        query_parser.add_argument("--part", help="sensor part number")
+        query_parser.add_argument("--since", help="start of the time window (ISO date or time)")
+        query_parser.add_argument("--until", help="end of the time window, excluded (ISO date or time)")
+        if name != "yield":
+            query_parser.add_argument("--serial", help="sensor serial number")
+        if name in ("trend", "percentiles"):
+            query_parser.add_argument("--column", default="average_data_rate", choices=NUMERIC_COLUMNS)
+    distribution_parser = commands.add_parser("distribution",
+                                              help="data rate percentiles over all samples per part number")
+    distribution_parser.add_argument("--part", help="sensor part number")
+    distribution_parser.add_argument("--since", help="start of the time window (ISO date or time)")
+    distribution_parser.add_argument("--until", help="end of the time window, excluded (ISO date or time)")
+    distribution_parser.add_argument("--percent", type=float, action="append",
+                                     help="percentile to compute, may be repeated (default 1, 5, 50, 95, 99)")
+    windows_parser = commands.add_parser("windows", help="SPC windows of a result")
+    windows_parser.add_argument("serial", help="sensor serial number")
+    windows_parser.add_argument("--start-time", help="start time of the result (default: the latest one)")
+    commands.choices["results"].add_argument("--limit", type=int, help="maximum number of results")
+    commands.choices["trend"].add_argument("--bucket", default="day", choices=sorted(BUCKETS))
+    commands.choices["percentiles"].add_argument("--percent", type=float, action="append",
+                                                 help="percentile to compute, may be repeated (default 5, 50, 95)")
+    args = parser.parse_args(argv)
+
+    database = ResultsDatabase(args.database)
+    try:
+        if args.command == "import":
+            imported = database.import_csv(args.sources)
+            print(f"Imported {imported} new rows into {args.database}")
+            return 0
+        if args.command == "results":
+            rows = database.results(args.part, args.serial, args.since, args.until, args.limit)
+        elif args.command == "windows":
+            rows = database.windows(args.serial, args.start_time)
+        elif args.command == "distribution":
+            rows = database.distribution(args.part, args.since, args.until, args.percent or REPORTED_PERCENTILES)
+        elif args.command == "yield":
+            rows = database.yield_by_part(args.part, args.since, args.until)
+        elif args.command == "trend":
+            rows = database.trend(args.column, args.bucket, args.part, args.serial, args.since, args.until)
+        else:
+            rows = [database.percentiles(args.column, args.percent or (5, 50, 95), args.part, args.serial,
+                                         args.since, args.until)]
+        for row in rows:
+            print(json.dumps(row))
+    finally:
+        database.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import argparse
+import codecs
+import csv
+import io
+import os
+import sys
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+# Column schema of the test result CSV, in file order. Files created before 'Stop reason',
+# 'Samples' and the percentiles were added get them appended to their header, see ResultsWriter.
+RESULT_COLUMNS = ['Test starting time', 'Sensor name', 'Sensor Serial Number', 'Minimum Data Rate Limit',
+                  'Maximum Data Rate Limit', 'Average data rate', 'Maximum Standard Deviation Limit',
+                  'Standard Deviation', 'Errors', 'Test status', 'Test end time', 'Stop reason', 'Samples',
+                  'P1 data rate', 'P99 data rate']
+
+
+def lock_file(file):
+    # Exclusive lock on the whole file, blocks until other stations release it
+    if sys.platform == 'win32':
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+    else:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+
+def unlock_file(file):
+    if sys.platform == 'win32':
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def _format_value(value):
+    if value is None:
+        return ''
+    return str(value)
+
+
+class ResultsWriter:
+    # Appends test results to a CSV file one row at a time. Every append takes an
+    # exclusive lock, writes only the new rows and fsyncs, so a crash can at most lose
+    # the row being written and several stations can share the same file.
+    def __init__(self, path, columns=RESULT_COLUMNS):
+        self.path = path
+        self.columns = list(columns)
+
+    def append(self, row):
+        self.append_rows([row])
+
+    def append_rows(self, rows):
+        # Opened for reading and writing rather than appending, so a header that lacks columns
+        # can be extended in place. Every write happens under the lock.
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+        with open(fd, 'r+b') as file:
+            lock_file(file)
+            try:
+                file.seek(0, os.SEEK_END)
+                if file.tell() == 0:
+                    columns, line_terminator, prefix = self.columns, os.linesep, ''
+                    write_header = True
+                else:
+                    columns, line_terminator, prefix = self._read_layout(file)
+                    write_header = False
+                    file.seek(0, os.SEEK_END)
+                buffer = io.StringIO()
+                buffer.write(prefix)
+                writer = csv.writer(buffer, lineterminator=line_terminator)
+                if write_header:
+                    writer.writerow(columns)
+                for row in rows:
+                    # Keep the column order of the existing file, unknown columns are left empty
+                    writer.writerow([_format_value(row.get(column)) for column in columns])
+                file.write(buffer.getvalue().encode('utf-8'))
+                file.flush()
+                os.fsync(file.fileno())
+            finally:
+                unlock_file(file)
+
+    def import_csv(self, paths):
+        # Bulk import of existing result files, written with a single lock and fsync
+        rows = []
+        for path in paths:
+            with open(path, newline='', encoding='utf-8-sig') as file:
+                rows.extend(csv.DictReader(file))
+        if rows:
+            self.append_rows(rows)
+        return len(rows)
+
+    def _read_layout(self, file):
+        # Returns the header columns and line terminator of the existing file, plus a
+        # prefix that terminates an unfinished last line
+        file.seek(0)
+        header = file.readline()
+        line_terminator = '\r\n' if header.endswith(b'\r\n') else '\n'
+        columns = next(csv.reader([header.decode('utf-8-sig')]), None) or self.columns
+        missing = [column for column in self.columns if column not in columns]
+        if missing:
+            columns = columns + missing
+            self._extend_header(file, header, columns, line_terminator)
+            print(f"Added the columns {', '.join(missing)} to the header of {self.path}")
+        file.seek(-1, os.SEEK_END)
+        prefix = '' if file.read(1) == b'\n' else line_terminator
+        return columns, line_terminator, prefix
+
+    def _extend_header(self, file, header, columns, line_terminator):
+        # Rewrites the file with the new header, the rows stay as they are (short rows read as
+        # empty columns). A copy of the file is kept until the new content is on disk, so a
+        # crash in between leaves the old content next to the file.
+        file.seek(0)
+        content = file.read()
+        backup_path = self.path + '.bak'
+        with open(backup_path, 'wb') as backup:
+            backup.write(content)
+            backup.flush()
+            os.fsync(backup.fileno())
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator=line_terminator).writerow(columns)
+        bom = codecs.BOM_UTF8 if header.startswith(codecs.BOM_UTF8) else b''
+        file.seek(0)
+        file.write(bom + buffer.getvalue().encode('utf-8') + content[len(header):])
+        file.flush()
+        os.fsync(file.fileno())
+        os.remove(backup_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import existing test result CSV files into a results file.")
+    parser.add_argument("target", help="result CSV file to append to")
+    parser.add_argument("sources", nargs="+", help="result CSV files to import")
+    args = parser.parse_args()
+    imported = ResultsWriter(args.target).import_csv(args.sources)
+    print(f"Imported {imported} rows into {args.target}")
+
+
+if __name__ == '__main__':
+    main()
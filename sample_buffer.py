@@ -0,0 +1,80 @@
+import math
+import threading
+
+# Number of most recent samples kept for plotting
+DEFAULT_CAPACITY = 100_000
+
+
+class SampleRingBuffer:
+    # Fixed-size ring buffer of (elapsed time, value) samples. The acquisition thread appends
+    # whole batches, the GUI thread reads a min/max decimated copy at its own frame rate.
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        import numpy as np
+
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+        # Incremented on every change so readers can skip redrawing an unchanged buffer
+        self.version = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self.count = 0
+            self._next = 0
+            self.version += 1
+
+    def extend(self, timestamp, values):
+        # Adds a batch of values that arrived at `timestamp` (seconds since the test start)
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64).ravel()[-self.capacity:]
+        size = values.size
+        if size == 0:
+            return
+        with self._lock:
+            first = min(size, self.capacity - self._next)
+            self.times[self._next:self._next + first] = timestamp
+            self.values[self._next:self._next + first] = values[:first]
+            # Wrap around to the start of the arrays
+            self.times[:size - first] = timestamp
+            self.values[:size - first] = values[first:]
+            self._next = (self._next + size) % self.capacity
+            self.count = min(self.count + size, self.capacity)
+            self.version += 1
+
+    def ordered(self):
+        # Copies of the stored times and values, oldest first
+        import numpy as np
+
+        with self._lock:
+            if self.count < self.capacity:
+                return self.times[:self.count].copy(), self.values[:self.count].copy()
+            return (np.concatenate((self.times[self._next:], self.times[:self._next])),
+                    np.concatenate((self.values[self._next:], self.values[:self._next])))
+
+    def decimate(self, bins, start, end):
+        # Reduces the samples between `start` and `end` seconds to `bins` equal time bins and
+        # returns (minimums, maximums) arrays; bins without samples are NaN. The cost only
+        # depends on the capacity, not on how long the test runs or how fast samples arrive.
+        import numpy as np
+
+        minimums = np.full(bins, math.nan)
+        maximums = np.full(bins, math.nan)
+        times, values = self.ordered()
+        if end <= start or times.size == 0:
+            return minimums, maximums
+        # Times are appended in order, so both the visible range and the bins are contiguous
+        first = np.searchsorted(times, start, side='left')
+        last = np.searchsorted(times, end, side='right')
+        times, values = times[first:last], values[first:last]
+        if times.size == 0:
+            return minimums, maximums
+        bin_index = np.minimum(((times - start) * (bins / (end - start))).astype(np.int64), bins - 1)
+        bin_starts = np.searchsorted(bin_index, np.arange(bins), side='left')
+        filled = np.diff(np.append(bin_starts, times.size)) > 0
+        minimums[filled] = np.minimum.reduceat(values, bin_starts[filled])
+        maximums[filled] = np.maximum.reduceat(values, bin_starts[filled])
+        return minimums, maximums
@@ -0,0 +1,345 @@
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+from datetime import datetime, timedelta
+
+from line_parser import SAMPLE_FIELD
+from streaming_stats import StreamingStats
+
+# A sample file starts with a HEADER_SIZE header: magic, the header fields below and the JSON
+# metadata (column names, test configuration, ...). Then follow chunks of `chunk_samples`
+# rows. A chunk stores its columns one after the other as float64, so a column of a chunk is
+# one contiguous array. Columns: elapsed time, cumulative error count, then the parsed fields.
+SAMPLE_FILE_MAGIC = b'CMDSMP1\n'
+HEADER_SIZE = 64 * 1024
+# Sample count, start time (Unix time), samples per chunk, length of the JSON metadata
+HEADER_FIELDS = struct.Struct('<QdII')
+TIME_COLUMN = 'time'
+ERRORS_COLUMN = 'errors'
+DEFAULT_CHUNK_SAMPLES = 64 * 1024
+# Maximum time between two flushes of the mapped pages to disk
+FLUSH_INTERVAL = 1.0
+# Length of the intervals of the hourly breakdown in seconds
+BREAKDOWN_INTERVAL = 3600.0
+SAMPLE_FILE_SUFFIX = '.samples'
+
+
+def sample_file_path(sample_dir, serial_number, start_time):
+    safe_serial = ''.join(c if c.isalnum() or c in '-_' else '_' for c in serial_number)
+    return os.path.join(sample_dir, f"{safe_serial}_{start_time:%Y%m%d_%H%M%S_%f}{SAMPLE_FILE_SUFFIX}")
+
+
+def soak_options(config):
+    # The optional "soak" section of the test configuration, true or
+    # {"sample_dir": "...", "chunk_samples": 65536}. Returns None when soak mode is off.
+    options = config.options.get("soak")
+    if not options:
+        return None
+    if options is True:
+        options = {}
+    return options
+
+
+class SampleFileWriter:
+    # Append-only writer of a sample file. Only the chunk being filled is mapped, so the memory
+    # use does not grow with the test run time. The rows are in the mapped pages as soon as
+    # they are appended and the sample count in the header is updated afterwards, so a reader
+    # (or a later run after a crash) always sees complete rows.
+    # With a `count`, an existing file is continued after its first `count` rows (a test resumed
+    # from a checkpoint), rows it has after them are overwritten.
+    def __init__(self, path, field_names, start_time, metadata=None, chunk_samples=DEFAULT_CHUNK_SAMPLES, count=0):
+        self.path = path
+        self.columns = [TIME_COLUMN, ERRORS_COLUMN] + list(field_names)
+        self.chunk_samples = int(chunk_samples)
+        self.count = int(count)
+        self._metadata = dict(metadata or {}, columns=self.columns)
+        if self.count:
+            self._file = open(path, 'r+b')
+        else:
+            self._file = open(path, 'w+b')
+            self._file.truncate(HEADER_SIZE)
+        self._header = mmap.mmap(self._file.fileno(), HEADER_SIZE)
+        self._header[:len(SAMPLE_FILE_MAGIC)] = SAMPLE_FILE_MAGIC
+        self._start_time = start_time.timestamp()
+        self._write_metadata(self._metadata)
+        self._chunk = None
+        self._chunk_index = -1
+        self._last_flush = time.monotonic()
+
+    @property
+    def chunk_bytes(self):
+        return len(self.columns) * self.chunk_samples * 8
+
+    def append(self, elapsed, fields, errors):
+        # Appends one batch: `fields` maps the field names to float64 arrays of equal length,
+        # every row gets the elapsed time and the error count of the test so far
+        count = len(next(iter(fields.values()))) if fields else 0
+        done = 0
+        while done < count:
+            row = (self.count + done) % self.chunk_samples
+            if row == 0 or self._chunk is None:
+                self._map_chunk((self.count + done) // self.chunk_samples)
+            take = min(count - done, self.chunk_samples - row)
+            self._chunk[0, row:row + take] = elapsed
+            self._chunk[1, row:row + take] = errors
+            for column, name in enumerate(self.columns[2:], start=2):
+                self._chunk[column, row:row + take] = fields[name][done:done + take]
+            done += take
+        self.count += count
+        self._write_count()
+        now = time.monotonic()
+        if now - self._last_flush >= FLUSH_INTERVAL:
+            self._last_flush = now
+            self.flush()
+
+    def flush(self):
+        if self._chunk is not None:
+            self._chunk.flush()
+        self._header.flush()
+
+    def close(self, stop_reason=None, elapsed=None, errors=None):
+        # How the test ended goes into the metadata, a file without it is from a crashed test.
+        # `errors` is the final error count, the rows only have the count as of their batch.
+        if self._file is None:
+            return
+        if stop_reason is not None:
+            self._write_metadata(dict(self._metadata, end={'stop_reason': stop_reason, 'elapsed': elapsed,
+                                                           'errors': errors}))
+        self.flush()
+        self._chunk = None
+        self._header.close()
+        self._file.close()
+        self._file = None
+
+    def _map_chunk(self, chunk_index):
+        import numpy as np
+
+        if chunk_index == self._chunk_index:
+            return
+        if self._chunk is not None:
+            self._chunk.flush()
+        offset = HEADER_SIZE + chunk_index * self.chunk_bytes
+        self._file.truncate(offset + self.chunk_bytes)
+        self._chunk = np.memmap(self._file, dtype=np.float64, mode='r+', offset=offset,
+                                shape=(len(self.columns), self.chunk_samples))
+        self._chunk_index = chunk_index
+
+    def _write_metadata(self, metadata):
+        header_metadata = json.dumps(metadata).encode('utf-8')
+        if len(SAMPLE_FILE_MAGIC) + HEADER_FIELDS.size + len(header_metadata) > HEADER_SIZE:
+            raise ValueError("The metadata does not fit into the sample file header")
+        self._metadata_length = len(header_metadata)
+        metadata_offset = len(SAMPLE_FILE_MAGIC) + HEADER_FIELDS.size
+        self._header[metadata_offset:metadata_offset + len(header_metadata)] = header_metadata
+        self._write_count()
+
+    def _write_count(self):
+        HEADER_FIELDS.pack_into(self._header, len(SAMPLE_FILE_MAGIC), self.count, self._start_time,
+                                self.chunk_samples, self._metadata_length)
+
+
+class SampleFileReader:
+    # Reads a sample file, also one that is still being written or was cut short by a crash.
+    # Chunks are mapped one at a time, so reading a long test does not need more memory either.
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            header = file.read(HEADER_SIZE)
+        if not header.startswith(SAMPLE_FILE_MAGIC):
+            raise ValueError(f"{path} is not a sample file")
+        count, self.start_time, self.chunk_samples, metadata_length = \
+            HEADER_FIELDS.unpack_from(header, len(SAMPLE_FILE_MAGIC))
+        metadata_offset = len(SAMPLE_FILE_MAGIC) + HEADER_FIELDS.size
+        self.metadata = json.loads(header[metadata_offset:metadata_offset + metadata_length].decode('utf-8'))
+        self.columns = self.metadata['columns']
+        # {'stop_reason': ..., 'elapsed': ..., 'errors': ...} of a test that ended normally, None after a crash
+        self.end = self.metadata.get('end')
+        self.chunk_bytes = len(self.columns) * self.chunk_samples * 8
+        self.chunk_count = min(math.ceil(count / self.chunk_samples),
+                               (os.path.getsize(path) - HEADER_SIZE) // self.chunk_bytes)
+        self.count = min(count, self.chunk_count * self.chunk_samples)
+
+    @property
+    def field_names(self):
+        return self.columns[2:]
+
+    @property
+    def last_time(self):
+        # Elapsed time of the last complete row, 0 without rows
+        import numpy as np
+
+        if not self.count:
+            return 0.0
+        offset = HEADER_SIZE + (self.count - 1) // self.chunk_samples * self.chunk_bytes
+        chunk = np.memmap(self.path, dtype=np.float64, mode='r', offset=offset, shape=(self.chunk_samples,))
+        return float(chunk[(self.count - 1) % self.chunk_samples])
+
+    def chunks(self):
+        # Yields every chunk as a dict column name -> array view of its complete rows
+        import numpy as np
+
+        for chunk_index in range(self.chunk_count):
+            rows = min(self.chunk_samples, self.count - chunk_index * self.chunk_samples)
+            offset = HEADER_SIZE + chunk_index * self.chunk_bytes
+            chunk = np.memmap(self.path, dtype=np.float64, mode='r', offset=offset,
+                              shape=(len(self.columns), self.chunk_samples))
+            yield {name: chunk[column, :rows] for column, name in enumerate(self.columns)}
+
+    def statistics(self):
+        # StreamingStats of every field, merged chunk by chunk, and the final error count
+        stats = {name: StreamingStats() for name in self.field_names}
+        errors = 0
+        for chunk in self.chunks():
+            for name, field_stats in stats.items():
+                field_stats.update_batch(chunk[name], skip_nan=True)
+            errors = int(chunk[ERRORS_COLUMN][-1])
+        return stats, self._final_errors(errors)
+
+    def breakdown(self, sample_field=SAMPLE_FIELD, interval=BREAKDOWN_INTERVAL):
+        # Statistics per `interval` seconds of the test (hours by default), as a list of dicts
+        import numpy as np
+
+        intervals = {}
+        for chunk in self.chunks():
+            indexes = (chunk[TIME_COLUMN] // interval).astype(np.int64)
+            # Rows are in time order, so every interval is one run of equal indexes
+            boundaries = np.concatenate(([0], np.flatnonzero(np.diff(indexes)) + 1, [len(indexes)]))
+            for begin, end in zip(boundaries[:-1], boundaries[1:]):
+                index = int(indexes[begin])
+                if index not in intervals:
+                    intervals[index] = ({name: StreamingStats() for name in self.field_names}, [0])
+                stats, last_errors = intervals[index]
+                for name, field_stats in stats.items():
+                    field_stats.update_batch(chunk[name][begin:end], skip_nan=True)
+                last_errors[0] = int(chunk[ERRORS_COLUMN][end - 1])
+        if self._final_errors(0):
+            # Errors after the last sample count in the interval the test ended in
+            index = int(self.end['elapsed'] // interval)
+            if index not in intervals:
+                intervals[index] = ({name: StreamingStats() for name in self.field_names}, [0])
+            intervals[index][1][0] = self.end['errors']
+        rows = []
+        previous_errors = 0
+        for index in sorted(intervals):
+            stats, last_errors = intervals[index]
+            samples = stats[sample_field]
+            rows.append({'interval': index, 'start_time': self.start_time + index * interval,
+                         'samples': samples.count, 'mean': samples.mean, 'std_dev': samples.std_dev,
+                         'min': samples.min if samples.count else 0.0, 'max': samples.max if samples.count else 0.0,
+                         'errors': last_errors[0] - previous_errors,
+                         'fields': {name: field_stats.mean for name, field_stats in stats.items()
+                                    if name != sample_field and field_stats.count}})
+            previous_errors = last_errors[0]
+        return rows
+
+    def _final_errors(self, errors):
+        # The error count of the test, the one of its last row unless the end metadata has it
+        if self.end is not None and self.end.get('errors') is not None:
+            return self.end['errors']
+        return errors
+
+
+def replay_sample_file(path, config=None):
+    # Evaluates the samples of a sample file again and returns the TestResult, like
+    # stream_capture.replay_capture() for a capture. `config` replaces the recorded configuration,
+    # e.g. to try new limits. The samples were parsed when they were recorded, so the parser
+    # settings of `config` do not apply and the error count is the recorded one. Errors after the
+    # last sample (lines without samples, COMSERVER exiting) are only known if the test ended normally.
+    import numpy as np
+
+    from log_histogram import LogHistogram
+    from spc import SpcMonitor
+    from test_engine import STOP_COMPLETED, STOP_INTERRUPTED, TestConfig, TestResult
+
+    reader = SampleFileReader(path)
+    if config is None:
+        config = TestConfig(**reader.metadata['config'])
+    run_time = float(config.test_run_time)
+    stats = {name: StreamingStats() for name in reader.field_names}
+    histogram = LogHistogram()
+    spc = SpcMonitor.from_config(config)
+    errors = 0
+    elapsed = 0.0
+    for chunk in reader.chunks():
+        # Rows are in time order, the ones after the test run time are left out
+        rows = int(np.searchsorted(chunk[TIME_COLUMN], run_time, side='right'))
+        times = chunk[TIME_COLUMN][:rows]
+        samples = chunk[SAMPLE_FIELD][:rows]
+        if rows:
+            for name, field_stats in stats.items():
+                field_stats.update_batch(chunk[name][:rows], skip_nan=True)
+            histogram.update_batch(samples)
+            if spc is not None:
+                indexes = (times // spc.window_seconds).astype(np.int64)
+                boundaries = np.concatenate(([0], np.flatnonzero(np.diff(indexes)) + 1, [rows]))
+                for begin, end in zip(boundaries[:-1], boundaries[1:]):
+                    spc.add(float(times[begin]), samples[begin:end])
+            errors = int(chunk[ERRORS_COLUMN][rows - 1])
+            elapsed = float(times[-1])
+        if rows < len(chunk[TIME_COLUMN]):
+            elapsed = run_time
+            break
+    stop_reason = STOP_COMPLETED
+    if reader.end is not None and reader.end['elapsed'] <= run_time:
+        # The whole recorded test is evaluated, it keeps its stop reason and final error count
+        elapsed = reader.end['elapsed']
+        stop_reason = reader.end['stop_reason']
+        if reader.end.get('errors') is not None:
+            errors = reader.end['errors']
+    elif reader.end is not None:
+        elapsed = run_time
+    elif elapsed < run_time:
+        stop_reason = STOP_INTERRUPTED
+    start_time = datetime.fromisoformat(reader.metadata['start_time'])
+    rx_stats = stats.pop(SAMPLE_FIELD)
+    return TestResult(config, reader.metadata.get('serial_number', ''), start_time,
+                      start_time + timedelta(seconds=elapsed), rx_stats, errors, stop_reason, stats,
+                      spc.evaluate(elapsed) if spc is not None else None, histogram)
+
+
+def start_sample_file(config, serial_number, start_time, field_names, count=0):
+    # Starts the sample file of a test if the configuration enables soak mode, otherwise
+    # returns None. The file goes to "sample_dir", next to the result file by default.
+    # A test resumed from a checkpoint continues its file after `count` samples, or after the
+    # rows the file has if it has more (written after the last checkpoint).
+    options = soak_options(config)
+    if options is None:
+        return None
+    sample_dir = options.get("sample_dir") or os.path.join(os.path.dirname(config.test_result_path) or '.',
+                                                           'samples')
+    os.makedirs(sample_dir, exist_ok=True)
+    path = sample_file_path(sample_dir, serial_number, start_time)
+    if count and os.path.exists(path):
+        count = max(count, SampleFileReader(path).count)
+    return SampleFileWriter(path, field_names, start_time,
+                            {'config': config.to_dict(), 'serial_number': serial_number,
+                             'start_time': start_time.isoformat()},
+                            options.get("chunk_samples", DEFAULT_CHUNK_SAMPLES), count)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize soak test sample files, also ones left behind by a "
+                                                 "crashed test, and print one JSON object per file.")
+    parser.add_argument("sample_files", nargs="+", help="sample files (*.samples)")
+    parser.add_argument("--interval", type=float, default=BREAKDOWN_INTERVAL,
+                        help="length of the breakdown intervals in seconds (default: one hour)")
+    parser.add_argument("--sample-field", default=SAMPLE_FIELD, help="field the breakdown is computed for")
+    args = parser.parse_args(argv)
+    for path in args.sample_files:
+        reader = SampleFileReader(path)
+        stats, errors = reader.statistics()
+        summary = {'sample_file': path, 'serial_number': reader.metadata.get('serial_number'),
+                   'start_time': reader.metadata.get('start_time'), 'samples': reader.count, 'errors': errors,
+                   'fields': {name: field_stats.snapshot() for name, field_stats in stats.items()},
+                   'breakdown': reader.breakdown(args.sample_field, args.interval)}
+        print(json.dumps(summary), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+import base64
+import math
+from array import array
+from functools import lru_cache
+
+# Defaults of the "spc" configuration option
+DEFAULT_WINDOW_SECONDS = 1.0
+DEFAULT_CONTROL_LIMIT = 3.0  # Width of the X-bar and R control limits in sigmas
+DEFAULT_CUSUM_K = 0.5  # Slack of the CUSUM in sigmas of a window mean
+DEFAULT_CUSUM_H = 5.0  # Decision interval of the CUSUM
+DEFAULT_EWMA_LAMBDA = 0.2
+DEFAULT_EWMA_WIDTH = 3.0
+DEFAULT_MIN_WINDOW_SAMPLES = 1  # Windows with fewer samples are dropouts
+
+CHECK_XBAR = 'xbar'
+CHECK_RANGE = 'range'
+CHECK_CUSUM = 'cusum'
+CHECK_EWMA = 'ewma'
+CHECK_DROPOUTS = 'dropouts'
+CHECK_DROPOUT_SECONDS = 'dropout_seconds'
+# Check -> option with its limit. A check only decides the verdict if its limit is configured.
+CHECK_LIMITS = {CHECK_XBAR: 'max_xbar_violations', CHECK_RANGE: 'max_range_violations',
+                CHECK_CUSUM: 'max_cusum_alarms', CHECK_EWMA: 'max_ewma_alarms', CHECK_DROPOUTS: 'max_dropouts',
+                CHECK_DROPOUT_SECONDS: 'max_dropout_seconds'}
+
+# SpcMonitor attributes with the closed windows
+WINDOW_ARRAYS = ('indexes', 'counts', 'means', 'minimums', 'maximums')
+
+# Grid of the numerical integration of the range constants, in sigmas
+RANGE_GRID_LIMIT = 8.0
+RANGE_GRID_POINTS = 801
+# With more different window sizes, the range constants are interpolated between this many sizes
+RANGE_CONSTANT_NODES = 16
+
+
+@lru_cache(maxsize=None)
+def _range_constants(n):
+    # d2 and d3 (mean and std dev of the range of n normal samples in sigmas), integrated
+    # numerically so windows of any size get exact limits, not only the tabulated n <= 25
+    import numpy as np
+
+    x = np.linspace(-RANGE_GRID_LIMIT, RANGE_GRID_LIMIT, RANGE_GRID_POINTS)
+    step = x[1] - x[0]
+    cdf = 0.5 * (1.0 + np.array([math.erf(value / math.sqrt(2.0)) for value in x]))
+    d2 = float(np.sum(1.0 - cdf ** n - (1.0 - cdf) ** n) * step)
+    # E[R^2] = 2 * integral over s < t of P(min <= s, max > t)
+    lower, upper = cdf[:, None], cdf[None, :]
+    both = 1.0 - upper ** n - (1.0 - lower) ** n + np.clip(upper - lower, 0.0, None) ** n
+    # Trapezoidal rule over the triangle: half of the diagonal belongs to it
+    mean_square = 2.0 * float(np.sum(np.triu(both, 1)) + 0.5 * np.trace(both)) * step * step
+    return d2, math.sqrt(max(mean_square - d2 * d2, 0.0))
+
+
+def range_constants(sizes):
+    # d2 and d3 arrays for an array of window sizes (>= 2)
+    import numpy as np
+
+    sizes = np.asarray(sizes, dtype=np.float64)
+    nodes = np.unique(sizes).astype(np.int64)
+    if len(nodes) > RANGE_CONSTANT_NODES:
+        nodes = np.unique(np.round(np.geomspace(nodes[0], nodes[-1], RANGE_CONSTANT_NODES)).astype(np.int64))
+    d2_nodes, d3_nodes = zip(*(_range_constants(int(n)) for n in nodes))
+    # Both change slowly with log(n), so the interpolation error is far below the noise of the ranges
+    log_nodes = np.log(nodes)
+    return np.interp(np.log(sizes), log_nodes, d2_nodes), np.interp(np.log(sizes), log_nodes, d3_nodes)
+
+
+class WindowSnapshot:
+    # A closed-window array as of a checkpoint. The arrays only grow, so the reference and the
+    # length are taken on the acquisition thread and the base64 text, which grows with the test
+    # run time, is made by the checkpoint writer thread (see checkpoint.encode_state).
+    def __init__(self, values):
+        self.values = values
+        self.length = len(values)
+
+    def to_json(self):
+        return base64.b64encode(self.values[:self.length].tobytes()).decode('ascii')
+
+
+class SpcMonitor:
+    # Statistical process control over time windows of a test. Samples are binned into
+    # windows of `window_seconds` of test time while the test runs (count, mean, min and
+    # max per window, no samples are kept). evaluate() then runs the checks over all windows:
+    # X-bar and R charts with the within-window sigma estimated from the ranges (R-bar/d2),
+    # two-sided CUSUM and EWMA on the standardized window means to find slow drift, and
+    # dropouts (windows with fewer than min_window_samples samples).
+    def __init__(self, options=None):
+        options = dict(options or {})
+        self.window_seconds = float(options.get("window_seconds", DEFAULT_WINDOW_SECONDS))
+        self.control_limit = float(options.get("control_limit", DEFAULT_CONTROL_LIMIT))
+        self.target = options.get("target")  # Center line, the grand mean if not given
+        self.cusum_k = float(options.get("cusum_k", DEFAULT_CUSUM_K))
+        self.cusum_h = float(options.get("cusum_h", DEFAULT_CUSUM_H))
+        self.ewma_lambda = float(options.get("ewma_lambda", DEFAULT_EWMA_LAMBDA))
+        self.ewma_width = float(options.get("ewma_width", DEFAULT_EWMA_WIDTH))
+        self.min_window_samples = int(options.get("min_window_samples", DEFAULT_MIN_WINDOW_SAMPLES))
+        self.limits = {check: options.get(option) for check, option in CHECK_LIMITS.items()}
+        # Closed windows, one entry per window that got samples
+        self.indexes = array('q')
+        self.counts = array('q')
+        self.means = array('d')
+        self.minimums = array('d')
+        self.maximums = array('d')
+        self._index = None
+        self._count = 0
+        self._sum = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+
+    @classmethod
+    def from_config(cls, config):
+        # Uses the optional "spc" section of the test configuration, true or {"window_seconds": 1.0,
+        # "max_xbar_violations": ..., ...}. Returns None when the SPC analysis is off.
+        options = config.options.get("spc")
+        if not options:
+            return None
+        return cls({} if options is True else options)
+
+    def add(self, elapsed, values):
+        # Adds a batch of samples that arrived at `elapsed` seconds of test time
+        count = len(values)
+        if not count:
+            return
+        index = int(elapsed // self.window_seconds)
+        if index != self._index:
+            self._close_window()
+            self._index = index
+        self._count += count
+        self._sum += float(values.sum())
+        self._min = min(self._min, float(values.min()))
+        self._max = max(self._max, float(values.max()))
+
+    def evaluate(self, elapsed):
+        # Runs the checks over the windows of a test that lasted `elapsed` seconds and returns
+        # the summary stored with the result
+        import numpy as np
+
+        self._close_window()
+        indexes = np.frombuffer(self.indexes, dtype=np.int64)
+        counts = np.frombuffer(self.counts, dtype=np.int64).astype(np.float64)
+        means = np.frombuffer(self.means, dtype=np.float64)
+        minimums = np.frombuffer(self.minimums, dtype=np.float64)
+        maximums = np.frombuffer(self.maximums, dtype=np.float64)
+        ranges = maximums - minimums
+        alarms = dict.fromkeys(CHECK_LIMITS, 0)
+        center = sigma = None
+        if len(counts):
+            center = float(self.target) if self.target is not None else float(np.sum(counts * means) / counts.sum())
+            multi = counts >= 2
+            if multi.any():
+                d2, d3 = range_constants(counts[multi])
+                sigma = float(np.mean(ranges[multi] / d2))
+            if sigma:
+                # X-bar chart, the limits get narrower for windows with more samples
+                standard_errors = sigma / np.sqrt(counts)
+                alarms[CHECK_XBAR] = int(np.count_nonzero(np.abs(means - center) >
+                                                          self.control_limit * standard_errors))
+                # R chart
+                upper = (d2 + self.control_limit * d3) * sigma
+                lower = np.maximum(d2 - self.control_limit * d3, 0.0) * sigma
+                alarms[CHECK_RANGE] = int(np.count_nonzero((ranges[multi] > upper) | (ranges[multi] < lower)))
+                scores = ((means - center) / standard_errors).tolist()
+                alarms[CHECK_CUSUM] = self._cusum_alarms(scores)
+                alarms[CHECK_EWMA] = self._ewma_alarms(scores)
+        # Dropouts among the complete windows of the test
+        complete_windows = int(elapsed // self.window_seconds)
+        window_counts = np.zeros(complete_windows, dtype=np.int64)
+        inside = indexes < complete_windows
+        window_counts[indexes[inside]] = counts[inside]
+        dropped = window_counts < self.min_window_samples
+        alarms[CHECK_DROPOUTS] = int(np.count_nonzero(dropped))
+        alarms[CHECK_DROPOUT_SECONDS] = self._longest_run(dropped) * self.window_seconds
+        checks = {}
+        for check, value in alarms.items():
+            limit = self.limits[check]
+            checks[check] = {'alarms': value, 'limit': limit, 'passed': limit is None or value <= limit}
+        return {'window_seconds': self.window_seconds, 'center': center, 'sigma': sigma,
+                'passed': all(check['passed'] for check in checks.values()), 'checks': checks,
+                'windows': {'start': (indexes * self.window_seconds).tolist(), 'samples': counts.astype(int).tolist(),
+                            'mean': means.tolist(), 'min': minimums.tolist(), 'max': maximums.tolist()}}
+
+    def checkpoint_state(self):
+        # Dict of the windows so far for a checkpoint, see restore(). The window arrays are
+        # stored as base64 of their bytes, encoded later from a WindowSnapshot.
+        state = {name: WindowSnapshot(getattr(self, name)) for name in WINDOW_ARRAYS}
+        state.update(index=self._index, count=self._count, sum=self._sum, min=self._min, max=self._max)
+        return state
+
+    def restore(self, state):
+        for name in WINDOW_ARRAYS:
+            values = getattr(self, name)
+            del values[:]
+            values.frombytes(base64.b64decode(state[name]))
+        self._index = state['index']
+        self._count = state['count']
+        self._sum = state['sum']
+        self._min = state['min']
+        self._max = state['max']
+
+    def _close_window(self):
+        if self._index is None:
+            return
+        self.indexes.append(self._index)
+        self.counts.append(self._count)
+        self.means.append(self._sum / self._count)
+        self.minimums.append(self._min)
+        self.maximums.append(self._max)
+        self._index = None
+        self._count = 0
+        self._sum = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+
+    def _cusum_alarms(self, scores):
+        # Tabular CUSUM in both directions, restarted after every alarm. Recursive, so it runs
+        # once per window rather than vectorized.
+        alarms = 0
+        high = low = 0.0
+        for score in scores:
+            high = max(0.0, high + score - self.cusum_k)
+            low = max(0.0, low - score - self.cusum_k)
+            if high > self.cusum_h or low > self.cusum_h:
+                alarms += 1
+                high = low = 0.0
+        return alarms
+
+    def _ewma_alarms(self, scores):
+        # EWMA of the standardized window means with the exact (time-varying) limits
+        alarms = 0
+        ewma = 0.0
+        weight = 1.0 - self.ewma_lambda
+        factor = self.ewma_lambda / (2.0 - self.ewma_lambda)
+        for number, score in enumerate(scores, start=1):
+            ewma = self.ewma_lambda * score + weight * ewma
+            if abs(ewma) > self.ewma_width * math.sqrt(factor * (1.0 - weight ** (2 * number))):
+                alarms += 1
+        return alarms
+
+    @staticmethod
+    def _longest_run(flags):
+        longest = current = 0
+        for flag in flags.tolist():
+            current = current + 1 if flag else 0
+            longest = max(longest, current)
+        return longest
@@ -0,0 +1,256 @@
+import argparse
+import gzip
+import itertools
+import json
+import math
+import os
+import struct
+import sys
+import time
+import zlib
+from datetime import datetime
+from operator import itemgetter
+
+from comserver_reader import LineSplitter
+from test_engine import STOP_CANCELLED, STOP_COMPLETED, STOP_COMSERVER_EXITED, STOP_EARLY_FAIL, STOP_EARLY_PASS, \
+    TestConfig, TestSession
+
+# A capture file is a gzip stream of records: header (monotonic offset in seconds, stream id,
+# payload length) followed by the payload. The first record holds the JSON metadata of the test,
+# the last one (if the test finished) how it ended. Raw pipe chunks are stored as read, an
+# empty chunk marks the end of a pipe.
+CAPTURE_MAGIC = b'CMDCAP1\n'
+RECORD_HEADER = struct.Struct('<dBI')
+STREAM_IDS = {'stdout': 0, 'stderr': 1}
+STREAM_NAMES = {stream_id: stream for stream, stream_id in STREAM_IDS.items()}
+METADATA_ID = 254
+END_ID = 255
+
+# Maximum time between two flushes of the compressor, older data survives a crash
+FLUSH_INTERVAL = 1.0
+# Size of the blocks a capture is decompressed in
+READ_BLOCK_SIZE = 1024 * 1024
+# Maximum number of bytes of output a replay feeds as one batch
+REPLAY_BATCH_BYTES = 1024 * 1024
+CAPTURE_SUFFIX = '.cap.gz'
+
+
+def capture_path(capture_dir, serial_number, start_time):
+    safe_serial = ''.join(c if c.isalnum() or c in '-_' else '_' for c in serial_number)
+    return os.path.join(capture_dir, f"{safe_serial}_{start_time:%Y%m%d_%H%M%S_%f}{CAPTURE_SUFFIX}")
+
+
+class CaptureWriter:
+    # Records the raw stdout/stderr chunks of one test with monotonic timestamps relative
+    # to `start` (time.monotonic() at the start of the test)
+    def __init__(self, path, metadata, start=None):
+        self.path = path
+        self._file = gzip.open(path, 'wb', compresslevel=6)
+        self._file.write(CAPTURE_MAGIC)
+        self._start = time.monotonic() if start is None else start
+        self._last_flush = self._start
+        self._write_record(METADATA_ID, json.dumps(metadata).encode('utf-8'), 0.0)
+        self._file.flush(zlib.Z_SYNC_FLUSH)
+
+    def write(self, stream, data, read_time=None):
+        # `read_time` is the time.monotonic() the chunk was read, now if not given
+        now = time.monotonic() if read_time is None else read_time
+        self._write_record(STREAM_IDS[stream], data, now - self._start)
+        if now - self._last_flush >= FLUSH_INTERVAL:
+            self._last_flush = now
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self, stop_reason=STOP_COMPLETED, elapsed=None):
+        if self._file is None:
+            return
+        if elapsed is None:
+            elapsed = time.monotonic() - self._start
+        self._write_record(END_ID, json.dumps({'stop_reason': stop_reason, 'elapsed': elapsed}).encode('utf-8'),
+                           elapsed)
+        self._file.close()
+        self._file = None
+
+    def _write_record(self, stream_id, data, timestamp):
+        self._file.write(RECORD_HEADER.pack(timestamp, stream_id, len(data)))
+        self._file.write(data)
+
+
+class CaptureReader:
+    # Reads a capture file. A file cut short by a crash is read up to its last complete record.
+    def __init__(self, path):
+        self.path = path
+        self.metadata = {}
+        self.end = None
+
+    def __iter__(self):
+        # Yields (timestamp, stream, data) for every recorded chunk. The file is decompressed in
+        # large blocks and the records are cut out of them.
+        with gzip.open(self.path, 'rb') as file:
+            if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+                raise ValueError(f"{self.path} is not a capture file")
+            buffer = b''
+            offset = 0
+            while True:
+                if len(buffer) - offset < RECORD_HEADER.size:
+                    buffer, offset = self._read_more(file, buffer[offset:], RECORD_HEADER.size), 0
+                    if len(buffer) < RECORD_HEADER.size:
+                        return
+                timestamp, stream_id, length = RECORD_HEADER.unpack_from(buffer, offset)
+                end = offset + RECORD_HEADER.size + length
+                if end > len(buffer):
+                    buffer, offset = self._read_more(file, buffer[offset:], RECORD_HEADER.size + length), 0
+                    end = RECORD_HEADER.size + length
+                    if end > len(buffer):
+                        return
+                data = buffer[offset + RECORD_HEADER.size:end]
+                offset = end
+                if stream_id == METADATA_ID:
+                    self.metadata = json.loads(data)
+                elif stream_id == END_ID:
+                    self.end = json.loads(data)
+                else:
+                    yield timestamp, STREAM_NAMES[stream_id], data
+
+    def _read_more(self, file, rest, size):
+        # `rest` followed by the next block(s) of the file, at least `size` bytes unless the file
+        # ends (or is cut short) before
+        blocks = [rest]
+        available = len(rest)
+        while available < size:
+            try:
+                # read1() returns what it decompressed, read() would drop it when the file is cut short
+                block = file.read1(READ_BLOCK_SIZE)
+            except (EOFError, zlib.error):
+                block = b''
+            if not block:
+                break
+            blocks.append(block)
+            available += len(block)
+        return b''.join(blocks)
+
+    def read_metadata(self):
+        for _ in self:
+            break
+        return self.metadata
+
+
+def start_capture(config, serial_number, start_time, start_monotonic, reader, key=None):
+    # Starts recording the pipes of `reader` if the configuration has a "capture_dir".
+    # Returns the CaptureWriter or None.
+    capture_dir = config.options.get("capture_dir")
+    if not capture_dir:
+        return None
+    os.makedirs(capture_dir, exist_ok=True)
+    writer = CaptureWriter(capture_path(capture_dir, serial_number, start_time),
+                           {'config': config.to_dict(), 'serial_number': serial_number,
+                            'start_time': start_time.isoformat()}, start_monotonic)
+    # Bytes of a partial line read before the test started belong to its first line
+    for stream, pending in reader.pending_data(key).items():
+        if pending:
+            writer.write(stream, pending)
+    reader.set_capture(writer, key)
+    return writer
+
+
+def replay_capture(path, config=None, realtime=False):
+    # Feeds a capture through the same TestSession evaluation as a live test and returns
+    # the TestResult. `config` replaces the recorded configuration, e.g. to try new limits.
+    capture = CaptureReader(path)
+    records = iter(capture)
+    first_record = next(records, None)
+    if config is None:
+        config = TestConfig(**capture.metadata['config'])
+    session = TestSession(config, capture.metadata.get('serial_number', ''),
+                          datetime.fromisoformat(capture.metadata['start_time']))
+    splitters = {stream: LineSplitter() for stream in STREAM_IDS}
+    open_streams = set(STREAM_IDS)
+    replay_start = time.monotonic()
+    stop_reason = STOP_COMPLETED
+    timed_out = False
+    # Unless the replay is paced or may stop early, the lines of consecutive records are fed as
+    # one batch while they fall into the same SPC window. The result is the same as feeding them
+    # record by record, but the parser and the statistics work on whole arrays.
+    batching = not realtime and session.early_stop is None
+    window_seconds = session.spc.window_seconds if session.spc is not None else math.inf
+    batch = []
+    batch_bytes = 0
+    batch_window = None
+    for timestamp, stream, data in _chain(first_record, records):
+        if timestamp > config.test_run_time:
+            timed_out = True
+            break
+        if batching and data:
+            window = timestamp // window_seconds
+            if window != batch_window or batch_bytes >= REPLAY_BATCH_BYTES:
+                session.feed_lines(_batch_lines(splitters, batch))
+                batch = []
+                batch_bytes = 0
+                batch_window = window
+            session.elapsed = timestamp
+            batch.append((stream, data))
+            batch_bytes += len(data)
+            continue
+        session.feed_lines(_batch_lines(splitters, batch))
+        batch = []
+        if realtime:
+            delay = timestamp - (time.monotonic() - replay_start)
+            if delay > 0:
+                time.sleep(delay)
+        session.elapsed = timestamp
+        early_stop_reason = session.early_stop_reason()
+        if early_stop_reason is not None:
+            stop_reason = early_stop_reason
+            break
+        if data:
+            session.feed_lines(splitters[stream].feed(data))
+        else:
+            session.feed_lines(splitters[stream].flush())
+            open_streams.discard(stream)
+            if not open_streams:
+                # COMSERVER closed its pipes before the test run time elapsed
+                session.add_error()
+                stop_reason = STOP_COMSERVER_EXITED
+                break
+    session.feed_lines(_batch_lines(splitters, batch))
+    if timed_out:
+        session.elapsed = float(config.test_run_time)
+    elif capture.end is not None and stop_reason == STOP_COMPLETED:
+        session.elapsed = min(capture.end['elapsed'], float(config.test_run_time))
+        # The recording ended before the test run time, the replay cannot go further
+        if capture.end['stop_reason'] in (STOP_CANCELLED, STOP_EARLY_PASS, STOP_EARLY_FAIL):
+            stop_reason = capture.end['stop_reason']
+    else:
+        session.elapsed = min(session.elapsed, float(config.test_run_time))
+    return session.finish(stop_reason)
+
+
+def _batch_lines(splitters, chunks):
+    # Lines of (stream, data) chunks in their order, consecutive chunks of a stream are split at once
+    lines = []
+    for stream, stream_chunks in itertools.groupby(chunks, key=itemgetter(0)):
+        lines.extend(splitters[stream].feed(b''.join(data for _, data in stream_chunks)))
+    return lines
+
+
+def _chain(first_record, records):
+    if first_record is not None:
+        yield first_record
+    yield from records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded COMSERVER captures through the test evaluation "
+                                                 "and print one JSON result per capture.")
+    parser.add_argument("captures", nargs="+", help="capture files (*.cap.gz)")
+    parser.add_argument("--config", help="test configuration JSON to evaluate with instead of the recorded one")
+    parser.add_argument("--realtime", action="store_true", help="replay at the recorded speed")
+    args = parser.parse_args(argv)
+    config = TestConfig.from_json_file(args.config) if args.config else None
+    for path in args.captures:
+        result = replay_capture(path, config, args.realtime)
+        print(json.dumps(dict(result.to_dict(), capture=path)), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
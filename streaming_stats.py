@@ -0,0 +1,123 @@
+import math
+import threading
+from collections import deque
+
+# Number of most recent samples kept for the rolling window statistics
+DEFAULT_WINDOW_SIZE = 1000
+# Batches smaller than this are added value by value, NumPy only pays off for larger ones
+SMALL_BATCH_SIZE = 32
+
+
+class StreamingStats:
+    # Constant-memory running statistics of a sample stream (Welford's algorithm).
+    # Variance and std dev are population values (ddof=0) to match np.std.
+    # All methods are thread-safe so the GUI can poll snapshot() while samples are added.
+    def __init__(self, window_size=DEFAULT_WINDOW_SIZE):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.window = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+    @property
+    def std_dev(self):
+        return math.sqrt(self.variance)
+
+    def update(self, value):
+        with self._lock:
+            self._update(float(value))
+
+    def update_batch(self, values, skip_nan=False):
+        # Adds a NumPy array (or any sequence) of samples at once by merging its
+        # moments with Chan's parallel algorithm. With skip_nan, NaN values are ignored.
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size < SMALL_BATCH_SIZE:
+            with self._lock:
+                for value in values.tolist():
+                    # NaN != NaN
+                    if value == value or not skip_nan:
+                        self._update(value)
+            return
+        if skip_nan:
+            values = values[~np.isnan(values)]
+            if values.size == 0:
+                return
+        batch_mean = float(values.mean())
+        batch_m2 = float(np.square(values - batch_mean).sum())
+        with self._lock:
+            self._merge(values.size, batch_mean, batch_m2, float(values.min()), float(values.max()))
+            self.window.extend(values[-self.window.maxlen:].tolist())
+
+    def merge(self, other):
+        count, mean, m2, minimum, maximum, window = other._state()
+        with self._lock:
+            self._merge(count, mean, m2, minimum, maximum)
+            self.window.extend(window)
+
+    def window_stats(self):
+        # Mean and population std dev of the rolling window
+        with self._lock:
+            window = list(self.window)
+        if not window:
+            return 0.0, 0.0
+        mean = math.fsum(window) / len(window)
+        variance = math.fsum((value - mean) ** 2 for value in window) / len(window)
+        return mean, math.sqrt(variance)
+
+    def snapshot(self):
+        with self._lock:
+            count, mean, variance = self.count, self.mean, self.variance
+            minimum, maximum = self.min, self.max
+        window_mean, window_std_dev = self.window_stats()
+        return {'count': count, 'mean': mean, 'std_dev': math.sqrt(variance), 'variance': variance,
+                'min': minimum if count else 0.0, 'max': maximum if count else 0.0,
+                'window_mean': window_mean, 'window_std_dev': window_std_dev}
+
+    def checkpoint_state(self):
+        # Plain dict of the complete state (including the window) for a checkpoint, see restore()
+        count, mean, m2, minimum, maximum, window = self._state()
+        return {'count': count, 'mean': mean, 'm2': m2, 'min': minimum, 'max': maximum, 'window': window}
+
+    def restore(self, state):
+        with self._lock:
+            self.count = state['count']
+            self.mean = state['mean']
+            self.m2 = state['m2']
+            self.min = state['min']
+            self.max = state['max']
+            self.window.clear()
+            self.window.extend(state['window'])
+
+    def _state(self):
+        with self._lock:
+            return self.count, self.mean, self.m2, self.min, self.max, list(self.window)
+
+    def _update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.window.append(value)
+
+    def _merge(self, count, mean, m2, minimum, maximum):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
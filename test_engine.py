@@ -0,0 +1,475 @@
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from early_stop import VERDICT_PASS, EarlyStopRule
+from line_parser import DEFAULT_FIELDS, SAMPLE_FIELD, LineParser
+from log_histogram import LogHistogram
+from metrics import TestMetrics, profile_path, write_metrics
+from results_store import ResultsWriter
+from spc import SpcMonitor
+from streaming_stats import StreamingStats
+
+# Pattern of the data rate value in a COMSERVER output line. It is the sample field of the
+# line parser, so extract_value() accepts exactly the lines the tests count as samples.
+RX_PATTERN = re.compile(DEFAULT_FIELDS[SAMPLE_FIELD])
+
+# Minimum time between two progress callbacks
+PROGRESS_INTERVAL = 0.1
+
+# Reasons why a test stopped
+STOP_COMPLETED = 'completed'
+STOP_CANCELLED = 'cancelled'
+STOP_COMSERVER_EXITED = 'comserver_exited'
+STOP_EARLY_PASS = 'early_pass'
+STOP_EARLY_FAIL = 'early_fail'
+STOP_INTERRUPTED = 'interrupted'  # Finalized from the checkpoint of a crashed test
+
+
+# Keys of the test configuration JSON that have an input field in the setup window
+CONFIG_FIELDS = ('sensor_part_number', 'min_data_rate_limit', 'max_data_rate_limit', 'max_std_dev_limit',
+                 'test_run_time', 'comserver_path', 'test_result_path', 'min_p1_data_rate_limit',
+                 'min_p99_data_rate_limit')
+# Percentile of the data rate -> TestConfig attribute with its floor
+PERCENTILE_LIMITS = {'p1': 'min_p1_data_rate_limit', 'p99': 'min_p99_data_rate_limit'}
+
+
+def optional_limit(value):
+    # Limits that may be left empty: None, '' -> None
+    if value is None or value == '':
+        return None
+    return float(value)
+
+
+def extract_value(line):
+    # Returns the rx data rate of a line as a string, or None if the line has none
+    match = RX_PATTERN.search(line)
+    if match:
+        return match.group(1)
+    return None
+
+
+class TestConfig:
+    # Test parameters, same keys as the JSON written by TestSetupWindow.export_configuration.
+    # Keys this class does not know are kept in `options` for optional features.
+    __test__ = False  # Not a test case for pytest despite the name
+
+    def __init__(self, sensor_part_number='', min_data_rate_limit=0.0, max_data_rate_limit=0.0,
+                 max_std_dev_limit=0.0, test_run_time=0, comserver_path='', test_result_path='',
+                 min_p1_data_rate_limit=None, min_p99_data_rate_limit=None, **options):
+        self.sensor_part_number = sensor_part_number
+        self.min_data_rate_limit = float(min_data_rate_limit)
+        self.max_data_rate_limit = float(max_data_rate_limit)
+        self.max_std_dev_limit = float(max_std_dev_limit)
+        self.test_run_time = int(test_run_time)
+        self.comserver_path = comserver_path
+        self.test_result_path = test_result_path
+        # Optional floors of the 1st and 99th percentile of the data rate
+        self.min_p1_data_rate_limit = optional_limit(min_p1_data_rate_limit)
+        self.min_p99_data_rate_limit = optional_limit(min_p99_data_rate_limit)
+        self.options = options
+
+    @classmethod
+    def from_json_file(cls, path):
+        with open(path, "r") as file:
+            return cls(**json.load(file))
+
+    def to_dict(self):
+        data = {
+            "sensor_part_number": self.sensor_part_number,
+            "min_data_rate_limit": self.min_data_rate_limit,
+            "max_data_rate_limit": self.max_data_rate_limit,
+            "max_std_dev_limit": self.max_std_dev_limit,
+            "test_run_time": self.test_run_time,
+            "comserver_path": self.comserver_path,
+            "test_result_path": self.test_result_path
+        }
+        for name in PERCENTILE_LIMITS.values():
+            if getattr(self, name) is not None:
+                data[name] = getattr(self, name)
+        data.update(self.options)
+        return data
+
+
+def evaluate(config, average_data_rate, standard_deviation, errors, spc=None, percentiles=None):
+    # `spc` is the summary of the SPC analysis, its configured checks must pass as well.
+    # `percentiles` are the data rate percentiles for the percentile floors.
+    if errors > 0 or average_data_rate < config.min_data_rate_limit or \
+            average_data_rate > config.max_data_rate_limit or standard_deviation > config.max_std_dev_limit:
+        return 'FAIL'
+    for name, limit_name in PERCENTILE_LIMITS.items():
+        limit = getattr(config, limit_name)
+        value = (percentiles or {}).get(name)
+        if limit is not None and (value is None or value < limit):
+            return 'FAIL'
+    if spc is not None and not spc['passed']:
+        return 'FAIL'
+    return 'PASS'
+
+
+class TestResult:
+    __test__ = False
+
+    def __init__(self, config, serial_number, start_time, end_time, rx_stats, errors, stop_reason,
+                 field_stats=None, spc=None, histogram=None):
+        self.config = config
+        self.serial_number = serial_number
+        self.start_time = start_time
+        self.end_time = end_time
+        self.samples = rx_stats.count
+        self.average_data_rate = rx_stats.mean if rx_stats.count else 0.0
+        self.standard_deviation = rx_stats.std_dev if rx_stats.count else 0.0
+        self.errors = errors
+        self.stop_reason = stop_reason
+        # Summary of the other parsed fields (tx, packet errors, ...) that appeared in the output
+        self.fields = {name: {'count': stats.count, 'mean': stats.mean, 'min': stats.min, 'max': stats.max}
+                       for name, stats in (field_stats or {}).items() if stats.count}
+        # Summary of the SPC analysis with the per-window statistics, None if it is off
+        self.spc = spc
+        # LogHistogram of the data rate, mergeable with the histograms of other tests
+        self.histogram = histogram
+        self.percentiles = histogram.percentiles() if histogram is not None and histogram.count else {}
+        self.test_status = evaluate(config, self.average_data_rate, self.standard_deviation, errors, spc,
+                                    self.percentiles)
+        self.metrics = None  # TestMetrics of the run, set by TestSession.finish()
+        self.checkpoint_path = None  # Checkpoint of the test, removed once the result is saved
+        # Soak mode: path of the sample file and the statistics per hour of the test
+        self.sample_file = None
+        self.breakdown = None
+
+    @property
+    def cancelled(self):
+        return self.stop_reason == STOP_CANCELLED
+
+    def to_row(self):
+        # One row of the result file, see results_store.RESULT_COLUMNS
+        return {'Test starting time': self.start_time,
+                'Sensor name': self.config.sensor_part_number,
+                'Sensor Serial Number': self.serial_number,
+                'Minimum Data Rate Limit': self.config.min_data_rate_limit,
+                'Maximum Data Rate Limit': self.config.max_data_rate_limit,
+                'Average data rate': round(self.average_data_rate, 2),
+                'Maximum Standard Deviation Limit': self.config.max_std_dev_limit,
+                'Standard Deviation': round(float(self.standard_deviation), 2),
+                'Errors': self.errors,
+                'Test status': self.test_status,
+                'Test end time': self.end_time,
+                'Stop reason': self.stop_reason,
+                'Samples': self.samples,
+                'P1 data rate': self._rounded_percentile('p1'),
+                'P99 data rate': self._rounded_percentile('p99')}
+
+    def discard_checkpoint(self):
+        # The result is saved (or deliberately not), the test no longer counts as interrupted
+        if self.checkpoint_path is not None:
+            try:
+                os.remove(self.checkpoint_path)
+            except FileNotFoundError:
+                pass
+            self.checkpoint_path = None
+
+    def _rounded_percentile(self, name):
+        value = self.percentiles.get(name)
+        return None if value is None else round(value, 2)
+
+    def to_dict(self):
+        # Machine-readable summary of the result
+        data = {'sensor_part_number': self.config.sensor_part_number,
+                'serial_number': self.serial_number,
+                'start_time': self.start_time.isoformat(),
+                'end_time': self.end_time.isoformat(),
+                'samples': self.samples,
+                'average_data_rate': self.average_data_rate,
+                'standard_deviation': self.standard_deviation,
+                'errors': self.errors,
+                'test_status': self.test_status,
+                'stop_reason': self.stop_reason,
+                'fields': self.fields,
+                'percentiles': self.percentiles}
+        if self.histogram is not None:
+            data['histogram'] = self.histogram.to_dict()
+        if self.spc is not None:
+            data['spc'] = self.spc
+        if self.sample_file is not None:
+            data['sample_file'] = self.sample_file
+            data['breakdown'] = self.breakdown
+        return data
+
+
+class TestSession:
+    # Evaluation state of one test. It is fed with COMSERVER output lines from any
+    # source (live pipes, a capture file, ...) and turned into a TestResult by finish().
+    __test__ = False
+
+    def __init__(self, config, serial_number, start_time=None, parser=None, sample_buffer=None, metrics=None):
+        self.config = config
+        self.serial_number = serial_number
+        self.start_time = start_time or datetime.now()
+        self.parser = parser or LineParser.from_config(config)
+        self.elapsed = 0.0
+        self.rx_stats = StreamingStats()
+        self.rx_histogram = LogHistogram()
+        self.field_stats = {name: StreamingStats() for name in self.parser.field_names if name != SAMPLE_FIELD}
+        self.errors = 0
+        self.noise_lines = 0
+        self.previous_line = ''
+        self.same_line_cnt = 0
+        # Optional SampleRingBuffer receiving the rx values for live plotting
+        self.sample_buffer = sample_buffer
+        self.early_stop = EarlyStopRule.from_config(config)
+        self.spc = SpcMonitor.from_config(config)
+        self.metrics = metrics or TestMetrics()
+        self.sample_file = None  # sample_store.SampleFileWriter in soak mode
+        self.checkpoint = None  # checkpoint.Checkpointer if checkpoints are configured
+
+    @classmethod
+    def from_checkpoint(cls, state, sample_buffer=None, metrics=None):
+        # Session of an interrupted test as of its last checkpoint, to resume or finalize it
+        session = cls(TestConfig(**state['config']), state['serial_number'],
+                      datetime.fromisoformat(state['start_time']), sample_buffer=sample_buffer, metrics=metrics)
+        session.elapsed = state['elapsed']
+        session.errors = state['errors']
+        session.noise_lines = state['noise_lines']
+        session.previous_line = state['previous_line']
+        session.same_line_cnt = state['same_line_cnt']
+        session.rx_stats.restore(state['rx_stats'])
+        for name, stats_state in state['field_stats'].items():
+            if name in session.field_stats:
+                session.field_stats[name].restore(stats_state)
+        session.rx_histogram = LogHistogram.from_dict(state['rx_histogram'])
+        if session.spc is not None and state.get('spc'):
+            session.spc.restore(state['spc'])
+        if state.get('sample_count') is not None:
+            session.start_sample_file(state['sample_count'])
+            if session.sample_file is not None and session.sample_file.count > state['sample_count']:
+                # The sample file has rows from after the checkpoint, the test goes on after them
+                from sample_store import SampleFileReader
+                session.elapsed = max(session.elapsed, SampleFileReader(session.sample_file.path).last_time)
+        return session
+
+    def start_sample_file(self, count=0):
+        # Soak mode ("soak" in the configuration) keeps every sample in a sample file on disk
+        if self.config.options.get("soak"):
+            from sample_store import start_sample_file
+            self.sample_file = start_sample_file(self.config, self.serial_number, self.start_time,
+                                                 self.parser.field_names, count)
+
+    def start_checkpoint(self):
+        # Periodic checkpoints ("checkpoint" in the configuration) to resume or finalize the
+        # test after a crash, see checkpoint.py
+        if self.config.options.get("checkpoint"):
+            from checkpoint import start_checkpoint
+            self.checkpoint = start_checkpoint(self)
+
+    def checkpoint_if_due(self):
+        # Called by the acquisition loops after every read
+        if self.checkpoint is not None:
+            self.checkpoint.maybe_save(self)
+
+    def checkpoint_state(self):
+        # Copy of everything the test resumes from, as plain JSON types apart from the SPC
+        # windows, which checkpoint.encode_state() encodes
+        return {'config': self.config.to_dict(),
+                'serial_number': self.serial_number,
+                'start_time': self.start_time.isoformat(),
+                'elapsed': self.elapsed,
+                'errors': self.errors,
+                'noise_lines': self.noise_lines,
+                'previous_line': self.previous_line,
+                'same_line_cnt': self.same_line_cnt,
+                'rx_stats': self.rx_stats.checkpoint_state(),
+                'field_stats': {name: stats.checkpoint_state() for name, stats in self.field_stats.items()},
+                'rx_histogram': self.rx_histogram.to_dict(),
+                'spc': self.spc.checkpoint_state() if self.spc is not None else None,
+                'sample_count': self.sample_file.count if self.sample_file is not None else None}
+
+    def feed_line(self, line):
+        self.feed_lines([line])
+
+    def feed_lines(self, lines):
+        # Repeated and empty lines are dropped first, the first one is tolerated
+        new_lines = []
+        for line in lines:
+            if self.previous_line != line and len(line) > 3:
+                self.previous_line = line
+                new_lines.append(line)
+            else:
+                self.same_line_cnt += 1
+                self.metrics.duplicate_lines += 1
+                if self.same_line_cnt > 1:
+                    self.errors += 1
+        if not new_lines:
+            return
+        # The remaining lines are parsed as one batch
+        batch = self.parser.parse_lines(new_lines)
+        self.rx_stats.update_batch(batch.fields[SAMPLE_FIELD])
+        self.rx_histogram.update_batch(batch.fields[SAMPLE_FIELD])
+        if self.sample_buffer is not None:
+            self.sample_buffer.extend(self.elapsed, batch.fields[SAMPLE_FIELD])
+        if self.spc is not None:
+            self.spc.add(self.elapsed, batch.fields[SAMPLE_FIELD])
+        for name, stats in self.field_stats.items():
+            # NaN marks samples without this field
+            stats.update_batch(batch.fields[name], skip_nan=True)
+        self.errors += batch.error_count
+        self.metrics.parse_misses += batch.noise_count + batch.error_count
+        self.noise_lines += batch.noise_count
+        if self.sample_file is not None:
+            self.sample_file.append(self.elapsed, batch.fields, self.errors)
+
+    def add_error(self):
+        self.errors += 1
+
+    def early_stop_reason(self):
+        # STOP_EARLY_PASS or STOP_EARLY_FAIL once early stopping is configured and the
+        # verdict is settled, otherwise None
+        if self.early_stop is None:
+            return None
+        verdict = self.early_stop.check(self.elapsed, self.rx_stats.count, self.rx_stats.mean,
+                                        self.rx_stats.std_dev, self.errors)
+        if verdict is None:
+            return None
+        return STOP_EARLY_PASS if verdict == VERDICT_PASS else STOP_EARLY_FAIL
+
+    def progress(self):
+        # 'time' is when the progress was taken, consumers measure their update latency with it
+        return {'elapsed': self.elapsed, 'samples': self.rx_stats.count, 'mean': self.rx_stats.mean,
+                'std_dev': self.rx_stats.std_dev, 'errors': self.errors, 'time': time.monotonic()}
+
+    def finish(self, stop_reason=STOP_COMPLETED):
+        if self.checkpoint is not None:
+            # The checkpoint stays until the result is saved
+            self.checkpoint.close()
+        end_time = self.start_time + timedelta(seconds=self.elapsed)
+        rx_stats, field_stats, breakdown = self.rx_stats, self.field_stats, None
+        if self.sample_file is not None:
+            # The final statistics of a soak test are computed from the sample file, chunk by chunk
+            from sample_store import SampleFileReader
+            self.sample_file.close(stop_reason, self.elapsed, self.errors)
+            reader = SampleFileReader(self.sample_file.path)
+            file_stats, _ = reader.statistics()
+            rx_stats = file_stats.pop(SAMPLE_FIELD)
+            field_stats = file_stats
+            breakdown = reader.breakdown(SAMPLE_FIELD)
+        spc = self.spc.evaluate(self.elapsed) if self.spc is not None else None
+        result = TestResult(self.config, self.serial_number, self.start_time, end_time, rx_stats,
+                            self.errors, stop_reason, field_stats, spc, self.rx_histogram)
+        if self.sample_file is not None:
+            result.sample_file = self.sample_file.path
+            result.breakdown = breakdown
+        if self.checkpoint is not None:
+            result.checkpoint_path = self.checkpoint.path
+        self.metrics.serial_number = self.serial_number
+        self.metrics.test_status = result.test_status
+        self.metrics.stop_reason = stop_reason
+        self.metrics.elapsed = self.elapsed
+        self.metrics.parse_hits = self.rx_stats.count
+        result.metrics = self.metrics
+        return result
+
+
+def run_test(config, serial_number, reader, cancel_event=None, progress_callback=None,
+             progress_interval=PROGRESS_INTERVAL, sample_buffer=None, metrics=None, session=None):
+    # Acquires COMSERVER output from `reader` for config.test_run_time seconds and
+    # returns the evaluated TestResult. With a "profile_dir" in the configuration the
+    # acquisition loop is profiled and the cProfile stats are written there.
+    # A `session` restored from a checkpoint is resumed for the rest of its run time.
+    cancel_event = cancel_event or threading.Event()
+    if session is None:
+        session = TestSession(config, serial_number, sample_buffer=sample_buffer, metrics=metrics)
+        session.start_sample_file()
+    session.start_checkpoint()
+    metrics = session.metrics
+    profiler = None
+    if config.options.get("profile_dir"):
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start_monotonic = time.monotonic() - session.elapsed
+    capture = None
+    if config.options.get("capture_dir"):
+        from stream_capture import start_capture
+        # The part of a resumed test after the crash is captured into a file of its own
+        capture_start = datetime.now() if session.elapsed else session.start_time
+        capture = start_capture(config, serial_number, capture_start, start_monotonic, reader)
+    # Output read after the run time is not evaluated, a replay of the capture drops it as well
+    deadline = start_monotonic + config.test_run_time
+    last_progress = 0.0
+    stop_reason = STOP_COMPLETED
+    try:
+        while True:
+            session.elapsed = time.monotonic() - start_monotonic
+            if cancel_event.is_set():
+                stop_reason = STOP_CANCELLED
+                break
+            remaining = config.test_run_time - session.elapsed
+            if remaining <= 0:
+                session.elapsed = float(config.test_run_time)
+                break
+            early_stop_reason = session.early_stop_reason()
+            if early_stop_reason is not None:
+                stop_reason = early_stop_reason
+                break
+            # Wake up regularly to report progress and notice cancellation
+            timeout = min(remaining, progress_interval) if progress_callback else min(remaining, 0.5)
+            read_start = time.perf_counter()
+            lines = reader.read_lines(timeout, deadline)
+            read_end = time.perf_counter()
+            session.feed_lines([line for stream, line in lines])
+            metrics.add_read(len(lines), read_end - read_start, time.perf_counter() - read_end)
+            session.checkpoint_if_due()
+            if reader.eof and not cancel_event.is_set() and time.monotonic() < deadline:
+                # COMSERVER closed its pipes before the test run time elapsed
+                session.elapsed = time.monotonic() - start_monotonic
+                session.add_error()
+                stop_reason = STOP_COMSERVER_EXITED
+                break
+            if progress_callback and session.elapsed - last_progress >= progress_interval:
+                last_progress = session.elapsed
+                progress_callback(session.progress())
+    finally:
+        if capture is not None:
+            reader.set_capture(None)
+            capture.close(stop_reason, session.elapsed)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(config.options["profile_dir"], exist_ok=True)
+            profiler.dump_stats(profile_path(config.options["profile_dir"], serial_number, session.start_time))
+    return session.finish(stop_reason)
+
+
+def record_result(config, result):
+    # Saves the result, then exports the metrics of the run including the time the saving took
+    # sqlite3 is only loaded when a result is saved
+    from results_db import ResultsDatabase, default_database_path
+    write_start = time.perf_counter()
+    row = result.to_row()
+    ResultsWriter(config.test_result_path).append(row)
+    # The results database is optional, "results_db_path": "" disables it
+    database_path = config.options.get("results_db_path", default_database_path(config.test_result_path))
+    if database_path:
+        database = ResultsDatabase(database_path)
+        try:
+            database.insert_result(row, result.histogram, result.spc['windows'] if result.spc is not None else None)
+        finally:
+            database.close()
+    result.discard_checkpoint()
+    # Results are also spooled for the aggregator if one is configured, and sent in the background
+    from aggregator import AggregatorClient, aggregator_entry
+    client = AggregatorClient.from_config(config)
+    if client is not None:
+        client.submit(aggregator_entry(result))
+    if result.metrics is not None:
+        result.metrics.results_write_seconds = time.perf_counter() - write_start
+    export_metrics(config, result)
+
+
+def export_metrics(config, result):
+    # Writes the metrics of the run to the "metrics_path" of the configuration, if any
+    metrics_path = config.options.get("metrics_path")
+    if metrics_path and result.metrics is not None:
+        write_metrics(metrics_path, result.metrics)
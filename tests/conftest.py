@@ -0,0 +1,91 @@
+import glob
+import io
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import test_engine  # noqa: E402
+
+SIMULATOR = os.path.join(ROOT, 'comserver_simulator.py')
+
+
+def simulator_command(*options):
+    # COMSERVER path running the simulator with these command line options
+    return ' '.join([f'"{sys.executable}"', f'"{SIMULATOR}"'] + list(options))
+
+
+def sample_lines(start, count, seed=0):
+    # COMSERVER sample lines number `start` to `start + count`, the same ones on every call
+    rng = np.random.default_rng(seed + start)
+    return [f"[{index}] rx={rate:.2f} MB/s tx=1.00 MB/s" for index, rate in
+            zip(range(start, start + count), rng.normal(100.0, 2.0, count))]
+
+
+def feed(session, start, count):
+    # Batches of varying size at increasing test times (100 samples per second), like the
+    # reads of a live test
+    index = start
+    while index < start + count:
+        size = min(1 + index % 37, start + count - index)
+        session.elapsed = index / 100.0
+        session.feed_lines(sample_lines(index, size))
+        index += size
+
+
+@pytest.fixture
+def make_config(tmp_path):
+    # Test configuration writing its results into the test's temporary directory
+    def make_config(**options):
+        values = dict(sensor_part_number='PN-TEST', min_data_rate_limit=90.0, max_data_rate_limit=110.0,
+                      max_std_dev_limit=5.0, test_run_time=2,
+                      comserver_path=simulator_command('--rate', '200', '--seed', '1'),
+                      test_result_path=str(tmp_path / 'results.csv'), results_db_path='')
+        values.update(options)
+        return test_engine.TestConfig(**values)
+    return make_config
+
+
+@pytest.fixture(scope='session')
+def recorded_test(tmp_path_factory):
+    # One live test of the simulator with stalls, duplicates and junk on stderr, recorded as a
+    # capture. Returns the capture path and the JSON result of the live test.
+    import headless_runner
+
+    directory = tmp_path_factory.mktemp('capture')
+    config = test_engine.TestConfig(
+        sensor_part_number='PN-TEST', min_data_rate_limit=90.0, max_data_rate_limit=110.0, max_std_dev_limit=5.0,
+        test_run_time=2, test_result_path=str(directory / 'results.csv'), results_db_path='',
+        comserver_path=simulator_command('--rate', '300', '--seed', '3', '--jitter', '0.5',
+                                         '--duplicate-probability', '0.02', '--junk-probability', '0.01',
+                                         '--stall-probability', '0.005', '--stall-duration', '0.2'),
+        capture_dir=str(directory), spc={'window_seconds': 0.25})
+    output = io.StringIO()
+    headless_runner.run(config, ['SIM-1'], save=False, output=output)
+    path, = glob.glob(str(directory / '*.cap.gz'))
+    return path, json.loads(output.getvalue())
+
+
+def assert_same_result(result, expected, same_windows=True):
+    # Compares two result dicts. The statistics may be merged from other batches, so the means
+    # may differ in the last bits.
+    for name in ('samples', 'errors', 'test_status', 'stop_reason', 'end_time', 'percentiles'):
+        assert result[name] == expected[name], name
+    assert result['average_data_rate'] == pytest.approx(expected['average_data_rate'], rel=1e-12)
+    assert result['standard_deviation'] == pytest.approx(expected['standard_deviation'], rel=1e-9)
+    assert result['fields'].keys() == expected['fields'].keys()
+    for name, field in expected['fields'].items():
+        assert result['fields'][name] == pytest.approx(field, rel=1e-12), name
+    if 'spc' not in expected:
+        return
+    if same_windows:
+        for name, values in expected['spc']['windows'].items():
+            assert result['spc']['windows'][name] == pytest.approx(values, rel=1e-12), name
+        assert result['spc']['passed'] == expected['spc']['passed']
+    else:
+        assert sum(result['spc']['windows']['samples']) == sum(expected['spc']['windows']['samples'])
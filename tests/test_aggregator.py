@@ -0,0 +1,178 @@
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import test_engine
+from aggregator import STATE_FILE, AggregatorClient, AggregatorServer, ResultSpool, aggregator_entry
+from results_db import ResultsDatabase
+
+
+def make_result(config, serial_number, minute=0):
+    session = test_engine.TestSession(config, serial_number, datetime(2026, 3, 1, 8, 0) + timedelta(minutes=minute))
+    session.feed_lines([f"[{index}] rx={100 + index % 5}.00 MB/s" for index in range(100)])
+    session.elapsed = float(config.test_run_time)
+    return session.finish()
+
+
+def stored_results(database_path):
+    database = ResultsDatabase(database_path)
+    try:
+        return database.results(), database.distribution()
+    finally:
+        database.close()
+
+
+def test_spool_numbers_and_acknowledges(tmp_path, make_config):
+    spool = ResultSpool(str(tmp_path / 'spool'))
+    config = make_config()
+    seqs = [spool.append(aggregator_entry(make_result(config, f"S{index}", index))) for index in range(3)]
+    assert seqs == [1, 2, 3]
+    epoch, entries = spool.pending()
+    assert [entry['seq'] for entry in entries] == seqs
+    spool.acknowledge(epoch, 2)
+    assert [entry['seq'] for entry in spool.pending()[1]] == [3]
+    spool.acknowledge(epoch, 3)
+    assert spool.pending() == (None, [])
+    # The numbers go on after everything was delivered
+    assert spool.append(aggregator_entry(make_result(config, "S3", 3))) == 4
+
+
+def test_lost_spool_state_starts_a_new_epoch(tmp_path, make_config):
+    spool = ResultSpool(str(tmp_path / 'spool'))
+    spool.append(aggregator_entry(make_result(make_config(), "S0")))
+    first_epoch, _ = spool.pending()
+    os.remove(os.path.join(spool.spool_dir, STATE_FILE))
+    epoch, entries = spool.pending()
+    assert epoch == first_epoch  # The entries keep the epoch they were spooled with
+    assert spool.append(aggregator_entry(make_result(make_config(), "S1", 1))) == 1
+
+
+def test_insert_deliveries_stores_every_entry_once(tmp_path, make_config):
+    config = make_config()
+    entries = [dict(aggregator_entry(make_result(config, f"S{index}", index)), seq=index + 1) for index in range(4)]
+    database_path = str(tmp_path / 'results.sqlite')
+    database = ResultsDatabase(database_path)
+    try:
+        assert database.insert_deliveries([('station', 'epoch-1', entries[:3])]) == [3]
+        # Sent again after a lost acknowledgement, together with a new entry
+        assert database.insert_deliveries([('station', 'epoch-1', entries)]) == [4]
+        # The same numbers in a new epoch are new results of the station, here already stored ones
+        assert database.insert_deliveries([('station', 'epoch-2', entries[:1])]) == [1]
+    finally:
+        database.close()
+    results, distribution = stored_results(database_path)
+    assert sorted(result['serial_number'] for result in results) == ['S0', 'S1', 'S2', 'S3']
+    assert distribution[0]['tests'] == 4
+
+
+def test_client_delivers_exactly_once_through_the_server(tmp_path, make_config):
+    database_path = str(tmp_path / 'aggregate.sqlite')
+    server = AggregatorServer(('localhost', 0), database_path)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    try:
+        client = AggregatorClient(f"localhost:{server.server_address[1]}", 'station-1', str(tmp_path / 'spool'),
+                                  batch_size=2)
+        config = make_config()
+        for index in range(5):
+            client.spool.append(aggregator_entry(make_result(config, f"S{index}", index)))
+        # The first batch arrives but its acknowledgement is lost, so the station sends it again
+        epoch, entries = client.spool.pending(2)
+        assert client._send(epoch, entries) == 2
+        assert client.deliver()
+        assert client.spool.pending() == (None, [])
+        client._disconnect()
+    finally:
+        server.shutdown()
+        server.server_close()
+    results, distribution = stored_results(database_path)
+    assert sorted(result['serial_number'] for result in results) == [f"S{index}" for index in range(5)]
+    assert distribution[0]['tests'] == 5
+
+
+def test_unreachable_aggregator_keeps_results_spooled(tmp_path, make_config, capsys):
+    client = AggregatorClient("localhost:1", 'station-1', str(tmp_path / 'spool'))
+    client.spool.append(aggregator_entry(make_result(make_config(), "S0")))
+    assert not client.deliver()
+    assert len(client.spool.pending()[1]) == 1
+    assert "stay spooled" in capsys.readouterr().out
+
+
+
+class ScriptedAggregator:
+    # Aggregator answering the batches with the given replies in turn, then confirming them.
+    # Returns the batches it received in `requests`.
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.requests = []
+        self._socket = socket.create_server(('localhost', 0))
+        self.address = f"localhost:{self._socket.getsockname()[1]}"
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def close(self):
+        self._socket.close()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            with connection, connection.makefile('rwb') as stream:
+                for line in stream:
+                    request = json.loads(line)
+                    self.requests.append(request)
+                    reply = self.replies.pop(0) if self.replies else \
+                        json.dumps({'last_seq': request['entries'][-1]['seq']}).encode('utf-8')
+                    stream.write(reply + b'\n')
+                    stream.flush()
+
+
+@pytest.mark.parametrize('reply', [b'{"last_seq": null}', b'{"stored": 1}', b'[1]', b'"ok"', b'\xff{'])
+def test_malformed_reply_keeps_the_results_spooled(tmp_path, make_config, capsys, reply):
+    aggregator = ScriptedAggregator([reply])
+    try:
+        client = AggregatorClient(aggregator.address, 'station-1', str(tmp_path / 'spool'))
+        client.spool.append(aggregator_entry(make_result(make_config(), "S0")))
+        assert not client.deliver()
+        assert "stay spooled" in capsys.readouterr().out
+        assert len(client.spool.pending()[1]) == 1
+        # The next attempt is answered properly
+        assert client.deliver()
+        assert client.spool.pending() == (None, [])
+        assert len(aggregator.requests) == 2
+        client._disconnect()
+    finally:
+        aggregator.close()
+
+
+def test_submit_replaces_a_dead_sender(tmp_path, make_config, monkeypatch):
+    aggregator = ScriptedAggregator([])
+    client = AggregatorClient(aggregator.address, 'station-1', str(tmp_path / 'spool'))
+    deliver = client.deliver
+
+    def broken_deliver():
+        monkeypatch.setattr(client, 'deliver', deliver)
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(client, 'deliver', broken_deliver)
+    monkeypatch.setattr(threading, 'excepthook', lambda args: None)
+    try:
+        config = make_config()
+        client.submit(aggregator_entry(make_result(config, "S0")))
+        client._thread.join(5)
+        assert not client._thread.is_alive()
+        client.submit(aggregator_entry(make_result(config, "S1", 1)))
+        deadline = time.monotonic() + 5
+        while client.spool.pending()[1] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert client.spool.pending() == (None, [])
+        assert [entry['row']['Sensor Serial Number'] for entry in aggregator.requests[0]['entries']] == ['S0', 'S1']
+    finally:
+        client.close()
+        aggregator.close()
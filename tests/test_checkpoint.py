@@ -0,0 +1,128 @@
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import checkpoint
+import headless_runner
+import test_engine
+from checkpoint import Checkpointer, checkpoint_dir, encode_state, finalize_checkpoint, interrupted_tests
+from conftest import ROOT, feed, simulator_command
+from sample_store import SampleFileReader
+from spc import WindowSnapshot
+
+
+def test_resumed_session_gives_the_uninterrupted_result(make_config):
+    config = make_config(test_run_time=10, spc={'window_seconds': 0.5})
+    start_time = datetime(2026, 3, 1, 8, 0)
+    uninterrupted = test_engine.TestSession(config, 'SN1', start_time)
+    interrupted = test_engine.TestSession(config, 'SN1', start_time)
+    feed(uninterrupted, 0, 500)
+    feed(interrupted, 0, 500)
+    state = json.loads(encode_state(interrupted.checkpoint_state()))
+    resumed = test_engine.TestSession.from_checkpoint(state)
+    feed(uninterrupted, 500, 500)
+    feed(resumed, 500, 500)
+    uninterrupted.elapsed = resumed.elapsed = 10.0
+    expected = uninterrupted.finish().to_dict()
+    result = resumed.finish().to_dict()
+    assert result == expected
+
+
+def test_windows_are_encoded_as_of_the_checkpoint(make_config):
+    session = test_engine.TestSession(make_config(test_run_time=10, spc={'window_seconds': 0.5}), 'SN1')
+    feed(session, 0, 500)
+    state = session.checkpoint_state()
+    # The acquisition thread only takes references, the writer thread encodes them
+    assert isinstance(state['spc']['means'], WindowSnapshot)
+    windows = len(session.spc.means)
+    feed(session, 500, 300)
+    restored = test_engine.TestSession.from_checkpoint(json.loads(encode_state(state)))
+    assert len(restored.spc.means) == windows
+    assert list(restored.spc.means) == list(session.spc.means[:windows])
+    with pytest.raises(TypeError):
+        encode_state({'value': object()})
+
+
+def test_checkpoints_use_one_percent_of_the_acquisition_cpu(make_config, tmp_path, monkeypatch):
+    clock = {'cpu': 0.0}
+
+    class Clock:
+        # CPU time of the process as the test sets it, the checkpoints themselves cost nothing
+        monotonic = staticmethod(time.monotonic)
+        process_time = staticmethod(lambda: clock['cpu'])
+        thread_time = staticmethod(lambda: 0.0)
+
+    monkeypatch.setattr(checkpoint, 'time', Clock)
+    session = test_engine.TestSession(make_config(), 'SN1')
+    checkpointer = Checkpointer(str(tmp_path / 'SN1.checkpoint'), interval=0)
+    try:
+        checkpointer.cpu_seconds = 0.001
+        # 1 ms of checkpoints needs 0.1 s of acquisition CPU, however long the test has run
+        clock['cpu'] = 0.05
+        checkpointer.maybe_save(session)
+        assert checkpointer.checkpoints == 0
+        clock['cpu'] = 0.2
+        checkpointer.maybe_save(session)
+        assert checkpointer.checkpoints == 1
+    finally:
+        checkpointer.close()
+    assert json.loads((tmp_path / 'SN1.checkpoint').read_text())['serial_number'] == 'SN1'
+
+
+def test_finalize_records_the_interrupted_test(make_config, tmp_path):
+    config = make_config(test_run_time=10, checkpoint={'checkpoint_dir': str(tmp_path / 'checkpoints')})
+    session = test_engine.TestSession(config, 'SN2')
+    session.start_checkpoint()
+    feed(session, 0, 300)
+    session.checkpoint.save(session)
+    session.checkpoint.close()
+    (path, state), = interrupted_tests(checkpoint_dir(config))
+    assert state['rx_stats']['count'] == 300
+    result = finalize_checkpoint(path)
+    assert result.stop_reason == test_engine.STOP_INTERRUPTED
+    assert result.samples == 300
+    assert not os.path.exists(path)
+    with open(config.test_result_path) as file:
+        assert 'SN2' in file.read()
+
+
+def test_killed_soak_test_resumes_without_losing_samples(make_config, tmp_path):
+    config = make_config(test_run_time=6, comserver_path=simulator_command('--rate', '100', '--seed', '2'),
+                         soak={'chunk_samples': 64}, checkpoint={'interval': 1})
+    config_path = tmp_path / 'config.json'
+    config_path.write_text(json.dumps(config.to_dict()))
+    station = subprocess.Popen([sys.executable, os.path.join(ROOT, 'headless_runner.py'), str(config_path), 'SN3',
+                                '--no-save'], stdout=subprocess.DEVNULL, start_new_session=True)
+    try:
+        deadline = time.monotonic() + 30
+        while not interrupted_tests(checkpoint_dir(config)) or \
+                interrupted_tests(checkpoint_dir(config))[0][1]['elapsed'] < 2.5:
+            assert time.monotonic() < deadline and station.poll() is None
+            time.sleep(0.1)
+    finally:
+        # Kills the station and the simulator it started
+        os.killpg(station.pid, signal.SIGKILL)
+        station.wait()
+    (_, state), = interrupted_tests(checkpoint_dir(config))
+    sample_path, = (tmp_path / 'samples').iterdir()
+    rows_at_crash = SampleFileReader(str(sample_path)).count
+    assert rows_at_crash >= state['sample_count'] > 0
+
+    output = io.StringIO()
+    headless_runner.run(config, ['SN3'], save=False, output=output, resume=True)
+    result = json.loads(output.getvalue())
+    assert result['stop_reason'] == test_engine.STOP_COMPLETED
+    assert result['samples'] > rows_at_crash
+    assert interrupted_tests(checkpoint_dir(config)) == []
+    reader = SampleFileReader(str(sample_path))
+    assert reader.count == result['samples']
+    times = np.concatenate([chunk['time'] for chunk in reader.chunks()])
+    assert np.all(np.diff(times) >= 0)
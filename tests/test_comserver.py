@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+
+import pytest
+
+from comserver import start_comserver_process, stop_comserver_process
+from comserver_manager import ComserverManager
+from conftest import simulator_command
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="process groups are signalled on POSIX only")
+
+# Child printing its pid and sleeping, optionally ignoring SIGTERM
+CHILD = "import os, signal, time; {} os.write(1, b'%d\\n' % os.getpid()); time.sleep(60)"
+
+
+def child_command(ignore_term=False):
+    code = CHILD.format("signal.signal(signal.SIGTERM, signal.SIG_IGN);" if ignore_term else "")
+    return f'"{sys.executable}" -c "{code}"'
+
+
+def alive(pid):
+    # Children of a stopped shell are reparented, a zombie left unreaped counts as gone
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            return file.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def child_pids(process, count):
+    return [int(process.stdout.readline()) for _ in range(count)]
+
+
+def test_stop_terminates_the_shell_and_its_children():
+    # COMSERVER .bat files start helpers the way a shell does, in the background
+    process = start_comserver_process(f"{child_command()} & {child_command()} & wait")
+    pids = child_pids(process, 2)
+    start = time.monotonic()
+    stop_comserver_process(process, timeout=10)
+    # SIGTERM was enough, nothing waited for the timeout
+    assert time.monotonic() - start < 5
+    assert process.poll() is not None
+    assert not any(alive(pid) for pid in pids)
+
+
+def test_children_ignoring_sigterm_are_killed_after_the_timeout():
+    process = start_comserver_process(f"{child_command(ignore_term=True)} & wait")
+    pid, = child_pids(process, 1)
+    start = time.monotonic()
+    stop_comserver_process(process, timeout=0.5)
+    assert 0.5 <= time.monotonic() - start < 3
+    assert not alive(pid)
+
+
+def test_children_of_an_exited_shell_are_stopped():
+    process = start_comserver_process(f"{child_command()} &")
+    pid, = child_pids(process, 1)
+    process.wait(5)
+    assert alive(pid)
+    stop_comserver_process(process)
+    assert not alive(pid)
+    # Stopping again finds no group and returns at once
+    stop_comserver_process(process)
+
+
+def test_manager_restarts_a_crashed_comserver():
+    manager = ComserverManager(f'"{sys.executable}" -c "print(1)"', restart_delay=0.5)
+    try:
+        instance = manager.start()
+        deadline = time.monotonic() + 5
+        while instance.alive and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert manager.ensure_running()
+        # Not again before the restart delay, so a COMSERVER failing at once does not loop
+        assert manager.active is not instance and not manager.ensure_running()
+        assert (manager.spawns, manager.restarts) == (2, 1)
+    finally:
+        manager.shutdown()
+
+
+def test_warm_standby_is_started_after_a_stop():
+    manager = ComserverManager(simulator_command('--rate', '50'), warm_standby=True)
+    try:
+        first = manager.start()
+        assert manager.start() is first
+        manager.stop()
+        assert not first.alive and manager.standby is not None
+        deadline = time.monotonic() + 10
+        while manager.standby.spawn_to_first_line is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        second = manager.start()
+        assert second is not first and manager.standby is None
+        metrics = manager.metrics()
+        assert (metrics['spawns'], metrics['standby_starts']) == (2, 1)
+        # The line was there before the start, the user did not wait for it
+        assert metrics['start_to_first_line'] == 0.0 and metrics['spawn_to_first_line'] > 0
+    finally:
+        manager.shutdown()
+    assert not second.alive and manager.standby is None
@@ -0,0 +1,123 @@
+import sys
+import time
+
+from comserver import start_comserver_process, stop_comserver_process
+from comserver_reader import READ_CHUNK_SIZE, ComserverReader, LineDemultiplexer
+from stream_capture import CaptureReader, CaptureWriter
+
+
+def python_command(code):
+    return f'"{sys.executable}" -c "{code}"'
+
+
+def numbered_lines(count, padding=0):
+    # COMSERVER printing `count` numbered lines and exiting
+    return python_command(f"import sys; sys.stdout.writelines(f'[{{i}}] {'x' * padding}\\n' for i in range({count}))")
+
+
+def start_demux(command):
+    process = start_comserver_process(command)
+    return process, LineDemultiplexer(ComserverReader(process))
+
+
+def read_all(subscription, timeout=10):
+    lines = []
+    deadline = time.monotonic() + timeout
+    while not subscription.eof and time.monotonic() < deadline:
+        lines.extend(line for _, line in subscription.read_lines(0.1))
+    return lines
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_full_queue_stops_the_reads_without_losing_lines():
+    # 4 MB of output, far more than the pipe buffer and one read chunk
+    count, padding = 40_000, 100
+    process, demux = start_demux(numbered_lines(count, padding))
+    subscription = demux.subscribe(max_lines=100)
+    try:
+        assert wait_for(lambda: subscription._line_count >= 100)
+        time.sleep(0.3)
+        # The publisher waits for room, the queue exceeds its size by one chunk at most
+        assert not demux.eof and process.poll() is None
+        assert subscription._line_count <= 100 + READ_CHUNK_SIZE // (padding + 4)
+        lines = read_all(subscription)
+        assert lines == [f"[{index}] {'x' * padding}\n" for index in range(count)]
+        assert subscription.dropped == 0
+    finally:
+        demux.close()
+        stop_comserver_process(process)
+
+
+def test_lossy_queue_keeps_the_newest_lines_and_counts_the_dropped():
+    count = 5000
+    process, demux = start_demux(numbered_lines(count))
+    subscription = demux.subscribe(max_lines=100, lossy=True)
+    try:
+        assert wait_for(lambda: demux.eof)
+        lines = read_all(subscription)
+        assert lines == [f"[{index}] \n" for index in range(count - 100, count)]
+        assert subscription.dropped == count - 100
+    finally:
+        demux.close()
+        stop_comserver_process(process)
+
+
+def test_every_subscription_gets_every_line():
+    process, demux = start_demux(numbered_lines(1000))
+    first, second = demux.subscribe(), demux.subscribe()
+    try:
+        assert read_all(first) == read_all(second) == [f"[{index}] \n" for index in range(1000)]
+        assert demux.first_line_time is not None
+    finally:
+        demux.close()
+        stop_comserver_process(process)
+
+
+def test_lines_read_after_the_cutoff_are_dropped():
+    process, demux = start_demux(python_command("import time; print('early', flush=True); time.sleep(0.5); "
+                                                "print('late', flush=True)"))
+    subscription = demux.subscribe()
+    try:
+        assert wait_for(lambda: demux.first_line_time is not None)
+        cutoff = demux.first_line_time + 0.25
+        assert wait_for(lambda: demux.eof)
+        assert subscription.read_lines(0, until=cutoff) == [('stdout', 'early\n')]
+    finally:
+        demux.close()
+        stop_comserver_process(process)
+    process = start_comserver_process(python_command("print('late')"))
+    reader = ComserverReader(process)
+    try:
+        cutoff = time.monotonic()
+        assert wait_for(lambda: process.poll() is not None)
+        assert reader.read_lines(1, until=cutoff) == []
+    finally:
+        reader.close()
+        stop_comserver_process(process)
+
+
+def test_capture_starts_with_the_queued_lines(tmp_path):
+    process, demux = start_demux(python_command("import sys, time; print('[0] queued', flush=True); "
+                                                "sys.stdout.write('[1] par'); sys.stdout.flush(); time.sleep(0.3); "
+                                                "print('tial', flush=True); print('[2] captured', flush=True)"))
+    subscription = demux.subscribe()
+    path = str(tmp_path / 'test.cap.gz')
+    try:
+        assert wait_for(lambda: subscription._line_count == 1)
+        capture = CaptureWriter(path, {})
+        subscription.set_capture(capture)
+        lines = read_all(subscription)
+        subscription.set_capture(None)
+        capture.close()
+    finally:
+        demux.close()
+        stop_comserver_process(process)
+    assert lines == ['[0] queued\n', '[1] partial\n', '[2] captured\n']
+    recorded = b''.join(data for _, stream, data in CaptureReader(path) if stream == 'stdout')
+    assert recorded.replace(b'\r\n', b'\n') == b'[0] queued\n[1] partial\n[2] captured\n'
@@ -0,0 +1,115 @@
+import math
+
+import numpy as np
+import pytest
+
+import test_engine
+from conftest import sample_lines
+from early_stop import CHECK_INTERVAL, VERDICT_FAIL, VERDICT_PASS, EarlyStopRule
+
+
+def make_rule(make_config, test_run_time=60, options=True, **config_options):
+    config = make_config(test_run_time=test_run_time, early_stop=options, **config_options)
+    return EarlyStopRule.from_config(config)
+
+
+def test_off_unless_configured(make_config):
+    assert EarlyStopRule.from_config(make_config()) is None
+    assert EarlyStopRule.from_config(make_config(early_stop=False)) is None
+    rule = make_rule(make_config, options={'confidence': 0.95, 'min_samples': 100, 'min_time': 5})
+    assert (rule.min_samples, rule.min_time, rule.allow_pass) == (100, 5.0, True)
+
+
+def test_clear_verdicts(make_config):
+    # Limits 90..110 MB/s and a std dev of at most 5
+    assert make_rule(make_config).check(1.0, 1000, 100.0, 1.0, 0) == VERDICT_PASS
+    assert make_rule(make_config).check(1.0, 1000, 80.0, 1.0, 0) == VERDICT_FAIL
+    assert make_rule(make_config).check(1.0, 1000, 120.0, 1.0, 0) == VERDICT_FAIL
+    assert make_rule(make_config).check(1.0, 1000, 100.0, 9.0, 0) == VERDICT_FAIL
+    # Any error fails at once, even before the first check
+    assert make_rule(make_config).check(0.0, 0, 0.0, 0.0, 1) == VERDICT_FAIL
+
+
+def test_bounds_close_to_the_limits_wait(make_config):
+    rule = make_rule(make_config)
+    z = rule.z
+    count, std_dev = 400, 4.0
+    margin = z * std_dev / math.sqrt(count)
+    # The confidence interval of the mean just reaches over the lower limit: no verdict
+    assert make_rule(make_config).check(1.0, count, 90.0 + 0.9 * margin, std_dev, 0) is None
+    assert make_rule(make_config).check(1.0, count, 90.0 + 1.1 * margin, std_dev, 0) == VERDICT_PASS
+    assert make_rule(make_config).check(1.0, count, 90.0 - 0.9 * margin, std_dev, 0) is None
+    assert make_rule(make_config).check(1.0, count, 90.0 - 1.1 * margin, std_dev, 0) == VERDICT_FAIL
+    # Same for the std dev, whose bounds are a factor on a log scale
+    factor = math.exp(z / math.sqrt(2.0 * (count - 1)))
+    assert make_rule(make_config).check(1.0, count, 100.0, 5.0 / factor * 1.01, 0) is None
+    assert make_rule(make_config).check(1.0, count, 100.0, 5.0 / factor * 0.99, 0) == VERDICT_PASS
+    assert make_rule(make_config).check(1.0, count, 100.0, 5.0 * factor * 0.99, 0) is None
+    assert make_rule(make_config).check(1.0, count, 100.0, 5.0 * factor * 1.01, 0) == VERDICT_FAIL
+
+
+def test_more_looks_need_wider_bounds(make_config):
+    # The confidence is split over all checks of the test
+    short, long = make_rule(make_config, test_run_time=10), make_rule(make_config, test_run_time=3600)
+    assert short.z < long.z
+    assert make_rule(make_config, options={'confidence': 0.999}).z > make_rule(make_config).z
+
+
+def test_minimum_samples_time_and_check_interval(make_config):
+    rule = make_rule(make_config, options={'min_samples': 50, 'min_time': 2})
+    assert rule.check(1.0, 1000, 100.0, 1.0, 0) is None  # Before min_time
+    assert rule.check(2.0, 10, 100.0, 1.0, 0) is None  # Too few samples
+    assert rule.check(2.0 + CHECK_INTERVAL / 2, 1000, 100.0, 1.0, 0) is None  # Not due yet
+    assert rule.check(2.0 + CHECK_INTERVAL, 1000, 100.0, 1.0, 0) == VERDICT_PASS
+
+
+@pytest.mark.parametrize('options, config_options', [
+    ({'allow_pass': False}, {}),
+    (True, {'spc': {'window_seconds': 1}}),
+    (True, {'min_p1_data_rate_limit': 95.0}),
+    (True, {'min_p99_data_rate_limit': 95.0}),
+])
+def test_checks_that_rule_out_an_early_pass(make_config, options, config_options):
+    rule = make_rule(make_config, options=options, **config_options)
+    assert not rule.allow_pass
+    assert rule.check(1.0, 1000, 100.0, 1.0, 0) is None
+    assert make_rule(make_config, options=options, **config_options).check(1.0, 1000, 80.0, 1.0, 0) == VERDICT_FAIL
+
+
+def early_verdicts(make_config, mean, runs=300):
+    # Verdicts of tests with 100 samples per second for 60 s, checked twice per second
+    rng = np.random.default_rng(7)
+    verdicts = {VERDICT_PASS: 0, VERDICT_FAIL: 0, None: 0}
+    for _ in range(runs):
+        rule = make_rule(make_config)
+        samples = rng.normal(mean, 4.5, 6000)
+        verdict = None
+        for looks in range(1, 121):
+            values = samples[:looks * 50]
+            verdict = rule.check(looks * CHECK_INTERVAL, len(values), values.mean(), values.std(ddof=1), 0)
+            if verdict is not None:
+                break
+        verdicts[verdict] += 1
+    return verdicts
+
+
+def test_early_verdicts_of_sensors_at_the_limit_are_rare(make_config):
+    # Sensors whose true mean is the lower limit, neither verdict is settled by the data
+    verdicts = early_verdicts(make_config, 90.0)
+    assert verdicts[VERDICT_PASS] + verdicts[VERDICT_FAIL] <= 0.01 * 300
+
+
+def test_no_wrong_early_verdicts_near_the_limit(make_config):
+    inside, outside = early_verdicts(make_config, 90.2), early_verdicts(make_config, 89.8)
+    assert inside[VERDICT_FAIL] == 0 and inside[VERDICT_PASS] > 0
+    assert outside[VERDICT_PASS] == 0 and outside[VERDICT_FAIL] > 0
+
+
+def test_session_stops_early(make_config):
+    session = test_engine.TestSession(make_config(test_run_time=60, early_stop=True), 'SN1')
+    assert session.early_stop_reason() is None
+    session.elapsed = 5.0
+    session.feed_lines(sample_lines(0, 500))
+    assert session.early_stop_reason() == test_engine.STOP_EARLY_PASS
+    result = session.finish(test_engine.STOP_EARLY_PASS)
+    assert (result.test_status, result.stop_reason) == ('PASS', test_engine.STOP_EARLY_PASS)
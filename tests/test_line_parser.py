@@ -0,0 +1,88 @@
+import io
+import math
+
+import pytest
+
+import comserver_simulator
+from line_parser import LINE_ERROR, LINE_NOISE, LINE_SAMPLE, SAMPLE_FIELD, LineParser
+from test_engine import extract_value
+
+
+@pytest.fixture(scope='module')
+def simulator_lines():
+    stdout, stderr = io.StringIO(), io.StringIO()
+    comserver_simulator.run(comserver_simulator.parse_args(
+        ['--rate', '5000', '--duration', '0.2', '--seed', '4', '--junk-probability', '0.05']), stdout, stderr)
+    return stdout.getvalue().splitlines() + stderr.getvalue().splitlines() + ['', '   ']
+
+
+def test_batch_parse_equals_line_by_line(simulator_lines):
+    parser = LineParser()
+    batch = parser.parse_lines(simulator_lines)
+    kinds = [parser.parse_line(line) for line in simulator_lines]
+    samples = [fields for kind, fields in kinds if kind == LINE_SAMPLE]
+    assert batch.sample_count == len(samples) > 500
+    assert batch.error_count == sum(kind == LINE_ERROR for kind, _ in kinds)
+    assert batch.noise_count == sum(kind == LINE_NOISE for kind, _ in kinds)
+    for name in parser.field_names:
+        expected = [fields.get(name, math.nan) for fields in samples]
+        assert batch.fields[name].tolist() == pytest.approx(expected, nan_ok=True), name
+
+
+def test_simulator_lines_have_every_default_field(simulator_lines):
+    batch = LineParser().parse_lines(simulator_lines)
+    for name, values in batch.fields.items():
+        assert not any(math.isnan(value) for value in values.tolist()), name
+    assert batch.fields[SAMPLE_FIELD].mean() == pytest.approx(100.0, abs=1.0)
+
+
+@pytest.mark.parametrize('line, field, value', [
+    ("[1] rx=100.50 MB/s rx_errors=7", 'packet_errors', None),
+    ("[1] rx=100.50 MB/s errors=7", 'packet_errors', 7.0),
+    ("[1] rx=100.50 MB/s uptime=99", 'timestamp', None),
+    ("[1] rx=100.50 MB/s time=99", 'timestamp', 99.0),
+])
+def test_default_fields_start_a_word(line, field, value):
+    kind, fields = LineParser().parse_line(line)
+    assert kind == LINE_SAMPLE
+    if value is None:
+        assert math.isnan(fields[field])
+    else:
+        assert fields[field] == value
+
+
+# Line forms the default parser counts as samples, with their rx value, and forms it does not.
+# The results of past tests depend on these, change them only deliberately.
+SAMPLE_LINES = [
+    ("[12] rx=100.50 MB/s tx=1.00 MB/s", "100.50"),
+    ("rx=0.00 MB/s", "0.00"),
+    ("port 1: (rx=99.9 MB/s)", "99.9"),
+    ("tx=1.00 MB/s,rx=12.345 MB/s", "12.345"),
+    ("[1] max_rx=5.00 MB/s rx=100.50 MB/s", "100.50"),
+]
+NON_SAMPLE_LINES = [
+    "[1] max_rx=5.00 MB/s",
+    "[1] rx_rate=100.50 MB/s",
+    "[1] rx=100 MB/s",
+    "[1] rx=100.50 kB/s",
+    "[1] rx=100.50MB/s",
+    "[1] rx = 100.50 MB/s",
+    "[1] RX=100.50 MB/s",
+    "[1] rx=-1.00 MB/s",
+    "rx=100.50",
+]
+
+
+@pytest.mark.parametrize('line, value', SAMPLE_LINES)
+def test_sample_line_forms(line, value):
+    kind, fields = LineParser().parse_line(line)
+    assert kind == LINE_SAMPLE and fields[SAMPLE_FIELD] == float(value)
+    assert LineParser().parse_lines([line]).fields[SAMPLE_FIELD].tolist() == [float(value)]
+    assert extract_value(line) == value
+
+
+@pytest.mark.parametrize('line', NON_SAMPLE_LINES)
+def test_non_sample_line_forms(line):
+    assert LineParser().parse_line(line)[0] != LINE_SAMPLE
+    assert LineParser().parse_lines([line]).sample_count == 0
+    assert extract_value(line) is None
@@ -0,0 +1,94 @@
+import json
+
+import numpy as np
+import pytest
+
+import test_engine
+from conftest import sample_lines
+from log_histogram import DEFAULT_RELATIVE_ACCURACY, LogHistogram, merge_results
+from streaming_stats import SMALL_BATCH_SIZE
+
+
+def samples(size=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    # Long tailed like a data rate with dropouts
+    return np.concatenate([rng.normal(100.0, 3.0, size), rng.lognormal(2.0, 1.0, size // 10)])
+
+
+@pytest.mark.parametrize('percent', [0, 1, 5, 50, 95, 99, 100])
+def test_quantiles_within_relative_accuracy(percent):
+    values = samples()
+    histogram = LogHistogram()
+    histogram.update_batch(values)
+    # The histogram returns the sample of rank floor(fraction * (count - 1))
+    expected = np.quantile(values, percent / 100.0, method='lower')
+    assert histogram.quantile(percent / 100.0) == pytest.approx(expected, rel=DEFAULT_RELATIVE_ACCURACY * 1.0001)
+
+
+def test_small_batches_give_the_same_bins():
+    values = samples(2000)
+    vectorized = LogHistogram()
+    vectorized.update_batch(values)
+    value_by_value = LogHistogram()
+    for start in range(0, values.size, SMALL_BATCH_SIZE - 1):
+        value_by_value.update_batch(values[start:start + SMALL_BATCH_SIZE - 1])
+    assert value_by_value.to_dict() == vectorized.to_dict()
+
+
+def test_merge_equals_one_histogram():
+    parts = np.array_split(samples(), 7)
+    merged = LogHistogram()
+    for part in parts:
+        histogram = LogHistogram()
+        histogram.update_batch(part)
+        merged.merge(histogram)
+    single = LogHistogram()
+    single.update_batch(np.concatenate(parts))
+    assert merged.to_dict() == single.to_dict()
+    assert merged.percentiles() == single.percentiles()
+
+
+def test_merge_needs_the_same_accuracy():
+    with pytest.raises(ValueError):
+        LogHistogram(0.01).merge(LogHistogram(0.02))
+
+
+def test_zero_and_nan_values():
+    histogram = LogHistogram()
+    histogram.update_batch(np.array([0.0, -1.0, np.nan] * SMALL_BATCH_SIZE + [10.0] * SMALL_BATCH_SIZE))
+    assert histogram.count == 3 * SMALL_BATCH_SIZE
+    assert histogram.zero_count == 2 * SMALL_BATCH_SIZE
+    # Values <= 0 share the zero bin
+    assert histogram.quantile(0.0) == 0.0
+    assert histogram.min == -1.0
+    assert histogram.quantile(1.0) == 10.0
+    assert LogHistogram().quantile(0.5) is None
+
+
+def test_dict_round_trip_and_merge_results():
+    histogram = LogHistogram()
+    histogram.update_batch(samples(1000))
+    data = json.loads(json.dumps(histogram.to_dict()))
+    assert LogHistogram.from_dict(data).to_dict() == histogram.to_dict()
+    summary, = merge_results([{'sensor_part_number': 'PN', 'histogram': data}] * 3)
+    assert summary['tests'] == 3
+    assert summary['samples'] == 3 * histogram.count
+    assert summary['p50'] == histogram.quantile(0.5)
+
+
+@pytest.mark.parametrize('limits, status', [
+    ({}, 'PASS'),
+    ({'min_p1_data_rate_limit': 94.0}, 'PASS'),
+    ({'min_p1_data_rate_limit': 97.0}, 'FAIL'),
+    ({'min_p99_data_rate_limit': 106.0}, 'FAIL'),
+    ({'min_p1_data_rate_limit': '', 'min_p99_data_rate_limit': 103.0}, 'PASS'),
+])
+def test_percentile_limits_decide_the_status(make_config, limits, status):
+    # Mean 100 and std dev 2: p1 is near 95.3 and p99 near 104.7
+    session = test_engine.TestSession(make_config(test_run_time=10, **limits), 'SN1')
+    session.feed_lines(sample_lines(0, 5000))
+    session.elapsed = 10.0
+    result = session.finish()
+    assert result.test_status == status
+    assert result.percentiles['p1'] == pytest.approx(95.3, abs=0.5)
+    assert result.to_row()['P99 data rate'] == round(result.percentiles['p99'], 2)
@@ -0,0 +1,79 @@
+import glob
+import io
+import json
+import os
+import pstats
+
+import pytest
+
+import headless_runner
+import metrics
+from metrics import TestMetrics, write_metrics
+
+
+@pytest.fixture(autouse=True)
+def no_previous_channels(monkeypatch):
+    # The metrics file holds every channel of the process, start each test without any
+    monkeypatch.setattr(metrics, '_latest', {})
+
+
+def make_metrics(channel, serial_number):
+    test_metrics = TestMetrics(channel)
+    test_metrics.serial_number, test_metrics.test_status, test_metrics.stop_reason = serial_number, 'PASS', 'completed'
+    test_metrics.elapsed = 2.0
+    test_metrics.add_read(30, 0.5, 0.1)
+    test_metrics.add_read(10, 0.3, 0.1)
+    test_metrics.add_gui_update(0.02)
+    return test_metrics
+
+
+def test_derived_values():
+    values = make_metrics('Port 1', 'S1').to_dict()
+    assert (values['lines_read'], values['lines_per_second'], values['queue_depth_max']) == (40, 20.0, 30)
+    assert values['queue_depth_mean'] == 20.0
+    assert values['busy_ratio'] == pytest.approx(0.2)
+    assert values['comserver_start_to_first_line_seconds'] is None
+    assert TestMetrics().to_dict()['busy_ratio'] == 0.0
+
+
+def test_json_file_holds_the_latest_test_of_every_channel(tmp_path):
+    path = str(tmp_path / 'metrics.json')
+    write_metrics(path, make_metrics('Port 2', 'S1'))
+    write_metrics(path, make_metrics('Port 1', 'S2'))
+    write_metrics(path, make_metrics('Port 2', 'S3'))
+    with open(path) as file:
+        tests = json.load(file)['tests']
+    assert [(test['channel'], test['serial_number']) for test in tests] == [('Port 1', 'S2'), ('Port 2', 'S3')]
+    assert os.listdir(tmp_path) == ['metrics.json']
+
+
+def test_prometheus_text(tmp_path):
+    path = str(tmp_path / 'metrics.prom')
+    first = make_metrics('Port 1', 'S"1')
+    first.add_comserver({'spawn_to_first_line': 0.25, 'start_to_first_line': 0.0})
+    write_metrics(path, first)
+    write_metrics(path, make_metrics('Port 2', 'S2'))
+    with open(path) as file:
+        lines = file.read().splitlines()
+    assert '# TYPE cmd_test_lines_read gauge' in lines
+    assert 'cmd_test_lines_read{channel="Port 1",serial_number="S\\"1",test_status="PASS",' \
+           'stop_reason="completed"} 40' in lines
+    # Metrics without a value are left out instead of written as None
+    first_line = [line for line in lines if line.startswith('cmd_test_comserver_spawn_to_first_line_seconds{')]
+    assert len(first_line) == 1 and first_line[0].endswith(' 0.25')
+    assert not any(line.endswith(' None') for line in lines)
+    assert not any(line.startswith('cmd_test_channel') for line in lines)
+
+
+def test_headless_run_exports_metrics_and_profile(make_config, tmp_path):
+    config = make_config(test_run_time=1, metrics_path=str(tmp_path / 'metrics.json'),
+                         profile_dir=str(tmp_path / 'profiles'))
+    # Whether the test passes does not matter here, the simulator's start banner may count as an error
+    headless_runner.run(config, ['SIM/1'], save=False, output=io.StringIO())
+    with open(config.options['metrics_path']) as file:
+        test, = json.load(file)['tests']
+    assert (test['serial_number'], test['stop_reason']) == ('SIM/1', 'completed')
+    assert test['lines_read'] > 100
+    assert 0 < test['comserver_spawn_to_first_line_seconds'] < 10
+    profile, = glob.glob(str(tmp_path / 'profiles' / 'SIM_1_*.prof'))
+    assert pstats.Stats(profile).total_calls > 0
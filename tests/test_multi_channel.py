@@ -0,0 +1,83 @@
+import csv
+import sys
+import threading
+import time
+
+import test_engine
+from conftest import simulator_command
+from multi_channel import STATUS_EXITED, STATUS_RUNNING, Channel, MultiChannelOrchestrator, channels_from_config
+
+
+def test_channels_from_config(make_config):
+    config = make_config(channels=[{"name": "Port 1", "comserver_path": "a.bat"}, {"comserver_path": "b.bat"}])
+    assert [(channel.name, channel.comserver_path) for channel in channels_from_config(config)] == \
+        [("Port 1", "a.bat"), ("Channel 2", "b.bat")]
+
+
+def test_channels_are_tested_in_parallel_and_saved(make_config):
+    config = make_config(test_run_time=1)
+    channels = [Channel(f"Port {number}", simulator_command('--rate', '200', '--seed', str(number)))
+                for number in range(3)]
+    orchestrator = MultiChannelOrchestrator(config, channels)
+    reported = []
+    statuses = {}
+    orchestrator.result_callback = lambda index, result: reported.append((index, result.serial_number))
+    orchestrator.status_callback = statuses.__setitem__
+    orchestrator.start()
+    try:
+        start = time.monotonic()
+        # The channel without a serial number is not tested
+        results = orchestrator.run_test(['S0', '', 'S2'])
+        duration = time.monotonic() - start
+    finally:
+        orchestrator.stop()
+    assert duration < 2 * config.test_run_time
+    assert [result.serial_number for result in results] == ['S0', 'S2']
+    assert all(result.stop_reason == test_engine.STOP_COMPLETED and result.samples > 100 for result in results)
+    assert results[0].average_data_rate != results[1].average_data_rate
+    assert sorted(reported) == [(0, 'S0'), (2, 'S2')]
+    assert statuses == {0: STATUS_RUNNING, 1: STATUS_RUNNING, 2: STATUS_RUNNING}
+    with open(config.test_result_path, newline='') as file:
+        saved = [row['Sensor Serial Number'] for row in csv.DictReader(file)]
+    assert sorted(saved) == ['S0', 'S2']
+
+
+def test_exited_comserver_ends_its_channel_test(make_config):
+    config = make_config(test_run_time=5)
+    exiting = f'"{sys.executable}" -c "import time; print(\'[0] rx=100.00 MB/s\', flush=True); time.sleep(0.3)"'
+    channels = [Channel("Port 1", simulator_command('--rate', '200')), Channel("Port 2", exiting)]
+    orchestrator = MultiChannelOrchestrator(config, channels, save_results=False)
+    orchestrator.start()
+    try:
+        orchestrator.start_test(['S1', 'S2'])
+        time.sleep(1)
+        orchestrator.cancel()
+        results = orchestrator.wait(5)
+    finally:
+        orchestrator.stop()
+    assert [result.stop_reason for result in results] == [test_engine.STOP_CANCELLED,
+                                                          test_engine.STOP_COMSERVER_EXITED]
+    assert results[1].errors == 1 and results[1].test_status == 'FAIL'
+
+
+def test_reactor_is_idle_once_every_comserver_exited(make_config):
+    orchestrator = MultiChannelOrchestrator(make_config(), [Channel("Port 1", "true"), Channel("Port 2", "echo hi")],
+                                            save_results=False)
+    statuses = {}
+    exited = threading.Event()
+
+    def status_changed(index, status):
+        statuses[index] = status
+        if len(statuses) == 2 and set(statuses.values()) == {STATUS_EXITED}:
+            exited.set()
+
+    orchestrator.status_callback = status_changed
+    orchestrator.start()
+    try:
+        assert exited.wait(5)
+        cpu_start = time.process_time()
+        time.sleep(1)
+        # The sleeping test thread uses no CPU, so this is the time the orchestrator threads used
+        assert time.process_time() - cpu_start < 0.1
+    finally:
+        orchestrator.stop()
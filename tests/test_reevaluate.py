@@ -0,0 +1,101 @@
+import json
+import shutil
+
+import pytest
+
+import reevaluate
+import stream_capture
+import test_engine
+from conftest import assert_same_result, feed
+from reevaluate import YieldImpact, reevaluate_test
+from sample_store import replay_sample_file
+from stream_capture import replay_capture
+
+
+def soak_test(make_config, tmp_path, serial_number, trailing_errors):
+    # A soak test of 10 seconds whose samples end after 3 seconds, followed by an error line
+    # and `trailing_errors` other errors that have no row in the sample file
+    config = make_config(test_run_time=10, soak={'sample_dir': str(tmp_path / 'samples'), 'chunk_samples': 64})
+    session = test_engine.TestSession(config, serial_number)
+    session.start_sample_file()
+    feed(session, 0, 300)
+    session.feed_line("COMSERVER: link lost")
+    for _ in range(trailing_errors):
+        session.add_error()
+    session.elapsed = 10.0
+    result = session.finish()
+    return session.sample_file.path, result
+
+
+def test_batched_replay_equals_the_record_by_record_replay(recorded_test, monkeypatch):
+    path, _ = recorded_test
+    batched = replay_capture(path).to_dict()
+    # Every record a batch of its own, read from the file in tiny blocks
+    monkeypatch.setattr(stream_capture, 'REPLAY_BATCH_BYTES', 0)
+    monkeypatch.setattr(stream_capture, 'READ_BLOCK_SIZE', 7)
+    assert_same_result(batched, replay_capture(path).to_dict())
+
+
+def test_sample_file_replay_reproduces_the_soak_result(make_config, tmp_path):
+    path, result = soak_test(make_config, tmp_path, 'SN1', trailing_errors=2)
+    replayed = replay_sample_file(path)
+    assert replayed.errors == result.errors == 3
+    assert replayed.samples == result.samples == 300
+    assert replayed.stop_reason == result.stop_reason
+    assert replayed.average_data_rate == pytest.approx(result.average_data_rate, rel=1e-12)
+    assert replayed.standard_deviation == pytest.approx(result.standard_deviation, rel=1e-9)
+
+
+def test_new_limits_change_the_verdict_without_a_replay(recorded_test, monkeypatch):
+    path, live = recorded_test
+    unchanged = reevaluate_test(path)
+    assert (unchanged['old_status'], unchanged['new_status'], unchanged['changes']) == \
+        (live['test_status'], live['test_status'], {})
+    replays = []
+    monkeypatch.setattr(reevaluate, 'replay', lambda *args: replays.append(args) or replay_capture(*args))
+    test = reevaluate_test(path, {'PN-TEST': {'min_data_rate_limit': 150.0}}, {'max_std_dev_limit': 5.0})
+    # The std dev limit is the recorded one, only the new minimum counts as a change
+    assert test['changes'] == {'min_data_rate_limit': 150.0}
+    assert test['new_status'] == 'FAIL' and test['samples'] == live['samples']
+    assert len(replays) == 1
+    # Other part numbers keep their limits
+    assert reevaluate_test(path, {'PN-OTHER': {'min_data_rate_limit': 150.0}})['changes'] == {}
+
+
+def test_new_run_time_replays_the_test(recorded_test):
+    path, live = recorded_test
+    test = reevaluate_test(path, changes={'test_run_time': 1})
+    assert 0 < test['samples'] < live['samples']
+    assert test['stop_reason'] == test_engine.STOP_COMPLETED
+
+
+def test_parallel_reevaluation_and_yield_impact(recorded_test, make_config, tmp_path, capsys):
+    path, _ = recorded_test
+    directory = tmp_path / 'tests'
+    directory.mkdir()
+    for number in range(3):
+        shutil.copy(path, directory / f"SIM-{number}.cap.gz")
+    sample_path, _ = soak_test(make_config, tmp_path, 'SN1', trailing_errors=0)
+    shutil.copy(sample_path, directory)
+    (directory / 'broken.cap.gz').write_bytes(b'not a capture')
+    paths = reevaluate.find_tests([str(directory)])
+    assert len(paths) == 5
+    changes = {'min_data_rate_limit': 150.0}
+    assert list(reevaluate.reevaluate(paths, changes=changes, jobs=2)) == \
+        list(reevaluate.reevaluate(paths, changes=changes, jobs=1))
+    assert reevaluate.main([str(directory), '--set', 'min_data_rate_limit=150', '--jobs', '2']) == 0
+    captured = capsys.readouterr()
+    assert "An error occurred while re-evaluating" in captured.err
+    summary, = [row for row in map(json.loads, captured.out.splitlines()) if row.get('summary') == 'yield']
+    assert (summary['tests'], summary['new_passed'], summary['new_yield']) == (4, 0, 0.0)
+    assert summary['pass_to_fail'] == summary['old_passed']
+
+
+def test_cancelled_tests_do_not_count_for_the_yield():
+    impact = YieldImpact()
+    impact.add({'sensor_part_number': 'PN', 'stop_reason': test_engine.STOP_CANCELLED, 'old_status': 'FAIL',
+                'new_status': 'FAIL'})
+    impact.add({'sensor_part_number': 'PN', 'stop_reason': test_engine.STOP_COMPLETED, 'old_status': 'FAIL',
+                'new_status': 'PASS'})
+    row, = impact.summary()
+    assert (row['tests'], row['fail_to_pass'], row['yield_change']) == (1, 1, 1.0)
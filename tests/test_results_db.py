@@ -0,0 +1,136 @@
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import results_db
+from log_histogram import LogHistogram
+from results_db import ResultsDatabase
+from results_store import ResultsWriter
+
+START = datetime(2026, 3, 1, 0, 0)
+# (part number, hours after START, average data rate, status) of the stored results
+RESULTS = [('PN-A', hours, 100.0 + hours % 7, 'FAIL' if hours % 5 == 0 else 'PASS')
+           for hours in range(0, 72, 3)] + [('PN-B', hours, 50.0 + hours, 'PASS') for hours in (1, 25, 49, 71)]
+
+
+def make_row(part, serial_number, start_time, rate, status):
+    return {'Test starting time': start_time, 'Sensor name': part, 'Sensor Serial Number': serial_number,
+            'Minimum Data Rate Limit': 90.0, 'Maximum Data Rate Limit': 110.0, 'Average data rate': rate,
+            'Maximum Standard Deviation Limit': 5.0, 'Standard Deviation': 1.0, 'Errors': 0,
+            'Test status': status, 'Test end time': start_time + timedelta(minutes=1),
+            'Stop reason': 'completed', 'Samples': 100}
+
+
+def make_histogram(rate):
+    histogram = LogHistogram()
+    histogram.update_batch(np.array([rate - 1.0, rate, rate + 1.0]))
+    return histogram
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = ResultsDatabase(str(tmp_path / 'results.sqlite'))
+    for number, (part, hours, rate, status) in enumerate(RESULTS):
+        assert database.insert_result(make_row(part, f"S{number}", START + timedelta(hours=hours), rate, status),
+                                      make_histogram(rate))
+    yield database
+    database.close()
+
+
+def expected(part=None, since=None, until=None):
+    # The stored results in the half-open time window [since, until)
+    return [(row_part, START + timedelta(hours=hours), rate, status) for row_part, hours, rate, status in RESULTS
+            if (part is None or row_part == part) and (since is None or START + timedelta(hours=hours) >= since)
+            and (until is None or START + timedelta(hours=hours) < until)]
+
+
+WINDOWS = [
+    (None, None),
+    (START + timedelta(days=1), None),
+    (None, START + timedelta(days=2)),
+    (START + timedelta(days=1), START + timedelta(days=2)),
+    # Windows that do not start and end at midnight
+    (START + timedelta(hours=4), START + timedelta(hours=49)),
+    (START + timedelta(hours=24, minutes=30), START + timedelta(days=3)),
+]
+
+
+@pytest.mark.parametrize('since, until', WINDOWS)
+def test_every_query_covers_the_same_half_open_window(database, since, until):
+    for part in ('PN-A', 'PN-B'):
+        rows = expected(part, since, until)
+        rates = [rate for _, _, rate, _ in rows]
+        assert [result['start_time'] for result in database.results(part, since=since, until=until)] == \
+            [start_time.isoformat(sep=' ', timespec='microseconds') for _, start_time, _, _ in rows]
+        assert sum(bucket['tests'] for bucket in database.trend(part=part, since=since, until=until)) == len(rows)
+        assert database.percentiles(part=part, since=since, until=until)['count'] == len(rows)
+        summary, = [summary for summary in database.yield_by_part(since=since, until=until)
+                    if summary['sensor_part_number'] == part]
+        assert summary['tests'] == len(rows)
+        assert summary['passed'] == sum(status == 'PASS' for _, _, _, status in rows)
+        assert summary['average_data_rate'] == pytest.approx(sum(rates) / len(rates))
+        assert (summary['data_rate_min'], summary['data_rate_max']) == (min(rates), max(rates))
+        distribution, = database.distribution(part, since, until)
+        assert (distribution['tests'], distribution['samples']) == (len(rows), 3 * len(rows))
+        assert distribution['min'] == pytest.approx(min(rates) - 1.0, rel=0.01)
+        assert distribution['max'] == pytest.approx(max(rates) + 1.0, rel=0.01)
+
+
+def test_dates_are_midnights(database):
+    day = database.yield_by_part('PN-B', since='2026-03-02', until='2026-03-03')
+    assert day[0]['tests'] == 1 and day[0]['data_rate_min'] == 75.0
+    assert database.yield_by_part('PN-B', since='2026-03-02', until='2026-03-02') == []
+
+
+def test_trend_buckets_and_yield(database):
+    days = database.trend('average_data_rate', 'day', part='PN-A')
+    assert [day['bucket'] for day in days] == ['2026-03-01', '2026-03-02', '2026-03-03']
+    assert [day['tests'] for day in days] == [8, 8, 8]
+    first_day = expected('PN-A', until=START + timedelta(days=1))
+    assert days[0]['yield'] == sum(status == 'PASS' for *_, status in first_day) / len(first_day)
+    with pytest.raises(ValueError):
+        database.trend('test_status; DROP TABLE results')
+
+
+def test_insert_is_idempotent_and_atomic(database):
+    row = make_row('PN-A', 'S0', START, 100.0, 'FAIL')
+    assert not database.insert_result(row, make_histogram(100.0))
+    assert database.yield_by_part('PN-A')[0]['tests'] == 24
+    # Windows without their maximum fail the insert, the result row is rolled back with them
+    broken_windows = {'start': [0.0], 'samples': [10], 'mean': [1.0], 'min': [1.0]}
+    with pytest.raises(KeyError):
+        database.insert_result(make_row('PN-C', 'S99', START, 100.0, 'PASS'), make_histogram(100.0),
+                               broken_windows)
+    assert database.results('PN-C') == []
+    assert database.distribution('PN-C') == []
+
+
+def test_windows_of_a_result(database):
+    windows = {'start': [0.0, 1.0], 'samples': [10, 12], 'mean': [99.0, 101.0], 'min': [98.0, 97.0],
+               'max': [100.0, 103.0]}
+    start_time = START + timedelta(days=5)
+    database.insert_result(make_row('PN-A', 'S0', start_time, 100.0, 'PASS'), None, windows)
+    assert [(window['start'], window['samples']) for window in database.windows('S0')] == [(0.0, 10), (1.0, 12)]
+    assert database.windows('S0', START) == []
+    assert database.windows('unknown') == []
+
+
+def test_rebuilt_aggregates_equal_the_incremental_ones(database):
+    before = database.yield_by_part(), database.distribution()
+    database.rebuild_aggregates()
+    assert (database.yield_by_part(), database.distribution()) == before
+
+
+def test_import_and_query_command_line(tmp_path, capsys):
+    csv_path = str(tmp_path / 'results.csv')
+    ResultsWriter(csv_path).append_rows([make_row('PN-A', f"S{hours}", START + timedelta(hours=hours), 100.0, 'PASS')
+                                         for hours in range(0, 48, 12)])
+    database_path = str(tmp_path / 'imported.sqlite')
+    assert results_db.main([database_path, 'import', csv_path]) == 0
+    assert results_db.main([database_path, 'import', csv_path]) == 0
+    assert "Imported 0 new rows" in capsys.readouterr().out
+    results_db.main([database_path, 'yield', '--since', '2026-03-01 12:00', '--until', '2026-03-02'])
+    summary, = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert summary['tests'] == 1
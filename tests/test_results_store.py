@@ -0,0 +1,110 @@
+import codecs
+import csv
+import subprocess
+import sys
+
+from conftest import ROOT
+from results_store import RESULT_COLUMNS, ResultsWriter
+
+
+def make_row(serial_number, status='PASS'):
+    return {'Test starting time': '2026-03-01 08:00:00', 'Sensor name': 'PN-TEST',
+            'Sensor Serial Number': serial_number, 'Average data rate': 100.0, 'Errors': 0,
+            'Test status': status, 'Stop reason': 'completed', 'Samples': 200}
+
+
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as file:
+        return list(csv.reader(file))
+
+
+def test_new_file_gets_the_header_and_appends_only_rows(tmp_path):
+    path = str(tmp_path / 'results.csv')
+    writer = ResultsWriter(path)
+    writer.append(make_row('S0'))
+    with open(path, 'rb') as file:
+        first_write = file.read()
+    writer.append_rows([make_row('S1'), make_row('S2', 'FAIL')])
+    with open(path, 'rb') as file:
+        content = file.read()
+    # The rows written before stay byte for byte as they are
+    assert content.startswith(first_write)
+    rows = read_rows(path)
+    assert rows[0] == RESULT_COLUMNS
+    assert [row[RESULT_COLUMNS.index('Sensor Serial Number')] for row in rows[1:]] == ['S0', 'S1', 'S2']
+    assert rows[3][RESULT_COLUMNS.index('Test status')] == 'FAIL'
+    # Columns the row does not have are left empty
+    assert rows[1][RESULT_COLUMNS.index('P1 data rate')] == ''
+
+
+def test_append_keeps_the_line_endings_and_ends_an_unfinished_line(tmp_path):
+    path = tmp_path / 'results.csv'
+    header = ','.join(RESULT_COLUMNS)
+    path.write_bytes(f"{header}\r\n2026-03-01,PN-TEST,S0".encode('utf-8'))
+    ResultsWriter(str(path)).append(make_row('S1'))
+    lines = path.read_bytes().split(b'\r\n')
+    assert lines[1] == b'2026-03-01,PN-TEST,S0'
+    assert lines[2].split(b',')[RESULT_COLUMNS.index('Sensor Serial Number')] == b'S1'
+    assert lines[3] == b''
+
+
+def test_concurrent_stations_do_not_lose_or_mix_rows(tmp_path):
+    # Several processes append to the same file at once, as stations sharing a network drive do
+    path = str(tmp_path / 'results.csv')
+    script = ("import sys; sys.path.insert(0, sys.argv[1]); from results_store import ResultsWriter\n"
+              "for index in range(50):\n"
+              "    ResultsWriter(sys.argv[2]).append({'Sensor Serial Number': f'{sys.argv[3]}-{index}',"
+              " 'Sensor name': 'x' * 2000})\n")
+    stations = [subprocess.Popen([sys.executable, '-c', script, ROOT, path, f"P{number}"]) for number in range(4)]
+    assert [station.wait() for station in stations] == [0] * 4
+    rows = read_rows(path)
+    assert rows[0] == RESULT_COLUMNS
+    assert all(len(row) == len(RESULT_COLUMNS) for row in rows[1:])
+    serial_numbers = sorted(row[RESULT_COLUMNS.index('Sensor Serial Number')] for row in rows[1:])
+    assert serial_numbers == sorted(f"P{number}-{index}" for number in range(4) for index in range(50))
+
+
+def test_import_csv_appends_the_rows_of_other_files(tmp_path):
+    sources = []
+    for number in range(2):
+        source = str(tmp_path / f'old{number}.csv')
+        ResultsWriter(source).append_rows([make_row(f"S{number}{index}") for index in range(3)])
+        sources.append(source)
+    target = str(tmp_path / 'results.csv')
+    assert ResultsWriter(target).import_csv(sources) == 6
+    rows = read_rows(target)
+    assert len(rows) == 7
+    assert rows[6][RESULT_COLUMNS.index('Sensor Serial Number')] == 'S12'
+
+
+def test_old_header_gets_the_new_columns(tmp_path, capsys):
+    # A file written before the stop reason, sample count and percentile columns existed
+    path = tmp_path / 'results.csv'
+    old_columns = RESULT_COLUMNS[:11]
+    old_row = '2026-03-01 08:00:00,PN-TEST,S0,90.0,110.0,100.0,5.0,1.0,0,PASS,2026-03-01 08:01:00'
+    path.write_bytes(codecs.BOM_UTF8 + f"{','.join(old_columns)}\r\n{old_row}\r\n".encode('utf-8'))
+    ResultsWriter(str(path)).append(dict(make_row('S1'), **{'P99 data rate': 104.5}))
+    assert "Added the columns Stop reason, Samples, P1 data rate, P99 data rate" in capsys.readouterr().out
+    content = path.read_bytes()
+    assert content.startswith(codecs.BOM_UTF8 + ','.join(RESULT_COLUMNS).encode('utf-8') + b'\r\n')
+    assert content.split(b'\r\n')[1] == old_row.encode('utf-8')
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        rows = list(csv.DictReader(file))
+    assert rows[0]['Sensor Serial Number'] == 'S0' and rows[0]['Samples'] is None
+    assert (rows[1]['Stop reason'], rows[1]['Samples'], rows[1]['P99 data rate']) == ('completed', '200', '104.5')
+    assert not (tmp_path / 'results.csv.bak').exists()
+    # The header is extended once
+    ResultsWriter(str(path)).append(make_row('S2'))
+    assert capsys.readouterr().out == ''
+    assert len(read_rows(str(path))) == 4
+
+
+def test_custom_columns_are_kept_in_their_order(tmp_path):
+    path = tmp_path / 'results.csv'
+    columns = ['Sensor Serial Number', 'Operator'] + [column for column in RESULT_COLUMNS
+                                                     if column != 'Sensor Serial Number']
+    path.write_text(','.join(columns) + '\n', encoding='utf-8')
+    ResultsWriter(str(path)).append(make_row('S1'))
+    rows = read_rows(str(path))
+    assert rows[0] == columns
+    assert rows[1][:2] == ['S1', '']
@@ -0,0 +1,31 @@
+import test_engine
+from conftest import feed
+from sample_store import SampleFileReader
+
+
+def soak_test(make_config, tmp_path, serial_number, trailing_errors):
+    # A soak test of 10 seconds whose samples end after 3 seconds, followed by an error line
+    # and `trailing_errors` other errors that have no row in the sample file
+    config = make_config(test_run_time=10, soak={'sample_dir': str(tmp_path / 'samples'), 'chunk_samples': 64})
+    session = test_engine.TestSession(config, serial_number)
+    session.start_sample_file()
+    feed(session, 0, 300)
+    session.feed_line("COMSERVER: link lost")
+    for _ in range(trailing_errors):
+        session.add_error()
+    session.elapsed = 10.0
+    result = session.finish()
+    return session.sample_file.path, result
+
+
+def test_breakdown_counts_the_errors_after_the_last_sample(make_config, tmp_path):
+    path, result = soak_test(make_config, tmp_path, 'SN2', trailing_errors=2)
+    reader = SampleFileReader(path)
+    stats, errors = reader.statistics()
+    assert errors == result.errors
+    assert stats['rx'].count == 300
+    rows = reader.breakdown(interval=1.0)
+    assert sum(row['samples'] for row in rows) == 300
+    assert sum(row['errors'] for row in rows) == result.errors
+    # The errors after the last sample count in the second the test ended in
+    assert rows[-1]['interval'] == 10 and rows[-1]['samples'] == 0 and rows[-1]['errors'] == 3
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from spc import CHECK_CUSUM, CHECK_DROPOUT_SECONDS, CHECK_DROPOUTS, CHECK_EWMA, CHECK_RANGE, CHECK_XBAR, \
+    SpcMonitor, range_constants
+
+# 100 samples per second in batches of 10, i.e. 10 batches per one second window
+RATE, BATCH = 100, 10
+
+
+def monitor_of(means, std=2.0, seed=0, gaps=(), **options):
+    # Monitor fed with one window per entry of `means` (its true mean), no samples in `gaps`
+    monitor = SpcMonitor(dict({'window_seconds': 1.0}, **options))
+    rng = np.random.default_rng(seed)
+    for second, mean in enumerate(means):
+        if second in gaps:
+            continue
+        for batch in range(RATE // BATCH):
+            monitor.add(second + batch / (RATE // BATCH), rng.normal(mean, std, BATCH))
+    return monitor
+
+
+def alarms(summary):
+    return {check: values['alarms'] for check, values in summary['checks'].items()}
+
+
+def test_off_unless_configured(make_config):
+    assert SpcMonitor.from_config(make_config()) is None
+    assert SpcMonitor.from_config(make_config(spc=True)).window_seconds == 1.0
+    assert SpcMonitor.from_config(make_config(spc={'window_seconds': 0.5})).window_seconds == 0.5
+
+
+def test_range_constants_match_the_tables():
+    d2, d3 = range_constants([2, 5, 10, 25])
+    assert d2 == pytest.approx([1.128, 2.326, 3.078, 3.931], abs=2e-3)
+    assert d3 == pytest.approx([0.853, 0.864, 0.797, 0.708], abs=2e-3)
+    # Many different sizes are interpolated, close to the exact values
+    sizes = np.arange(2, 200)
+    d2, d3 = range_constants(sizes)
+    assert d2[98] == pytest.approx(range_constants([100])[0][0], rel=1e-3)
+
+
+def test_windows_hold_count_mean_min_and_max():
+    monitor = SpcMonitor({'window_seconds': 0.5})
+    monitor.add(0.1, np.array([1.0, 3.0]))
+    monitor.add(0.4, np.array([2.0]))
+    monitor.add(1.2, np.array([5.0, 7.0]))
+    windows = monitor.evaluate(1.5)['windows']
+    assert windows == {'start': [0.0, 1.0], 'samples': [3, 2], 'mean': [2.0, 6.0], 'min': [1.0, 5.0],
+                       'max': [3.0, 7.0]}
+
+
+def test_stable_process_raises_no_alarms():
+    summary = monitor_of([100.0] * 300).evaluate(300)
+    assert summary['sigma'] == pytest.approx(2.0, rel=0.03)
+    assert summary['center'] == pytest.approx(100.0, abs=0.05)
+    counts = alarms(summary)
+    # 3 sigma limits: about 0.3 % false alarms per window
+    assert counts[CHECK_XBAR] <= 3 and counts[CHECK_RANGE] <= 3
+    assert counts[CHECK_CUSUM] == counts[CHECK_DROPOUTS] == 0
+    assert summary['passed']
+
+
+def test_mean_shift_is_found_by_the_xbar_chart():
+    summary = monitor_of([100.0] * 100 + [103.0] * 10 + [100.0] * 100).evaluate(210)
+    assert alarms(summary)[CHECK_XBAR] >= 8
+
+
+def test_small_shift_is_found_by_cusum_and_ewma():
+    # The mean moves by one sigma of a window mean, the X-bar chart sees few of these windows
+    summary = monitor_of([100.0] * 100 + [100.2] * 200, target=100.0).evaluate(300)
+    counts = alarms(summary)
+    assert counts[CHECK_XBAR] <= 10
+    assert counts[CHECK_CUSUM] >= 10 and counts[CHECK_EWMA] >= 40
+
+
+def test_wider_spread_is_found_by_the_range_chart():
+    monitor = monitor_of([100.0] * 100)
+    rng = np.random.default_rng(1)
+    for second in range(100, 110):
+        monitor.add(second, rng.normal(100.0, 6.0, RATE))
+    assert alarms(monitor.evaluate(110))[CHECK_RANGE] >= 8
+
+
+def test_dropouts_and_their_longest_run():
+    monitor = monitor_of([100.0] * 20, gaps=(3, 10, 11, 12), min_window_samples=1, max_dropouts=3,
+                         max_dropout_seconds=5)
+    # The last window is not complete yet and not a dropout
+    summary = monitor.evaluate(20.5)
+    counts = alarms(summary)
+    assert (counts[CHECK_DROPOUTS], counts[CHECK_DROPOUT_SECONDS]) == (4, 3.0)
+    assert not summary['checks'][CHECK_DROPOUTS]['passed'] and summary['checks'][CHECK_DROPOUT_SECONDS]['passed']
+    assert not summary['passed']
+    # A test that stopped early has windows it never reached, they are not dropouts
+    assert alarms(monitor_of([100.0] * 5).evaluate(3.0))[CHECK_DROPOUTS] == 0
+
+
+def test_limits_decide_the_verdict():
+    means = [100.0] * 100 + [103.0] * 5 + [100.0] * 100
+    assert monitor_of(means).evaluate(205)['passed']
+    assert not monitor_of(means, max_xbar_violations=2).evaluate(205)['passed']
+    assert monitor_of(means, max_xbar_violations=20).evaluate(205)['passed']
+
+
+def test_no_samples():
+    summary = SpcMonitor({'max_dropouts': 0}).evaluate(2.0)
+    assert (summary['center'], summary['sigma']) == (None, None)
+    assert alarms(summary)[CHECK_DROPOUTS] == 2 and not summary['passed']
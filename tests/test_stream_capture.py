@@ -0,0 +1,54 @@
+import glob
+import os
+
+import test_engine
+from conftest import assert_same_result, simulator_command
+from multi_channel import Channel, MultiChannelOrchestrator
+from stream_capture import CaptureReader, replay_capture
+
+
+def test_capture_has_the_live_output(recorded_test):
+    path, live = recorded_test
+    capture = CaptureReader(path)
+    records = list(capture)
+    assert capture.metadata['serial_number'] == 'SIM-1'
+    assert capture.end['stop_reason'] == live['stop_reason']
+    assert {stream for _, stream, _ in records} == {'stdout', 'stderr'}
+    timestamps = [timestamp for timestamp, _, _ in records]
+    assert timestamps == sorted(timestamps)
+
+
+def test_replay_reproduces_the_live_result(recorded_test):
+    path, live = recorded_test
+    assert live['samples'] > 300
+    # A live test puts a batch into the SPC window of when it was evaluated, a replay into the
+    # one of when it was read, so only the sample counts of the windows add up the same
+    assert_same_result(replay_capture(path).to_dict(), live, same_windows=False)
+
+
+def test_replay_reproduces_every_channel_of_a_multi_channel_test(make_config, tmp_path):
+    capture_dir = tmp_path / 'captures'
+    config = make_config(test_run_time=1, capture_dir=str(capture_dir))
+    channels = [Channel(f"Port {number}", simulator_command('--rate', '500', '--seed', str(number)))
+                for number in range(2)]
+    orchestrator = MultiChannelOrchestrator(config, channels, save_results=False)
+    orchestrator.start()
+    try:
+        # Tests started right after the COMSERVERs, and again while they are printing
+        results = orchestrator.run_test(['S0', 'S1']) + orchestrator.run_test(['S2', 'S3'])
+    finally:
+        orchestrator.stop()
+    for result in results:
+        path, = glob.glob(str(capture_dir / f"{result.serial_number}_*"))
+        assert result.samples > 100
+        assert_same_result(replay_capture(path).to_dict(), result.to_dict())
+
+
+def test_truncated_capture_replays_up_to_its_last_record(recorded_test, tmp_path):
+    path, live = recorded_test
+    truncated_path = str(tmp_path / os.path.basename(path))
+    with open(path, 'rb') as source, open(truncated_path, 'wb') as target:
+        target.write(source.read(os.path.getsize(path) // 2))
+    result = replay_capture(truncated_path)
+    assert 0 < result.samples < live['samples']
+    assert result.stop_reason == test_engine.STOP_COMPLETED
@@ -0,0 +1,72 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+from streaming_stats import SMALL_BATCH_SIZE, StreamingStats
+
+# Batch sizes around the switch between the value by value and the NumPy path
+BATCH_SIZES = [1, 3, SMALL_BATCH_SIZE - 1, SMALL_BATCH_SIZE, SMALL_BATCH_SIZE + 1, 500, 7, 2000]
+
+
+def batches(offset=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    return [offset + rng.normal(0.0, 2.0, size) for size in BATCH_SIZES]
+
+
+@pytest.mark.parametrize('offset', [0.0, 100.0, 1e9])
+def test_update_batch_matches_numpy(offset):
+    # A large offset makes a naive sum of squares lose every digit of the variance
+    stats = StreamingStats()
+    for batch in batches(offset):
+        stats.update_batch(batch)
+    values = np.concatenate(batches(offset))
+    assert stats.count == values.size
+    assert stats.mean == pytest.approx(values.mean(), rel=1e-12)
+    assert stats.std_dev == pytest.approx(values.std(), rel=1e-6)
+    assert (stats.min, stats.max) == (values.min(), values.max())
+
+
+def test_skip_nan_ignores_missing_values():
+    stats = StreamingStats()
+    for batch in batches():
+        batch[::4] = np.nan
+        stats.update_batch(batch, skip_nan=True)
+    expected = np.concatenate([np.delete(batch, np.s_[::4]) for batch in batches()])
+    assert stats.count == expected.size
+    assert stats.mean == pytest.approx(expected.mean(), rel=1e-12)
+    assert stats.std_dev == pytest.approx(expected.std(), rel=1e-9)
+
+
+def test_merge_equals_one_stream():
+    merged = StreamingStats()
+    for batch in batches(50.0):
+        part = StreamingStats()
+        part.update_batch(batch)
+        merged.merge(part)
+    single = StreamingStats()
+    single.update_batch(np.concatenate(batches(50.0)))
+    assert merged.count == single.count
+    assert merged.mean == pytest.approx(single.mean, rel=1e-12)
+    assert merged.std_dev == pytest.approx(single.std_dev, rel=1e-9)
+
+
+def test_checkpoint_round_trip():
+    stats = StreamingStats(window_size=10)
+    for batch in batches():
+        stats.update_batch(batch)
+    restored = StreamingStats(window_size=10)
+    restored.restore(json.loads(json.dumps(stats.checkpoint_state())))
+    assert restored.snapshot() == stats.snapshot()
+    restored.update_batch(np.arange(40.0))
+    stats.update_batch(np.arange(40.0))
+    assert restored.snapshot() == stats.snapshot()
+
+
+def test_empty_stats():
+    stats = StreamingStats()
+    stats.update_batch(np.full(SMALL_BATCH_SIZE * 2, np.nan), skip_nan=True)
+    assert stats.count == 0
+    assert stats.std_dev == 0.0
+    assert math.isinf(stats.min)
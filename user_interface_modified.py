@@ -1,18 +1,39 @@
-import os
+import importlib
 import threading
-from datetime import datetime, timedelta
 import sys
 import json
-import subprocess
-import re
+import math
 import time
-import pandas as pd
-from pandas.errors import EmptyDataError
-import signal
 
-import numpy as np
+# The setup window only needs PyQt5. The acquisition, plot and multi-channel modules (and
+# NumPy behind them) are imported where they are used, and preloaded in the background once
+# the setup window is painted, so the first window comes up without waiting for them.
+from PyQt5.QtCore import QMetaObject, QObject, Qt, QThread, QTimer, pyqtSignal, pyqtSlot
 from PyQt5.QtWidgets import QApplication, QMessageBox, QWidget, QLabel, QLineEdit, QPushButton, QVBoxLayout, \
-    QHBoxLayout, QFileDialog
+    QHBoxLayout, QFileDialog, QGridLayout
+
+# Interval of the sensor connection check in milliseconds
+MONITOR_INTERVAL_MS = 100
+# Lines the connection monitor keeps between two checks, older ones are dropped
+MONITOR_QUEUE_SIZE = 10_000
+# Modules imported by a background thread after the setup window was painted
+PRELOAD_MODULES = ('numpy', 'test_engine', 'comserver_manager', 'sample_buffer', 'rate_plot', 'multi_channel')
+
+
+def preload_modules(module_names=PRELOAD_MODULES):
+    # Imports the modules a test needs ahead of time. The import system locks every module
+    # while it is imported, so a window that needs one of them early simply waits for it.
+    for module_name in module_names:
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            print(f"An error occurred while preloading {module_name}: {e}")
+
+
+def start_preload():
+    preload_thread = threading.Thread(target=preload_modules, daemon=True)
+    preload_thread.start()
+    return preload_thread
 
 
 class TestSetupWindow(QWidget):
@@ -23,14 +44,33 @@ class TestSetupWindow(QWidget):
         self.min_data_rate_limit = None
         self.max_data_rate_limit = None
         self.max_std_dev_limit = None
+        self.min_p1_data_rate_limit = None
+        self.min_p99_data_rate_limit = None
         self.test_run_time = None
         self.comserver_path = None
         self.test_result_path = None
+        # Imported configuration keys without an input field (channels, capture_dir, ...)
+        self.options = {}
 
         self.output_window = None
+        self.multi_channel_window = None
+        self.preload_thread = None  # Started after the first paint
+        # Connected once here rather than by every output window, which would leave the
+        # connections of replaced windows behind
+        QApplication.instance().aboutToQuit.connect(self.shutdown_windows)
 
         self.init_ui()
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.preload_thread is None:
+            # Start once the event loop is idle again, i.e. after the window is on screen
+            self.preload_thread = False
+            QTimer.singleShot(0, self.preload)
+
+    def preload(self):
+        self.preload_thread = start_preload()
+
     def init_ui(self):
         layout = QVBoxLayout()
 
@@ -50,6 +90,9 @@ class TestSetupWindow(QWidget):
         layout.addLayout(self.create_input_layout("Minimum Data Rate Limit :", "min_data_rate_limit", "MB/s"))
         layout.addLayout(self.create_input_layout("Maximum Data Rate Limit :", "max_data_rate_limit", "MB/s"))
         layout.addLayout(self.create_input_layout("Maximum Standard Deviation Limit:", "max_std_dev_limit"))
+        # Optional floors of the data rate percentiles, left empty to not check them
+        layout.addLayout(self.create_input_layout("P1 Data Rate Floor:", "min_p1_data_rate_limit", "MB/s"))
+        layout.addLayout(self.create_input_layout("P99 Data Rate Floor:", "min_p99_data_rate_limit", "MB/s"))
         layout.addLayout(self.create_input_layout("Test Run Time:", "test_run_time", "s"))
         layout.addLayout(self.create_input_browse_path_layout("COMSERVER Path:", "comserver_path"))
         layout.addLayout(self.create_output_browse_path_layout("Test Result Path:", "test_result_path"))
@@ -57,12 +100,17 @@ class TestSetupWindow(QWidget):
         # Start Button
         start_button = QPushButton("Next", self)
         start_button.clicked.connect(self.next_window)
-        layout.addWidget(start_button)
+        multi_channel_button = QPushButton("Multi-Channel Test", self)
+        multi_channel_button.clicked.connect(self.open_multi_channel_window)
+        next_button_layout = QHBoxLayout()
+        next_button_layout.addWidget(start_button)
+        next_button_layout.addWidget(multi_channel_button)
+        layout.addLayout(next_button_layout)
 
         self.setLayout(layout)
         self.setWindowTitle("Test Parameter Setup Window")
         # Set fixed width and height for the window (adjust the values as needed)
-        self.setFixedSize(700, 500)
+        self.setFixedSize(700, 560)
         self.show()
 
     def create_input_layout(self, label_text, attribute_name, post_label_text=""):
@@ -121,12 +169,17 @@ class TestSetupWindow(QWidget):
         self.min_data_rate_limit = float(self.min_data_rate_limit_entry.text())
         self.max_data_rate_limit = float(self.max_data_rate_limit_entry.text())
         self.max_std_dev_limit = float(self.max_std_dev_limit_entry.text())
+        self.min_p1_data_rate_limit = self.min_p1_data_rate_limit_entry.text()
+        self.min_p99_data_rate_limit = self.min_p99_data_rate_limit_entry.text()
         self.test_run_time = int(self.test_run_time_entry.text())
         self.comserver_path = self.comserver_path_entry.text()
         self.test_result_path = self.test_result_path_entry.text()
         if self.output_window:
-            if self.output_window.comserver_process and self.output_window.comserver_process.poll() is None:
-                self.output_window.stop_comserver()
+            # The test thread of the old window must be finished before the window is destroyed.
+            # Shutting down also stops a warm standby COMSERVER of the old window.
+            self.output_window.stop_test_thread()
+            self.output_window.shutdown_comserver()
+            self.output_window.close()
             self.output_window = None
         # Open the output window
         self.output_window = TestOutputWindow(self)
@@ -134,6 +187,25 @@ class TestSetupWindow(QWidget):
 
         # Perform any other actions needed to start the test
 
+    def shutdown_windows(self):
+        # Called when the application quits
+        if self.output_window:
+            self.output_window.stop_test_thread()
+            self.output_window.shutdown_comserver()
+        if self.multi_channel_window:
+            self.multi_channel_window.orchestrator.stop()
+
+    def open_multi_channel_window(self):
+        if not self.options.get("channels"):
+            QMessageBox.warning(self, "No Channels Configured",
+                                "Please import a configuration with a \"channels\" list to test several sensors.")
+            return
+        self.refresh_setup_window()
+        if self.multi_channel_window:
+            self.multi_channel_window.close()
+        self.multi_channel_window = MultiChannelWindow(self)
+        self.multi_channel_window.show()
+
     def refresh_setup_window(self):
         # Get values from input fields
         self.sensor_part_number = self.sensor_part_number_entry.text()
@@ -141,24 +213,36 @@ class TestSetupWindow(QWidget):
         self.max_data_rate_limit = float(self.max_data_rate_limit_entry.text())
         # self.min_std_dev_limit = float(self.min_std_dev_limit_entry.text())
         self.max_std_dev_limit = float(self.max_std_dev_limit_entry.text())
+        self.min_p1_data_rate_limit = self.min_p1_data_rate_limit_entry.text()
+        self.min_p99_data_rate_limit = self.min_p99_data_rate_limit_entry.text()
         self.test_run_time = int(self.test_run_time_entry.text())
         self.comserver_path = self.comserver_path_entry.text()
         self.test_result_path = self.test_result_path_entry.text()
 
+    def test_config(self):
+        from test_engine import TestConfig
+        return TestConfig(self.sensor_part_number, self.min_data_rate_limit, self.max_data_rate_limit,
+                          self.max_std_dev_limit, self.test_run_time, self.comserver_path, self.test_result_path,
+                          self.min_p1_data_rate_limit, self.min_p99_data_rate_limit, **self.options)
+
     def import_configuration(self):
         file_dialog = QFileDialog(self)
         file_path, _ = file_dialog.getOpenFileName(self, "Import Configuration", "", "JSON Files (*.json)")
         if file_path:
             with open(file_path, "r") as file:
                 data = json.load(file)
+                from test_engine import CONFIG_FIELDS
                 # Set values to input fields
                 self.sensor_part_number_entry.setText(data.get("sensor_part_number", ""))
                 self.min_data_rate_limit_entry.setText(str(data.get("min_data_rate_limit", "")))
                 self.max_data_rate_limit_entry.setText(str(data.get("max_data_rate_limit", "")))
                 self.max_std_dev_limit_entry.setText(str(data.get("max_std_dev_limit", "")))
+                self.min_p1_data_rate_limit_entry.setText(str(data.get("min_p1_data_rate_limit") or ""))
+                self.min_p99_data_rate_limit_entry.setText(str(data.get("min_p99_data_rate_limit") or ""))
                 self.test_run_time_entry.setText(str(data.get("test_run_time", "")))
                 self.comserver_path_entry.setText(str(data.get("comserver_path", "")))
                 self.test_result_path_entry.setText(str(data.get("test_result_path", "")))
+                self.options = {key: value for key, value in data.items() if key not in CONFIG_FIELDS}
 
     def export_configuration(self):
         file_dialog = QFileDialog(self)
@@ -173,6 +257,11 @@ class TestSetupWindow(QWidget):
                 "comserver_path": self.comserver_path_entry.text(),
                 "test_result_path": self.test_result_path_entry.text()
             }
+            for name in ("min_p1_data_rate_limit", "min_p99_data_rate_limit"):
+                entry = getattr(self, name + "_entry")
+                if entry.text():
+                    data[name] = float(entry.text())
+            data.update(self.options)
             with open(file_path, "w") as file:
                 json.dump(data, file)
 
@@ -195,6 +284,62 @@ class TestSetupWindow(QWidget):
             self.test_result_path_entry.setText(output_path)
 
 
+class TestWorker(QObject):
+    # Runs one test acquisition off the GUI thread and reports through signals
+    progress = pyqtSignal(dict)
+    finished = pyqtSignal(dict)
+
+    def __init__(self, config, subscription, serial_number, sample_buffer=None, resume_state=None,
+                 comserver_manager=None):
+        from metrics import TestMetrics
+        super().__init__()
+        self.config = config
+        self.subscription = subscription  # Lines of the COMSERVER from the test start on
+        self.serial_number = serial_number
+        self.sample_buffer = sample_buffer
+        self.resume_state = resume_state  # Checkpoint of an interrupted test to resume
+        self.comserver_manager = comserver_manager  # For the COMSERVER startup latency in the metrics
+        self.metrics = TestMetrics()  # The GUI adds its update latency while the test runs
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    @pyqtSlot()
+    def run(self):
+        from test_engine import TestSession, export_metrics, record_result, run_test
+        # Progress signals are throttled by run_test so fast streams cannot flood the event loop
+        try:
+            session = None
+            if self.resume_state is not None:
+                # A resumed test goes on with the configuration it was started with
+                session = TestSession.from_checkpoint(self.resume_state, self.sample_buffer, self.metrics)
+                self.config = session.config
+            result = run_test(self.config, self.serial_number, self.subscription, self._cancel_event,
+                              self.progress.emit, sample_buffer=self.sample_buffer, metrics=self.metrics,
+                              session=session)
+        except Exception as e:
+            print(f"An error occurred while running the test: {e}")
+            # The window has to get the Start button back either way
+            self.finished.emit({'cancelled': True, 'failed': True, 'error': str(e)})
+            return
+        finally:
+            self.subscription.close()
+        if self.comserver_manager is not None:
+            result.metrics.add_comserver(self.comserver_manager.metrics())
+        try:
+            if not result.cancelled:
+                record_result(self.config, result)
+            else:
+                export_metrics(self.config, result)
+                result.discard_checkpoint()
+        except Exception as e:
+            print(f"An error occurred while saving the test result: {e}")
+        data = result.to_dict()
+        data['cancelled'] = result.cancelled
+        self.finished.emit(data)
+
+
 class TestOutputWindow(QWidget):
     def __init__(self, setup_window):
         super().__init__()
@@ -214,10 +359,59 @@ class TestOutputWindow(QWidget):
         self.start_comserver_button = None
         self.stop_comserver_button = None
 
+        self.comserver_manager = None  # Starts, restarts and stops the COMSERVER process
         self.comserver_process = None  # To store the process
+        self.comserver_demux = None  # Reads the process pipes and publishes the lines
+        self.monitor_subscription = None  # Lines for the sensor connection check
         self.comserver_running = False
+        self.sensor_connected = None
+        self.last_sensor_line_time = 0.0
+        self.monitor_timer = QTimer(self)
+        self.monitor_timer.setInterval(MONITOR_INTERVAL_MS)
+        self.monitor_timer.timeout.connect(self.monitor_comserver)
+
+        # Tests run on one long-lived worker thread
+        self.test_thread = QThread(self)
+        self.test_thread.start()
+        self.test_worker = None  # Worker of the running test
+
+        from sample_buffer import SampleRingBuffer
+        self.sample_buffer = SampleRingBuffer()  # rx values of the running test for the plot
+        self.rate_plot = None
+        self.resume_state = None  # Checkpoint of the interrupted test the next start resumes
 
         self.init_ui()
+        QTimer.singleShot(0, self.offer_interrupted_tests)
+
+    def offer_interrupted_tests(self):
+        # Tests that did not end normally (crash of the GUI, COMSERVER or PC) can be resumed,
+        # finalized with what they measured until their last checkpoint, or discarded
+        config = self.setup_window.test_config()
+        if not config.options.get("checkpoint"):
+            return
+        from checkpoint import checkpoint_dir, discard_checkpoint, finalize_checkpoint, interrupted_tests
+        for path, state in interrupted_tests(checkpoint_dir(config)):
+            box = QMessageBox(self)
+            box.setWindowTitle("Interrupted Test")
+            box.setText(f"The test of {state['serial_number']} started at {state['start_time']} was interrupted "
+                        f"after {state['elapsed']:.0f} of {state['config']['test_run_time']} s.")
+            # Only one test can be waiting to be resumed
+            resume_button = box.addButton("Resume", QMessageBox.AcceptRole) if self.resume_state is None else None
+            finalize_button = box.addButton("Finalize", QMessageBox.ActionRole)
+            discard_button = box.addButton("Discard", QMessageBox.DestructiveRole)
+            box.addButton("Later", QMessageBox.RejectRole)
+            box.exec_()
+            clicked = box.clickedButton()
+            try:
+                if resume_button is not None and clicked is resume_button:
+                    self.resume_state = state
+                    self.a2c_number_input.setText(state['serial_number'])
+                elif clicked is finalize_button:
+                    finalize_checkpoint(path)
+                elif clicked is discard_button:
+                    discard_checkpoint(path)
+            except Exception as e:
+                print(f"An error occurred while handling the interrupted test {path}: {e}")
 
     def change_button_color(self):
         if not self.comserver_running:
@@ -273,12 +467,18 @@ class TestOutputWindow(QWidget):
         self.errors_label = QLabel("Errors: 0", self)
         layout.addWidget(self.errors_label)
 
-        self.is_button_clicked = False
+        self.percentiles_label = QLabel("Data Rate P1 / P99: - / - MB/s", self)
+        layout.addWidget(self.percentiles_label)
+
+        from rate_plot import RatePlotWidget
+        self.rate_plot = RatePlotWidget(self)
+        self.rate_plot.set_buffer(self.sample_buffer)
+        layout.addWidget(self.rate_plot)
+
         # Buttons to Start test
         self.start_button = QPushButton("Start Test", self)
         self.start_button.clicked.connect(self.start_test)
         self.start_button.pressed.connect(self.change_button_color)
-        self.start_button.released.connect(self.restore_button_color)
 
         start_button_layout = QHBoxLayout()
         start_button_layout.addWidget(self.start_button)
@@ -301,70 +501,11 @@ class TestOutputWindow(QWidget):
         self.setWindowTitle("Test Output Window")
 
         # Set fixed width and height for the window (adjust the values as needed)
-        self.setFixedSize(600, 400)
+        self.setFixedSize(600, 600)
 
     def extract_value(self, line):
-        # Define a regular expression pattern to match the desired value
-        pattern = r'rx=(\d+\.\d+) MB/s'
-
-        # Use re.search to find the pattern in the line
-        match = re.search(pattern, line)
-
-        # If a match is found, extract the value
-        if match:
-            return match.group(1)
-        else:
-            return None
-
-    def is_csv_file_empty(self, file_path):
-        try:
-            df = pd.read_csv(file_path)
-            if len(df) == 0:
-                return True
-            else:
-                return False
-        except EmptyDataError:
-            return True
-
-    def update_excel(self, excel_file, Test_starting_time, Sensor_name, A2C_number, Minimum_Data_Rate_Limit,
-                     Maximum_Data_Rate_Limit, Average_data_rate,
-                     Maximum_Standard_Deviation_Limit, Standard_Deviation, Errors, Test_status,
-                     Test_end_time):
-        is_empty = self.is_csv_file_empty(excel_file)
-        # Load the Excel file into a Pandas DataFrame
-        if is_empty:
-            # creating empty dataframe
-            df_updated = pd.DataFrame({'Test starting time': [Test_starting_time], 'Sensor name': [''],
-                                       'Sensor Serial Number': [''], 'Minimum Data Rate Limit': [''],
-                                       'Maximum Data Rate Limit': [''], 'Average data rate': [''],
-                                       'Maximum Standard Deviation Limit': [''], 'Standard Deviation': [''],
-                                       'Errors': [''], 'Test status': [''], 'Test end time': [Test_end_time]})
-        else:
-            df = pd.read_csv(excel_file)
-
-        # Create a new DataFrame with the new data to be inserted
-        new_data = {'Test starting time': [Test_starting_time],
-                    'Sensor name': [Sensor_name],
-                    'Sensor Serial Number': [A2C_number],
-                    'Minimum Data Rate Limit': [Minimum_Data_Rate_Limit],
-                    'Maximum Data Rate Limit': [Maximum_Data_Rate_Limit],
-                    'Average data rate': [Average_data_rate],
-                    'Maximum Standard Deviation Limit': [Maximum_Standard_Deviation_Limit],
-                    'Standard Deviation': [Standard_Deviation],
-                    'Errors': [Errors],
-                    'Test status': [Test_status],
-                    'Test end time': [Test_end_time]
-                    }
-        df_new = pd.DataFrame(new_data)
-        if is_empty:
-            # Append the new data to the empty DataFrame
-            df_updated.update(df_new)
-        else:
-            # Append the new data to the existing DataFrame
-            df_updated = pd.concat([df, df_new], ignore_index=True)
-
-        # Save the updated DataFrame to the Excel file
-        df_updated.to_csv(excel_file, index=False)
+        from test_engine import extract_value
+        return extract_value(line)
 
     def refresh_data(self):
         # Update labels with the latest data from setup window
@@ -387,71 +528,68 @@ class TestOutputWindow(QWidget):
         # if not a2c_number:
         #     QMessageBox.warning(self, "Sensor Serial Number Not Filled", "Please enter the Sensor Serial Number before starting the test.")
         #     return
-        self.is_button_clicked = True
-        # Refresh data from the setup window
-        # self.setup_window.refresh_setup_window()
-        # # self.refresh_data()
-
-        startTime = datetime.now()
-        currTime = time.time()
-        test_run_time_label = self.setup_window.test_run_time
+        # The pressed handler already warned the user if the test cannot start
+        if self.test_worker is not None or not self.comserver_running or not self.a2c_number_input.text().strip():
+            return
+        self.start_button.setEnabled(False)
         self.test_run_time_label.setText(f"Test Run Time: {self.setup_window.test_run_time} s")
-        endTime = startTime + timedelta(seconds=self.setup_window.test_run_time)
-        errors_warnings = 0
-        iteration = 0
-        sum_of_data_rate = 0.0
-        rx_value_list = []
-        average_data_rate = 0
-        standard_deviation = 0
-        Test_status = ''
-        previous_line = ''
-        same_line_cnt = 0
-        while datetime.now() < endTime and self.comserver_process:
-            fd = self.comserver_process.stdout.fileno()
-            os.set_blocking(fd, False)
-            fe = self.comserver_process.stderr.fileno()
-            os.set_blocking(fe, False)
-            output_line = self.comserver_process.stderr.readline()
-            if output_line == '':
-                # time.sleep(4)
-                counter = 0
-                while output_line == '' and datetime.now() < endTime:
-                    output_line = self.comserver_process.stdout.readline()
-                    if output_line == '':
-                        counter += 1
-                        output_line = self.comserver_process.stderr.readline()
-                        # if counter>300000:
-                        #     errors_warnings += 1
-                        #     break
-                    else:
-                        break
-
-            if previous_line != output_line and len(output_line) > 3:
-                previous_line = output_line
-                test_run_time_label -= 1  # Decrease the variable
-                # currTime = time.time()  # Reset the start time
-                # self.test_run_time_label.setText(f"Test Run Time: {test_run_time_label} s")
-                if output_line == '' and self.comserver_process.poll() is not None:
-                    errors_warnings += 1
-                    # break
-                if output_line:
-                    rx_value = self.extract_value(output_line)
-                    if rx_value is not None:
-                        iteration += 1
-                        sum_of_data_rate += float(rx_value)
-                        rx_value_list.append(float(rx_value))
-                    else:
-                        errors_warnings += 1
-                        # break
-            else:
-                same_line_cnt += 1
-                if same_line_cnt > 1:
-                    errors_warnings += 1
-                    # break
-
-        if iteration > 0:
-            average_data_rate = sum_of_data_rate / iteration
-            standard_deviation = np.std(rx_value_list)
+        self.sample_buffer.clear()
+        self.rate_plot.set_limits(self.setup_window.min_data_rate_limit, self.setup_window.max_data_rate_limit)
+        self.rate_plot.set_time_range(self.setup_window.test_run_time)
+        self.rate_plot.start()
+
+        # Acquisition runs on the worker thread, this thread only renders its signals. The test
+        # subscribes to the COMSERVER lines here, so it gets every line from now on.
+        # The interrupted test chosen to be resumed, if its serial number is still the one entered
+        resume_state = self.resume_state
+        if resume_state is not None and resume_state['serial_number'] != self.a2c_number_input.text().strip():
+            resume_state = None
+        self.resume_state = None
+        self.test_worker = TestWorker(self.setup_window.test_config(), self.comserver_demux.subscribe(),
+                                      self.a2c_number_input.text(), self.sample_buffer, resume_state,
+                                      self.comserver_manager)
+        self.test_worker.moveToThread(self.test_thread)
+        self.test_worker.progress.connect(self.update_test_progress)
+        self.test_worker.finished.connect(self.test_finished)
+        QMetaObject.invokeMethod(self.test_worker, "run", Qt.QueuedConnection)
+
+    def cancel_test(self):
+        if self.test_worker is not None:
+            self.test_worker.cancel()
+
+    def update_test_progress(self, progress):
+        if self.test_worker is not None:
+            self.test_worker.metrics.add_gui_update(time.monotonic() - progress['time'])
+        remaining = max(0, math.ceil(self.setup_window.test_run_time - progress['elapsed']))
+        self.test_run_time_label.setText(f"Test Run Time: {remaining} s")
+        self.average_data_rate_label.setText(f"Average Data Rate: {round(progress['mean'], 2)} MB/s")
+        self.std_deviation_label.setText(f"Standard Deviation: {round(progress['std_dev'], 2)}")
+        self.errors_label.setText(f"Errors: {progress['errors']}")
+        self.test_output_label.setText(f"Test Output: Running... ({progress['samples']} samples)")
+
+    def test_finished(self, result):
+        self.test_worker.deleteLater()
+        self.test_worker = None
+        self.rate_plot.stop()
+        self.start_button.setEnabled(True)
+        self.restore_button_color()
+        self.test_run_time_label.setText(f"Test Run Time: {self.setup_window.test_run_time} s")
+
+        if result.get('failed'):
+            self.test_output_label.setText(f"Test Output: Error ({result['error']})")
+        elif result['cancelled']:
+            self.test_output_label.setText("Test Output: Cancelled")
+        else:
+            from test_engine import STOP_EARLY_FAIL, STOP_EARLY_PASS
+            if result['stop_reason'] in (STOP_EARLY_PASS, STOP_EARLY_FAIL):
+                self.test_run_time_label.setText(f"Test Run Time: decided early after {result['samples']} samples")
+            self.show_test_result(result)
+            self.a2c_number_input.clear()
+
+    def show_test_result(self, result):
+        average_data_rate = result['average_data_rate']
+        standard_deviation = result['standard_deviation']
+        errors_warnings = result['errors']
         if average_data_rate < self.setup_window.min_data_rate_limit or average_data_rate > self.setup_window.max_data_rate_limit:
             self.average_data_rate_label.setText(
                 f"Average Data Rate: <span style='color: red;'>{round(average_data_rate, 2)} MB/s</span>")
@@ -466,56 +604,60 @@ class TestOutputWindow(QWidget):
             self.errors_label.setText(f"Errors: <span style='color: red;'>{errors_warnings}</span>")
         else:
             self.errors_label.setText(f"Errors: {errors_warnings}")
-        if errors_warnings > 0 or average_data_rate < self.setup_window.min_data_rate_limit or average_data_rate > self.setup_window.max_data_rate_limit or standard_deviation > self.setup_window.max_std_dev_limit:
+        percentiles = []
+        for name, limit in (('p1', self.setup_window.min_p1_data_rate_limit),
+                            ('p99', self.setup_window.min_p99_data_rate_limit)):
+            value = result.get('percentiles', {}).get(name)
+            text = '-' if value is None else str(round(value, 2))
+            if value is not None and limit not in (None, '') and value < float(limit):
+                text = f"<span style='color: red;'>{text}</span>"
+            percentiles.append(text)
+        self.percentiles_label.setText(f"Data Rate P1 / P99: {percentiles[0]} / {percentiles[1]} MB/s")
+        failed_checks = [name for name, check in result.get('spc', {}).get('checks', {}).items()
+                         if not check['passed']]
+        if failed_checks:
+            # Name the SPC checks that failed the test
+            self.test_output_label.setText(f"<div style='padding: 5px;'>Test Output: <span style='background-color: "
+                                           f"red; color: black; font-weight: bold;'>FAIL</span> "
+                                           f"(SPC: {', '.join(failed_checks)})</div>")
+        elif result['test_status'] == 'FAIL':
             self.test_output_label.setText(f"<div style='padding: 5px;'>Test Output: <span style='background-color: "
                                            f"red; color: black; font-weight: bold;'>FAIL</span></div>")
-            result_msg = f"<div style='padding: 5px;'>Test Output: <span style='background-color: red; color: black; font-weight: bold;'>FAIL</span></div>"
-            Test_status = 'FAIL'
         else:
             self.test_output_label.setText(f"<div style='padding: 5px;'>Test Output: <span style='background-color: "
                                            f"green; color: black; font-weight: bold;'>PASS</span></div>")
-            result_msg = f"<div style='padding: 5px;'>Test Output: <span style='background-color: green; color: black; font-weight: bold;'>PASS</span></div>"
-            Test_status = 'PASS'
-        result_msg += f"Average Data Rate: {round(average_data_rate, 2)} MB/s<br>"
-        result_msg += f"Standard Deviation: {round(float(standard_deviation), 2)}<br>"
-        result_msg += f"Errors: {errors_warnings}\n\n"
-
-        self.update_excel(self.setup_window.test_result_path, startTime, self.setup_window.sensor_part_number,
-                          self.a2c_number_input.text(),
-                          self.setup_window.min_data_rate_limit,
-                          self.setup_window.max_data_rate_limit, round(average_data_rate, 2),
-                          self.setup_window.max_std_dev_limit, round(float(standard_deviation), 2), errors_warnings,
-                          Test_status,
-                          endTime)
-        self.is_button_clicked = False
-        self.a2c_number_input.clear()
-        self.start_thread_to_ignore_unnecessary_lines()
-
-    def run_loop(self):
-        counter = 0
-        fd = self.comserver_process.stdout.fileno()
-        os.set_blocking(fd, False)
-        fe = self.comserver_process.stderr.fileno()
-        os.set_blocking(fe, False)
-        while not self.is_button_clicked and self.comserver_running and self.comserver_process:
-            current_line = self.comserver_process.stdout.readline()
-            output_line = self.comserver_process.stderr.readline()
-            if len(current_line) < 42:
-                counter += 1
-            else:
-                counter = 0
-            time.sleep(0.1)
-            if counter > 20:
-                # self.comserver_status_label.setText("COMSERVER Status: Sensor not connected")
-                self.comserver_status_label.setText(
-                    "COMSERVER Status: <span style='color: #9C5700;'>Sensor not connected</span>")
-            else:
-                # self.comserver_status_label.setText("COMSERVER Status: Running")
-                self.comserver_status_label.setText("COMSERVER Status: <span style='color: green;'>Running</span>")
 
-    def start_thread_to_ignore_unnecessary_lines(self):
-        loop_thread = threading.Thread(target=self.run_loop)
-        loop_thread.start()
+    def closeEvent(self, event):
+        self.stop_test_thread()
+        super().closeEvent(event)
+
+    def stop_test_thread(self):
+        # Do not destroy the window while the worker thread is still reading
+        self.cancel_test()
+        self.test_thread.quit()
+        self.test_thread.wait()
+
+    def monitor_comserver(self):
+        # Runs on the GUI thread every MONITOR_INTERVAL_MS, tests read their own subscription
+        from multi_channel import SENSOR_LINE_MIN_LENGTH, SENSOR_TIMEOUT
+        if self.comserver_demux.eof:
+            self.comserver_exited()
+            return
+        for stream, current_line in self.monitor_subscription.read_lines(0):
+            if stream == 'stdout' and len(current_line) >= SENSOR_LINE_MIN_LENGTH:
+                self.last_sensor_line_time = time.monotonic()
+        # No sensor output for more than SENSOR_TIMEOUT seconds means the sensor is not connected
+        connected = time.monotonic() - self.last_sensor_line_time <= SENSOR_TIMEOUT
+        if connected == self.sensor_connected:
+            return
+        self.sensor_connected = connected
+        if not connected:
+            # self.comserver_status_label.setText("COMSERVER Status: Sensor not connected")
+            self.comserver_status_label.setText(
+                "COMSERVER Status: <span style='color: #9C5700;'>Sensor not connected</span>")
+        else:
+            # self.comserver_status_label.setText("COMSERVER Status: Running")
+            self.comserver_status_label.setText("COMSERVER Status: <span style='color: green;'>Running</span>")
 
     def start_comserver(self):
         try:
@@ -523,44 +665,209 @@ class TestOutputWindow(QWidget):
             if self.comserver_process and self.comserver_process.poll() is None:
                 # print("COMSERVER is already running.")
                 return
-            # Run the .bat file
-            self.comserver_process = subprocess.Popen(self.setup_window.comserver_path, stdout=subprocess.PIPE,
-                                                      stderr=subprocess.PIPE, shell=True, text=True,
-                                                      universal_newlines=True)
+            from comserver_manager import ComserverManager
+            config = self.setup_window.test_config()
+            if self.comserver_manager is None or self.comserver_manager.command != config.comserver_path:
+                if self.comserver_manager is not None:
+                    self.comserver_manager.shutdown()
+                self.comserver_manager = ComserverManager.from_config(config)
+            # Run the .bat file, or take over the warm standby
+            self.attach_comserver(self.comserver_manager.start())
             # self.comserver_status_label.setText("COMSERVER Status: Running")
             self.comserver_status_label.setText("COMSERVER Status: <span style='color: green;'>Running</span>")
             self.comserver_running = True
-            # Start the loop in a separate thread
-            self.start_thread_to_ignore_unnecessary_lines()
+            self.monitor_timer.start()
 
         except Exception as e:
             print(f"An error occurred: {e}")
 
+    def attach_comserver(self, instance):
+        self.comserver_process = instance.process
+        self.comserver_demux = instance.demux
+        # The monitor only needs recent lines, it may drop old ones instead of blocking the tests
+        self.monitor_subscription = self.comserver_demux.subscribe(MONITOR_QUEUE_SIZE, lossy=True)
+        self.sensor_connected = True
+        self.last_sensor_line_time = time.monotonic()
+
+    def comserver_exited(self):
+        # COMSERVER crashed or exited by itself, a running test ends with the exit as its stop reason
+        if self.comserver_manager.ensure_running():
+            self.monitor_subscription.close()
+            self.attach_comserver(self.comserver_manager.active)
+            self.comserver_status_label.setText(
+                "COMSERVER Status: <span style='color: #9C5700;'>Restarted</span>")
+        elif not self.comserver_manager.auto_restart:
+            self.stop_comserver_pressed()
+            self.stop_comserver()
+
     def stop_comserver_pressed(self):
         self.comserver_running = False
 
     def stop_comserver(self):
         # Stop the COMSERVER process if it's running
         # self.comserver_running = False
+        self.cancel_test()
         self.comserver_status_label.setText("COMSERVER Status: <span style='color: red;'>Not Running</span>")
 
-        if self.comserver_process:
-            try:
-                # Send the SIGTERM signal to request termination
-                # self.comserver_process.send_signal(signal.CTRL_C_EVENT)
-                # self.comserver_process.send_signal(signal.CTRL_C_EVENT)
-                # Terminate the process
-                subprocess.check_call(["taskkill", "/F", "/T", "/PID", str(self.comserver_process.pid)])
-                self.comserver_process = None
-            except Exception as e:
-                print(f"An error occurred while terminating the COMSERVER process gracefully: {e}")
-                try:
-                    # If SIGTERM fails, try sending a SIGKILL signal to forcefully terminate the process
-                    self.comserver_process.send_signal(signal.CTRL_BREAK_EVENT)
-                    # Wait for the process to terminate
-                    self.comserver_process.wait()
-                except Exception as e:
-                    print(f"An error occurred while forcefully terminating the COMSERVER process: {e}")
+        self.monitor_timer.stop()
+        if self.comserver_manager:
+            # Terminates the whole process group and spawns the warm standby if configured
+            self.comserver_manager.stop()
+        self.comserver_process = None
+        self.comserver_demux = None
+        self.monitor_subscription = None
+
+    def shutdown_comserver(self):
+        self.stop_comserver()
+        if self.comserver_manager:
+            self.comserver_manager.shutdown()
+            self.comserver_manager = None
+
+
+class MultiChannelSignals(QObject):
+    # Carries the orchestrator callbacks from its reactor thread to the GUI thread
+    progress = pyqtSignal(int, dict)
+    result = pyqtSignal(int, dict)
+    status = pyqtSignal(int, str)
+
+
+class MultiChannelWindow(QWidget):
+    # Status grid for testing every configured channel at the same time
+    def __init__(self, setup_window):
+        from multi_channel import MultiChannelOrchestrator, channels_from_config
+        super().__init__()
+
+        self.setup_window = setup_window
+        self.config = setup_window.test_config()
+        self.channels = channels_from_config(self.config)
+        self.orchestrator = MultiChannelOrchestrator(self.config, self.channels)
+        self.signals = MultiChannelSignals()
+        self.orchestrator.progress_callback = self.signals.progress.emit
+        self.orchestrator.result_callback = lambda index, result: self.signals.result.emit(index, result.to_dict())
+        self.orchestrator.status_callback = self.signals.status.emit
+        self.signals.progress.connect(self.update_channel_progress)
+        self.signals.result.connect(self.show_channel_result)
+        self.signals.status.connect(self.update_channel_status)
+
+        self.serial_number_inputs = []
+        self.status_labels = []
+        self.samples_labels = []
+        self.average_labels = []
+        self.std_deviation_labels = []
+        self.errors_labels = []
+        self.result_labels = []
+        self.pending_channels = set()
+
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+
+        self.start_comserver_button = QPushButton("Start Comservers", self)
+        self.start_comserver_button.clicked.connect(self.start_comservers)
+        self.stop_comserver_button = QPushButton("Stop Comservers", self)
+        self.stop_comserver_button.clicked.connect(self.stop_comservers)
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.start_comserver_button)
+        button_layout.addWidget(self.stop_comserver_button)
+        layout.addLayout(button_layout)
+
+        layout.addWidget(QLabel(f"Sensor Part Number: {self.config.sensor_part_number}", self))
+
+        grid = QGridLayout()
+        headers = ["Channel", "Sensor Serial Number", "COMSERVER Status", "Samples", "Average Data Rate",
+                   "Standard Deviation", "Errors", "Test Output"]
+        for column, header in enumerate(headers):
+            grid.addWidget(QLabel(f"<b>{header}</b>", self), 0, column)
+        for row, channel in enumerate(self.channels, start=1):
+            grid.addWidget(QLabel(channel.name, self), row, 0)
+            serial_number_input = QLineEdit(self)
+            serial_number_input.setPlaceholderText("Sensor Serial Number")
+            grid.addWidget(serial_number_input, row, 1)
+            self.serial_number_inputs.append(serial_number_input)
+            for column, (labels, text) in enumerate(((self.status_labels, "Not Running"), (self.samples_labels, "0"),
+                                                     (self.average_labels, "0 MB/s"),
+                                                     (self.std_deviation_labels, "0"), (self.errors_labels, "0"),
+                                                     (self.result_labels, "No Results")), start=2):
+                label = QLabel(text, self)
+                grid.addWidget(label, row, column)
+                labels.append(label)
+        layout.addLayout(grid)
+
+        self.start_button = QPushButton("Start Test", self)
+        self.start_button.clicked.connect(self.start_test)
+        layout.addWidget(self.start_button)
+
+        self.setLayout(layout)
+        self.setWindowTitle("Multi-Channel Test Window")
+
+    def start_comservers(self):
+        try:
+            self.orchestrator.start()
+        except Exception as e:
+            print(f"An error occurred: {e}")
+
+    def stop_comservers(self):
+        self.orchestrator.stop()
+        self.pending_channels.clear()
+        self.restore_start_button()
+        for label in self.status_labels:
+            label.setText("<span style='color: red;'>Not Running</span>")
+
+    def start_test(self):
+        if not self.orchestrator.running:
+            QMessageBox.warning(self, "COMSERVER Not Running", "Please start COMSERVER before starting the test.")
+            return
+        serial_numbers = [serial_number_input.text().strip() for serial_number_input in self.serial_number_inputs]
+        if not any(serial_numbers):
+            QMessageBox.warning(self, "Sensor Serial Number Not Filled",
+                                "Please enter at least one Sensor Serial Number before starting the test.")
+            return
+        self.pending_channels = set(self.orchestrator.start_test(serial_numbers))
+        if not self.pending_channels:
+            return
+        self.start_button.setEnabled(False)
+        self.start_button.setStyleSheet("background-color: green;")
+        self.start_button.setText("Running...")
+        for index in self.pending_channels:
+            self.result_labels[index].setText("Running...")
+
+    def restore_start_button(self):
+        self.start_button.setEnabled(True)
+        self.start_button.setStyleSheet("")
+        self.start_button.setText("Start Test")
+
+    def update_channel_status(self, index, status):
+        from multi_channel import STATUS_NOT_CONNECTED, STATUS_RUNNING
+        color = {STATUS_RUNNING: 'green', STATUS_NOT_CONNECTED: '#9C5700'}.get(status, 'red')
+        self.status_labels[index].setText(f"<span style='color: {color};'>{status}</span>")
+
+    def update_channel_progress(self, index, progress):
+        self.samples_labels[index].setText(str(progress['samples']))
+        self.average_labels[index].setText(f"{round(progress['mean'], 2)} MB/s")
+        self.std_deviation_labels[index].setText(str(round(progress['std_dev'], 2)))
+        self.errors_labels[index].setText(str(progress['errors']))
+
+    def show_channel_result(self, index, result):
+        self.samples_labels[index].setText(str(result['samples']))
+        self.average_labels[index].setText(f"{round(result['average_data_rate'], 2)} MB/s")
+        self.std_deviation_labels[index].setText(str(round(result['standard_deviation'], 2)))
+        self.errors_labels[index].setText(str(result['errors']))
+        from test_engine import STOP_CANCELLED
+        if result['stop_reason'] == STOP_CANCELLED:
+            self.result_labels[index].setText("Cancelled")
+        else:
+            color = 'red' if result['test_status'] == 'FAIL' else 'green'
+            self.result_labels[index].setText(f"<span style='background-color: {color}; color: black; "
+                                              f"font-weight: bold;'>{result['test_status']}</span>")
+            self.serial_number_inputs[index].clear()
+        self.pending_channels.discard(index)
+        if not self.pending_channels:
+            self.restore_start_button()
+
+    def closeEvent(self, event):
+        self.orchestrator.stop()
+        super().closeEvent(event)
 
 
 if __name__ == '__main__':